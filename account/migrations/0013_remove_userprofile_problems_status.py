@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0012_userprofile_language'),
+        # 数据复制到 user_problem_status 之后再删除
+        ('problem', '0017_userproblemstatus'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='userprofile',
+            name='acm_problems_status',
+        ),
+        migrations.RemoveField(
+            model_name='userprofile',
+            name='oi_problems_status',
+        ),
+    ]
@@ -68,25 +68,7 @@ class User(AbstractBaseUser):
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
-    # acm_problems_status examples:
-    # {
-    #     "problems": {
-    #         "1": {
-    #             "status": JudgeStatus.ACCEPTED,
-    #             "_id": "1000"
-    #         }
-    #     },
-    #     "contest_problems": {
-    #         "1": {
-    #             "status": JudgeStatus.ACCEPTED,
-    #             "_id": "1000"
-    #         }
-    #     }
-    # }
-    acm_problems_status = JSONField(default=dict)
-    # like acm_problems_status, merely add "score" field
-    oi_problems_status = JSONField(default=dict)
-
+    # 用户在每个题目上的状态见 problem.models.UserProblemStatus
     real_name = models.TextField(null=True)
     avatar = models.TextField(default=f"{settings.AVATAR_URI_PREFIX}/default.png")
     blog = models.URLField(null=True)
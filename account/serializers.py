@@ -1,5 +1,6 @@
 from django import forms
 
+from problem.models import ProblemRuleType, UserProblemStatus
 from utils.api import serializers, UsernameSerializer
 
 from .models import AdminType, ProblemPermission, User, UserProfile
@@ -70,6 +71,8 @@ class UserSerializer(serializers.ModelSerializer):
 class UserProfileSerializer(serializers.ModelSerializer):
     user = UserSerializer()
     real_name = serializers.SerializerMethodField()
+    acm_problems_status = serializers.SerializerMethodField()
+    oi_problems_status = serializers.SerializerMethodField()
 
     class Meta:
         model = UserProfile
@@ -82,6 +85,29 @@ class UserProfileSerializer(serializers.ModelSerializer):
     def get_real_name(self, obj):
         return obj.real_name if self.show_real_name else None
 
+    def _problems_status(self, obj):
+        """
+        按原来 JSON 字段的格式返回，两个字段共用一次查询
+        """
+        if not hasattr(self, "_problems_status_cache"):
+            ret = {ProblemRuleType.ACM: {}, ProblemRuleType.OI: {}}
+            for item in UserProblemStatus.objects.filter(user_id=obj.user_id) \
+                    .values("problem_id", "problem___id", "problem__rule_type", "contest_id", "status", "score"):
+                entries = ret[item["problem__rule_type"]].setdefault(
+                    "contest_problems" if item["contest_id"] else "problems", {})
+                entry = {"status": item["status"], "_id": item["problem___id"]}
+                if item["problem__rule_type"] == ProblemRuleType.OI:
+                    entry["score"] = item["score"]
+                entries[str(item["problem_id"])] = entry
+            self._problems_status_cache = ret
+        return self._problems_status_cache
+
+    def get_acm_problems_status(self, obj):
+        return self._problems_status(obj)[ProblemRuleType.ACM]
+
+    def get_oi_problems_status(self, obj):
+        return self._problems_status(obj)[ProblemRuleType.OI]
+
 
 class EditUserSerializer(serializers.Serializer):
     id = serializers.IntegerField()
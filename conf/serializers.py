@@ -1,3 +1,4 @@
+from judge.scheduling import SCHEDULE_POLICIES
 from utils.api import serializers
 
 from .models import JudgeServer
@@ -49,3 +50,13 @@ class JudgeServerHeartbeatSerializer(serializers.Serializer):
 class EditJudgeServerSerializer(serializers.Serializer):
     id = serializers.IntegerField()
     is_disabled = serializers.BooleanField()
+
+
+class EditJudgeSchedulePolicySerializer(serializers.Serializer):
+    policy = serializers.ChoiceField(choices=list(SCHEDULE_POLICIES.keys()))
+
+
+class EditJudgeAdmissionSerializer(serializers.Serializer):
+    user_in_flight_limit = serializers.IntegerField(min_value=0)
+    queue_soft_limit = serializers.IntegerField(min_value=0)
+    contest_exempt = serializers.BooleanField()
@@ -4,8 +4,12 @@ from unittest import mock
 from django.conf import settings
 from django.utils import timezone
 
-from options.options import SysOptions
+from judge.allocator import JudgeSlotAllocator
+from judge.registry import JudgeServerRegistry
+from options.options import SysOptions, language_registry
 from utils.api.tests import APITestCase
+from utils.cache import cache
+from utils.constants import CacheKey
 from .models import JudgeServer
 
 
@@ -82,6 +86,7 @@ class WebsiteConfigAPITest(APITestCase):
 
 class JudgeServerHeartbeatTest(APITestCase):
     def setUp(self):
+        cache.delete_many([f"{CacheKey.judge_server_registry}:testhostname", CacheKey.judge_server_registry])
         self.url = self.reverse("judge_server_heartbeat_api")
         self.data = {"hostname": "testhostname", "judger_version": "1.0.4", "cpu_core": 4,
                      "cpu": 90.5, "memory": 80.3, "action": "heartbeat", "service_url": "http://127.0.0.1"}
@@ -104,6 +109,15 @@ class JudgeServerHeartbeatTest(APITestCase):
         self.assertSuccess(resp)
         self.assertEqual(JudgeServer.objects.get(hostname=self.data["hostname"]).judger_version, data["judger_version"])
 
+    def test_heartbeat_is_persisted_periodically(self):
+        self.test_update_heartbeat()
+        data = dict(self.data, cpu=10.0)
+        resp = self.client.post(self.url, data=data, **self.headers)
+        self.assertSuccess(resp)
+        # 数据库中的记录要到 persist_interval 之后才更新, 在线状态以 redis 中的为准
+        self.assertEqual(JudgeServer.objects.get(hostname=self.data["hostname"]).cpu_usage, 90.5)
+        self.assertEqual(JudgeServerRegistry().live_status()[self.data["hostname"]].cpu_usage, 10.0)
+
 
 class JudgeServerAPITest(APITestCase):
     def setUp(self):
@@ -129,11 +143,86 @@ class JudgeServerAPITest(APITestCase):
         self.assertTrue(JudgeServer.objects.get(id=self.server.id).is_disabled)
 
 
+class JudgeSlotAllocatorTest(APITestCase):
+    def setUp(self):
+        self.allocator = JudgeSlotAllocator()
+        self.server = JudgeServer.objects.create(hostname="testhostname", judger_version="1.0.4", cpu_core=1,
+                                                 cpu_usage=90.5, memory_usage=80.3, last_heartbeat=timezone.now())
+        cache.delete_many([f"{CacheKey.judge_server_leases}:{self.server.id}", CacheKey.judge_server_registry])
+        JudgeServerRegistry().register(self.server)
+
+    def test_acquire_and_release(self):
+        lease = self.allocator.acquire()
+        self.assertEqual(lease.server.id, self.server.id)
+        self.assertEqual(self.allocator.acquire().server.id, self.server.id)
+        # cpu_core * 2 个槽位已全部占用
+        self.assertIsNone(self.allocator.acquire())
+        self.allocator.release(lease)
+        self.assertEqual(self.allocator.usage([self.server.id])[self.server.id], 1)
+
+    def test_expired_lease_is_reclaimed(self):
+        self.allocator.acquire(timeout=-1)
+        self.assertEqual(self.allocator.usage([self.server.id])[self.server.id], 0)
+        self.assertEqual(self.allocator.reap(self.server.id), 1)
+        self.allocator.acquire()
+        self.allocator.acquire(timeout=-1)
+        # 过期的租约在申请时也会被回收
+        self.assertIsNotNone(self.allocator.acquire())
+
+    def test_skip_disabled_and_abnormal_server(self):
+        registry = JudgeServerRegistry()
+        registry.update(self.server.hostname, is_disabled=True)
+        self.assertIsNone(self.allocator.acquire())
+        registry.update(self.server.hostname, is_disabled=False)
+        self.assertIsNotNone(self.allocator.acquire())
+        # 心跳超时后 key 过期
+        registry.remove(self.server.hostname)
+        self.assertIsNone(self.allocator.acquire())
+
+    def test_heartbeat_keeps_disabled(self):
+        registry = JudgeServerRegistry()
+        # 心跳从数据库读取判题机之后管理员禁用了判题机，心跳不能覆盖禁用
+        cache.delete(f"{CacheKey.judge_server_registry}:{self.server.hostname}")
+        registry.update(self.server.hostname, is_disabled=True)
+        server = registry.heartbeat(self.server.hostname, cpu_usage=10.0)
+        self.assertTrue(server.is_disabled)
+        registry.heartbeat(self.server.hostname, cpu_usage=20.0)
+        self.assertIsNone(self.allocator.acquire())
+
+
+class JudgeSchedulePolicyAPITest(APITestCase):
+    def setUp(self):
+        self.url = self.reverse("judge_schedule_policy_api")
+        self.create_super_admin()
+
+    def test_edit_policy(self):
+        resp = self.client.put(self.url, data={"policy": "latency_ewma"})
+        self.assertSuccess(resp)
+        self.assertEqual(SysOptions.judge_schedule_policy, "latency_ewma")
+        resp = self.client.get(self.url)
+        self.assertSuccess(resp)
+        self.assertEqual(resp.data["data"]["policy"], "latency_ewma")
+
+    def test_invalid_policy(self):
+        resp = self.client.put(self.url, data={"policy": "random"})
+        self.assertFailed(resp)
+
+
 class LanguageListAPITest(APITestCase):
     def test_get_languages(self):
         resp = self.client.get(self.reverse("language_list_api"))
         self.assertSuccess(resp)
 
+    def test_registry_invalidated_on_set(self):
+        SysOptions.reset_languages()
+        self.assertIsNotNone(language_registry.get("C"))
+        SysOptions.languages = [item for item in SysOptions.languages if item["name"] != "C"]
+        self.assertIsNone(language_registry.get("C"))
+        self.assertNotIn("C", SysOptions.spj_language_names)
+        resp = self.client.get(self.reverse("language_list_api"))
+        self.assertNotIn("C", [item["name"] for item in resp.data["data"]["languages"]])
+        SysOptions.reset_languages()
+
 
 class TestCasePruneAPITest(APITestCase):
     def setUp(self):
@@ -16,7 +16,13 @@ from requests.exceptions import RequestException
 from account.decorators import super_admin_required
 from account.models import User
 from contest.models import Contest
+from judge.admission import JudgeQueueMonitor
+from judge.allocator import JudgeSlotAllocator
+from judge.client import session_pool
 from judge.dispatcher import process_pending_task
+from judge.registry import JudgeServerRegistry
+from judge.scheduling import SCHEDULE_POLICIES, JudgeLatencyTracker
+from judge.verdict_cache import VerdictCache
 from options.options import SysOptions
 from problem.models import Problem
 from submission.models import Submission
@@ -27,7 +33,8 @@ from .models import JudgeServer
 from .serializers import (CreateEditWebsiteConfigSerializer,
                           CreateSMTPConfigSerializer, EditSMTPConfigSerializer,
                           JudgeServerHeartbeatSerializer,
-                          JudgeServerSerializer, TestSMTPConfigSerializer, EditJudgeServerSerializer)
+                          JudgeServerSerializer, TestSMTPConfigSerializer, EditJudgeServerSerializer,
+                          EditJudgeSchedulePolicySerializer, EditJudgeAdmissionSerializer)
 
 
 class SMTPAPI(APIView):
@@ -109,26 +116,68 @@ class JudgeServerAPI(APIView):
     @super_admin_required
     def get(self, request):
         servers = JudgeServer.objects.all().order_by("-last_heartbeat")
+        # 心跳和负载以 redis 中的注册表为准，正在运行的任务数以 redis 中未过期的租约为准
+        live_status = JudgeServerRegistry().live_status()
+        usage = JudgeSlotAllocator().usage([server.id for server in servers])
+        for server in servers:
+            live = live_status.get(server.hostname)
+            if live:
+                server.last_heartbeat, server.cpu_usage, server.memory_usage = \
+                    live.last_heartbeat, live.cpu_usage, live.memory_usage
+            server.task_number = usage[server.id]
         return self.success({"token": SysOptions.judge_server_token,
-                             "servers": JudgeServerSerializer(servers, many=True).data})
+                             "servers": JudgeServerSerializer(servers, many=True).data,
+                             "http_stats": session_pool.metrics(),
+                             "verdict_cache": VerdictCache().stats()})
 
     @super_admin_required
     def delete(self, request):
         hostname = request.GET.get("hostname")
         if hostname:
             JudgeServer.objects.filter(hostname=hostname).delete()
+            JudgeServerRegistry().remove(hostname)
         return self.success()
 
     @validate_serializer(EditJudgeServerSerializer)
     @super_admin_required
     def put(self, request):
         is_disabled = request.data.get("is_disabled", False)
-        JudgeServer.objects.filter(id=request.data["id"]).update(is_disabled=is_disabled)
+        server = JudgeServer.objects.filter(id=request.data["id"]).first()
+        if server:
+            server.is_disabled = is_disabled
+            server.save(update_fields=["is_disabled"])
+            JudgeServerRegistry().update(server.hostname, is_disabled=is_disabled)
         if not is_disabled:
             process_pending_task()
         return self.success()
 
 
+class JudgeSchedulePolicyAPI(APIView):
+    @super_admin_required
+    def get(self, request):
+        return self.success({"policy": SysOptions.judge_schedule_policy,
+                             "policies": list(SCHEDULE_POLICIES.keys()),
+                             "latencies": JudgeLatencyTracker().latencies()})
+
+    @super_admin_required
+    @validate_serializer(EditJudgeSchedulePolicySerializer)
+    def put(self, request):
+        SysOptions.judge_schedule_policy = request.data["policy"]
+        return self.success()
+
+
+class JudgeAdmissionAPI(APIView):
+    @super_admin_required
+    def get(self, request):
+        return self.success({"admission": SysOptions.judge_admission, "queue": JudgeQueueMonitor().status()})
+
+    @super_admin_required
+    @validate_serializer(EditJudgeAdmissionSerializer)
+    def put(self, request):
+        SysOptions.judge_admission = request.data
+        return self.success()
+
+
 class JudgeServerHeartbeatAPI(CSRFExemptAPIView):
     @validate_serializer(JudgeServerHeartbeatSerializer)
     def post(self, request):
@@ -137,26 +186,27 @@ class JudgeServerHeartbeatAPI(CSRFExemptAPIView):
         if hashlib.sha256(SysOptions.judge_server_token.encode("utf-8")).hexdigest() != client_token:
             return self.error("Invalid token")
 
-        try:
-            server = JudgeServer.objects.get(hostname=data["hostname"])
-            server.judger_version = data["judger_version"]
-            server.cpu_core = data["cpu_core"]
-            server.memory_usage = data["memory"]
-            server.cpu_usage = data["cpu"]
-            server.service_url = data["service_url"]
-            server.ip = request.ip
-            server.last_heartbeat = timezone.now()
-            server.save(update_fields=["judger_version", "cpu_core", "memory_usage", "service_url", "ip", "last_heartbeat"])
-        except JudgeServer.DoesNotExist:
-            JudgeServer.objects.create(hostname=data["hostname"],
-                                       judger_version=data["judger_version"],
-                                       cpu_core=data["cpu_core"],
-                                       memory_usage=data["memory"],
-                                       cpu_usage=data["cpu"],
-                                       ip=request.META["REMOTE_ADDR"],
-                                       service_url=data["service_url"],
-                                       last_heartbeat=timezone.now(),
-                                       )
+        registry = JudgeServerRegistry()
+        server = registry.heartbeat(data["hostname"],
+                                    judger_version=data["judger_version"],
+                                    cpu_core=data["cpu_core"],
+                                    memory_usage=data["memory"],
+                                    cpu_usage=data["cpu"],
+                                    service_url=data["service_url"],
+                                    ip=request.ip)
+        if server is None:
+            server = JudgeServer.objects.create(hostname=data["hostname"],
+                                                judger_version=data["judger_version"],
+                                                cpu_core=data["cpu_core"],
+                                                memory_usage=data["memory"],
+                                                cpu_usage=data["cpu"],
+                                                ip=request.META["REMOTE_ADDR"],
+                                                service_url=data["service_url"],
+                                                last_heartbeat=timezone.now(),
+                                                )
+            registry.register(server)
+        # 回收该判题机上已过期的租约，判题进程崩溃后泄漏的槽位会在这里归还
+        JudgeSlotAllocator().reap(server.id)
         # 新server上线 处理队列中的，防止没有新的提交而导致一直waiting
         process_pending_task()
 
@@ -228,7 +278,7 @@ class DashboardInfoAPI(APIView):
         today_submission_count = Submission.objects.filter(
             create_time__gte=datetime(today.year, today.month, today.day, 0, 0, tzinfo=pytz.UTC)).count()
         recent_contest_count = Contest.objects.exclude(end_time__lt=timezone.now()).count()
-        judge_server_count = len(list(filter(lambda x: x.status == "normal", JudgeServer.objects.all())))
+        judge_server_count = len(JudgeServerRegistry().alive_servers())
         return self.success({
             "user_count": User.objects.count(),
             "recent_contest_count": recent_contest_count,
@@ -0,0 +1,237 @@
+import json
+
+from django.db import transaction
+from django.utils.timezone import now
+
+from utils.api import JSONResponse
+
+from .models import ContestRankSnapshot
+from .scoreboard import ContestRankCache, ContestScoreboard
+from .serializers import ACMContestRankSerializer, OIContestRankSerializer
+
+
+class ScoreboardFreeze:
+    """
+    封榜。到达 contest.freeze_time 后第一次读取排名或者处理判题结果时保存当时的排名 (ContestRankSnapshot),
+    之后普通用户看到的都是这个快照，新的判题结果只记为 pending, 数据库中的排名仍然实时更新，管理员看到的是实时排名。
+    比赛结束后管理员通过 resolve 逐个公布 pending 的题目，每次只更新快照中一个用户的一个题目并移动这一行，
+    全部公布后 (finish) 恢复实时排名
+    """
+    # 错误提交的罚时，与 VerdictIngestion 相同
+    error_penalty_seconds = 20 * 60
+
+    def __init__(self, contest):
+        self.contest = contest
+        self.scoreboard = ContestScoreboard(contest)
+        self.serializer = ACMContestRankSerializer if self.scoreboard.is_acm else OIContestRankSerializer
+        self.rank_cache = ContestRankCache(self.scoreboard, frozen=True)
+
+    def started(self):
+        return self.contest.freeze_time is not None and now() >= self.contest.freeze_time
+
+    def frozen(self):
+        """
+        封榜已经开始并且还没有全部公布，普通用户不能看到封榜后的判题结果
+        """
+        if not self.started():
+            return False
+        snapshot = self.snapshot()
+        return snapshot is None or not snapshot.resolved
+
+    def _freeze_offset(self):
+        """
+        封榜时间距离比赛开始的秒数，与事件中的 contest_time 比较
+        """
+        return (self.contest.freeze_time - self.contest.start_time).total_seconds()
+
+    def snapshot(self, lock=False):
+        snapshots = ContestRankSnapshot.objects.filter(contest=self.contest)
+        if lock:
+            snapshots = snapshots.select_for_update()
+        return snapshots.first()
+
+    def _serialize(self, ranks):
+        return json.loads(json.dumps(self.serializer(ranks, many=True).data))
+
+    def capture(self):
+        """
+        保存封榜时的排名，已经保存过时直接返回
+        """
+        snapshot = self.snapshot()
+        if snapshot is not None:
+            return snapshot
+        ranks = [self.scoreboard.apply_penalty(rank) for rank in self.scoreboard.queryset().select_related("user")]
+        snapshot, _ = ContestRankSnapshot.objects.get_or_create(contest=self.contest,
+                                                                defaults={"ranks": self._serialize(ranks)})
+        return snapshot
+
+    def reset(self):
+        """
+        修改封榜时间后丢弃已经保存的快照
+        """
+        ContestRankSnapshot.objects.filter(contest=self.contest).delete()
+        ContestRankCache.bump(self.contest.id, frozen=True)
+
+    def add_pending(self, events):
+        """
+        在 VerdictIngestion 的事务中调用，events 已经写入数据库中的排名。
+        封榜后的提交记为 pending; 封榜前的提交 (封榜后才判完或者重判) 直接更新快照，
+        该题目已经有 pending 时等到公布时一起更新
+        """
+        snapshot = self.snapshot(lock=True)
+        if snapshot is None or snapshot.resolved:
+            return
+        offset = self._freeze_offset()
+        revealed = set()
+        for event in events:
+            if event["contest_time"] < offset:
+                revealed.add((event["user_id"], event["problem_id"]))
+                continue
+            key = f"{event['user_id']}:{event['problem_id']}"
+            snapshot.pending[key] = snapshot.pending.get(key, 0) + 1
+        revealed = sorted((user_id, problem_id) for user_id, problem_id in revealed
+                          if f"{user_id}:{problem_id}" not in snapshot.pending)
+        if revealed:
+            ranks = self.scoreboard.queryset().select_related("user").filter(user_id__in={item[0] for item in revealed})
+            currents = {row["user"]["id"]: row for row in self._serialize([self.scoreboard.apply_penalty(rank)
+                                                                           for rank in ranks])}
+            for user_id, problem_id in revealed:
+                if user_id in currents:
+                    self._reveal(snapshot.ranks, currents[user_id], problem_id)
+        snapshot.save(update_fields=["ranks", "pending"])
+        transaction.on_commit(lambda: ContestRankCache.bump(self.contest.id, frozen=True))
+
+    def _page(self, offset, limit):
+        snapshot = self.capture()
+        if snapshot.resolved:
+            return ""
+        pending = {}
+        for key, count in snapshot.pending.items():
+            user_id, problem_id = key.split(":")
+            pending.setdefault(int(user_id), {})[problem_id] = count
+        results = [dict(row, pending=pending.get(row["user"]["id"], {})) for row in snapshot.ranks[offset:offset + limit]]
+        return JSONResponse.dumps({"results": results, "total": len(snapshot.ranks)})
+
+    def page(self, offset, limit):
+        """
+        return 封榜排名的一页，已经序列化为 json; 没有封榜或者已经全部公布时返回 None
+        """
+        if not self.started():
+            return None
+        return self.rank_cache.get_or_compute(f"page:{offset}:{limit}", lambda: self._page(offset, limit)) or None
+
+    def rank_of(self, user_id):
+        positions = self.rank_cache.get_or_compute(
+            "positions", lambda: {row["user"]["id"]: index + 1 for index, row in enumerate(self.capture().ranks)})
+        return positions.get(user_id)
+
+    def _sort_key(self, row):
+        if self.scoreboard.is_acm:
+            return -row["accepted_number"], row["total_time"], row["user"]["id"]
+        return -row["total_score"], row["user"]["id"]
+
+    def _update_totals(self, row, current):
+        """
+        重新计算快照中一行的合计。违规和评价的罚时在封榜后仍会变化 (例如比赛结束后没有评价的用户增加罚时),
+        按当前的排名 current 计算。
+        return 合计是否变化
+        """
+        if self.scoreboard.is_acm:
+            before = (row["accepted_number"], row["total_time"])
+            accepted = []
+            for problem_id, info in row["submission_info"].items():
+                if not info["is_ac"]:
+                    continue
+                # 与 ContestScoreboard.apply_penalty 相同，ac_time 中包含违规的罚时
+                ac_time = info["ac_time"] - info.pop("penalty_applied", 0)
+                info.pop("original_ac_time", None)
+                info.pop("violation_count", None)
+                penalty_info = current["submission_info"].get(problem_id, {})
+                if penalty_info.get("penalty_applied"):
+                    info.update(original_ac_time=ac_time, penalty_applied=penalty_info["penalty_applied"],
+                                violation_count=penalty_info["violation_count"])
+                    ac_time += penalty_info["penalty_applied"]
+                info["ac_time"] = ac_time
+                accepted.append(info)
+            row["review_penalty_applied"] = current.get("review_penalty_applied", 0)
+            row["total_violation_count"] = current.get("total_violation_count", 0)
+            row["total_penalty_time"] = sum(info.get("penalty_applied", 0) for info in accepted) + \
+                row["review_penalty_applied"]
+            row["accepted_number"] = len(accepted)
+            row["total_time"] = sum(info["ac_time"] + info["error_number"] * self.error_penalty_seconds
+                                    for info in accepted) + row["review_penalty_applied"]
+            return before != (row["accepted_number"], row["total_time"])
+        before = row["total_score"]
+        row["violation_count"] = current.get("violation_count", 0)
+        row["penalty_points"] = current.get("penalty_points", 0)
+        row["total_score"] = max(0, sum(row["submission_info"].values()) - row["penalty_points"])
+        row["total_score_with_penalty"] = row["total_score"]
+        return before != row["total_score"]
+
+    def _reveal(self, rows, current, problem_id):
+        """
+        将当前排名 current 中 problem_id 的结果写入快照 rows, 并移动该用户的一行
+        return from_rank, to_rank, cell, row; 该用户原来不在快照中时 from_rank 为 None
+        """
+        user_id = current["user"]["id"]
+        index = next((i for i, row in enumerate(rows) if row["user"]["id"] == user_id), None)
+        if index is None:
+            row, from_rank = dict(current, submission_info={}), None
+        else:
+            row, from_rank = rows.pop(index), index + 1
+        cell = current["submission_info"].get(str(problem_id))
+        if cell is None:
+            row["submission_info"].pop(str(problem_id), None)
+        else:
+            row["submission_info"][str(problem_id)] = dict(cell)
+        self._update_totals(row, current)
+        index = next((i for i, item in enumerate(rows) if self._sort_key(item) > self._sort_key(row)), len(rows))
+        rows.insert(index, row)
+        return from_rank, index + 1, cell, row
+
+    def resolve(self):
+        """
+        公布下一个 pending 的题目，顺序与 ICPC 的 resolver 相同: 从快照中排名最低的还有 pending 的用户开始，
+        每次公布该用户题目 id 最小的一个，封榜后才第一次提交的用户排在最后。
+        return {"user_id": 1, "problem_id": 2, "cell": {...}, "from_rank": 10, "to_rank": 3, "row": {...},
+                "reload": False},
+        row 是快照中该用户新的一行; 罚时变化导致其他行的名次也变化时 reload 为 True, 没有 pending 时返回 None
+        """
+        with transaction.atomic():
+            snapshot = self.snapshot(lock=True)
+            if snapshot is None or snapshot.resolved or not snapshot.pending:
+                return None
+            rows = snapshot.ranks
+            currents = {row["user"]["id"]: row for row in self._serialize(
+                [self.scoreboard.apply_penalty(rank) for rank in self.scoreboard.queryset().select_related("user")])}
+            reload = False
+            for row in rows:
+                current = currents.get(row["user"]["id"])
+                if current is not None and self._update_totals(row, current):
+                    reload = True
+            rows.sort(key=self._sort_key)
+
+            pending = {}
+            for key in snapshot.pending:
+                user_id, problem_id = map(int, key.split(":"))
+                pending.setdefault(user_id, []).append(problem_id)
+            positions = {row["user"]["id"]: index for index, row in enumerate(rows)}
+            user_id = max(pending, key=lambda item: (positions.get(item, len(rows)), -item))
+            problem_id = min(pending[user_id])
+            snapshot.pending.pop(f"{user_id}:{problem_id}")
+
+            ret = {"user_id": user_id, "problem_id": problem_id, "cell": None, "from_rank": None, "to_rank": None,
+                   "row": None, "reload": reload}
+            if user_id in currents:
+                ret["from_rank"], ret["to_rank"], ret["cell"], ret["row"] = \
+                    self._reveal(rows, currents[user_id], problem_id)
+            snapshot.save(update_fields=["ranks", "pending"])
+            transaction.on_commit(lambda: ContestRankCache.bump(self.contest.id, frozen=True))
+        return ret
+
+    def finish(self):
+        """
+        结束封榜，普通用户恢复看到实时排名
+        """
+        ContestRankSnapshot.objects.filter(contest=self.contest).update(resolved=True, pending={})
+        ContestRankCache.bump(self.contest.id, frozen=True)
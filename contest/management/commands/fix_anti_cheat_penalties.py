@@ -1,7 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.utils.timezone import now
 from contest.models import Contest, AntiCheatViolation, ACMContestRank, OIContestRank
-from submission.models import Submission
+from contest.scoreboard import ContestScoreboard, load_rank_penalty
 from utils.constants import ContestRuleType
 
 
@@ -72,27 +72,19 @@ class Command(BaseCommand):
                 if contest.rule_type == ContestRuleType.ACM:
                     try:
                         rank = ACMContestRank.objects.get(contest=contest, user=user)
-                        
-                        # Check if penalties have already been applied by looking at accepted submissions
-                        accepted_submissions = Submission.objects.filter(
-                            contest=contest,
-                            user=user,
-                            result=0  # Accepted
-                        ).exists()
-                        
-                        if accepted_submissions:
-                            old_time = rank.total_time
-                            
-                            if not dry_run:
-                                # Apply penalty
-                                rank.total_time += penalty_seconds
-                                rank.save()
-                            
-                            new_time = old_time + penalty_seconds
-                            self.stdout.write(f'    ACM Rank: {old_time}s -> {new_time}s')
-                            contest_fixes += 1
-                        else:
-                            self.stdout.write(f'    No accepted submissions for {user.username}')
+                        old_time = rank.final_total_time
+
+                        # Penalties live in violation_info and are applied by rank.update_penalty(),
+                        # total_time only holds the AC time plus wrong answer penalties.
+                        # load_rank_penalty reloads violation_info/reviewed and calls update_penalty
+                        load_rank_penalty(contest, [rank])
+                        if not dry_run:
+                            rank.save(update_fields=['violation_info', 'reviewed', 'penalty_time',
+                                                     'total_time_with_penalty', 'final_total_time'])
+
+                        self.stdout.write(f'    ACM Rank: {old_time}s -> {rank.final_total_time}s '
+                                          f'(at most {penalty_seconds}s on accepted problems)')
+                        contest_fixes += 1
                             
                     except ACMContestRank.DoesNotExist:
                         self.stdout.write(f'    No ACM rank found for {user.username}')
@@ -100,10 +92,15 @@ class Command(BaseCommand):
                 else:  # OI Contest
                     try:
                         rank = OIContestRank.objects.get(contest=contest, user=user)
-                        
-                        # For OI contests, you might want to implement point deduction
-                        # For now, we'll just log that we found the rank
-                        self.stdout.write(f'    OI Rank found for {user.username} (no penalty applied)')
+                        old_score = rank.total_score_with_penalty
+
+                        # Reloads violation_count and calls rank.update_penalty()
+                        load_rank_penalty(contest, [rank])
+                        if not dry_run:
+                            rank.save(update_fields=['violation_count', 'total_score_with_penalty'])
+
+                        self.stdout.write(f'    OI Rank: {old_score} -> {rank.total_score_with_penalty} points')
+                        contest_fixes += 1
                         
                     except OIContestRank.DoesNotExist:
                         self.stdout.write(f'    No OI rank found for {user.username}')
@@ -115,11 +112,7 @@ class Command(BaseCommand):
             self.stdout.write(self.style.SUCCESS(f'DRY RUN: Would fix {total_fixes} rankings'))
         else:
             self.stdout.write(self.style.SUCCESS(f'Fixed {total_fixes} rankings total'))
-            # Clear contest rank cache
-            from django.core.cache import cache
-            from utils.constants import CacheKey
-            
+            # Rebuild the scoreboard and drop cached rank pages
             for contest in contests:
-                cache_key = f"{CacheKey.contest_rank_cache}:{contest.id}"
-                cache.delete(cache_key)
+                ContestScoreboard.invalidate(contest.id)
                 self.stdout.write(f'Cleared cache for contest {contest.id}')
\ No newline at end of file
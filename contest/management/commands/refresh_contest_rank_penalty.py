@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from contest.models import ACMContestRank, Contest, OIContestRank
+from contest.scoreboard import ContestScoreboard, load_rank_penalty
+from utils.constants import ContestRuleType
+
+
+class Command(BaseCommand):
+    help = "Recompute the materialized violation and review penalty columns of contest ranks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--contest-id", type=int, help="Only refresh the given contest")
+
+    def handle(self, *args, **options):
+        contests = Contest.objects.all()
+        if options.get("contest_id"):
+            contests = contests.filter(id=options["contest_id"])
+        for contest in contests.order_by("id"):
+            if contest.rule_type == ContestRuleType.ACM:
+                model = ACMContestRank
+                fields = ["violation_info", "reviewed", "penalty_time", "total_time_with_penalty", "final_total_time"]
+            else:
+                model = OIContestRank
+                fields = ["violation_count", "total_score_with_penalty"]
+            with transaction.atomic():
+                ranks = load_rank_penalty(contest, model.objects.select_for_update().filter(contest=contest)
+                                          .order_by("user_id"))
+                model.objects.bulk_update(ranks, fields, batch_size=500)
+            ContestScoreboard.invalidate(contest.id)
+            self.stdout.write(f"Contest {contest.id}: refreshed {len(ranks)} ranks")
@@ -1,12 +1,12 @@
 # management/commands/test_anti_cheat_system.py
 from django.core.management.base import BaseCommand
 from django.db import transaction
-from django.core.cache import cache
 from contest.models import Contest, AntiCheatViolation, ACMContestRank, OIContestRank
+from contest.scoreboard import ContestScoreboard, load_rank_penalty
 from submission.models import Submission
 from account.models import User, AdminType
 from problem.models import Problem
-from utils.constants import ContestRuleType, CacheKey
+from utils.constants import ContestRuleType
 from django.utils.timezone import now
 from datetime import timedelta
 import time
@@ -59,9 +59,8 @@ class Command(BaseCommand):
                     ranks_deleted = OIContestRank.objects.filter(contest=contest, user=user).count()
                     OIContestRank.objects.filter(contest=contest, user=user).delete()
                 
-                # Clear cache
-                cache_key = f"{CacheKey.contest_rank_cache}:{contest.id}"
-                cache.delete(cache_key)
+                # Rebuild the scoreboard and drop cached rank pages
+                ContestScoreboard.invalidate(contest.id)
                 
                 self.stdout.write(f'✅ Deleted: {violations_deleted} violations, {submissions_deleted} submissions')
                 self.stdout.write('✅ Cleared contest rank cache')
@@ -191,14 +190,13 @@ class Command(BaseCommand):
             self.stdout.write('=' * 40)
             
             try:
-                if contest.rule_type == ContestRuleType.ACM:
-                    from submission.signals import recalculate_acm_ranking_with_penalties
-                    rank = recalculate_acm_ranking_with_penalties(user, contest)
-                else:
-                    from submission.signals import recalculate_oi_ranking_with_penalties
-                    rank = recalculate_oi_ranking_with_penalties(user, contest)
-                
+                model = ACMContestRank if contest.rule_type == ContestRuleType.ACM else OIContestRank
+                rank = model.objects.filter(contest=contest, user=user).first()
                 if rank:
+                    # Reloads violations and reviews, then calls rank.update_penalty()
+                    load_rank_penalty(contest, [rank])
+                    rank.save()
+                    ContestScoreboard.invalidate(contest.id)
                     self.stdout.write('✅ Manual recalculation successful')
                     self.check_current_ranking(contest, user, "After manual recalculation")
                 else:
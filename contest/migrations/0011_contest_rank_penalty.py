@@ -0,0 +1,72 @@
+from django.db import migrations, models
+from django.db.models import F
+
+
+def init_penalty_fields(apps, schema_editor):
+    """
+    违规和评价的罚时由 refresh_contest_rank_penalty 命令重新计算，这里只保证排序字段有合理的初始值
+    """
+    ACMContestRank = apps.get_model('contest', 'ACMContestRank')
+    OIContestRank = apps.get_model('contest', 'OIContestRank')
+    ACMContestRank.objects.update(total_time_with_penalty=F('total_time'), final_total_time=F('total_time'))
+    OIContestRank.objects.update(total_score_with_penalty=F('total_score'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contest', '0010_auto_20190326_0201'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='acmcontestrank',
+            name='violation_info',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AddField(
+            model_name='acmcontestrank',
+            name='penalty_time',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='acmcontestrank',
+            name='reviewed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='acmcontestrank',
+            name='total_time_with_penalty',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='acmcontestrank',
+            name='final_total_time',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='oicontestrank',
+            name='violation_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='oicontestrank',
+            name='total_score_with_penalty',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(init_penalty_fields, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='acmcontestrank',
+            index=models.Index(fields=['contest', '-accepted_number', 'total_time_with_penalty'],
+                               name='acm_rank_live_order'),
+        ),
+        migrations.AddIndex(
+            model_name='acmcontestrank',
+            index=models.Index(fields=['contest', '-accepted_number', 'final_total_time'],
+                               name='acm_rank_final_order'),
+        ),
+        migrations.AddIndex(
+            model_name='oicontestrank',
+            index=models.Index(fields=['contest', '-total_score_with_penalty'], name='oi_rank_order'),
+        ),
+    ]
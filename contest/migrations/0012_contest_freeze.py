@@ -0,0 +1,31 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contest', '0011_contest_rank_penalty'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contest',
+            name='freeze_time',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.CreateModel(
+            name='ContestRankSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ranks', models.JSONField(default=list)),
+                ('pending', models.JSONField(default=dict)),
+                ('resolved', models.BooleanField(default=False)),
+                ('create_time', models.DateTimeField(auto_now_add=True)),
+                ('contest', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='contest.Contest')),
+            ],
+            options={
+                'db_table': 'contest_rank_snapshot',
+            },
+        ),
+    ]
@@ -24,6 +24,8 @@ class Contest(models.Model):
     # 是否可见 false的话相当于删除
     visible = models.BooleanField(default=True)
     allowed_ip_ranges = JSONField(default=list)
+    # 封榜时间，为空时不封榜
+    freeze_time = models.DateTimeField(null=True)
 
     @property
     def status(self):
@@ -55,6 +57,14 @@ class Contest(models.Model):
         ordering = ("-start_time",)
 
 
+# ACM 比赛中每次违规在对应题目的 AC 时间上增加的秒数
+VIOLATION_PENALTY_SECONDS = 600
+# 比赛结束后没有提交评价的罚时
+REVIEW_PENALTY_SECONDS = 3600
+# OI 比赛中每次违规扣除的分数
+VIOLATION_PENALTY_POINTS = 10
+
+
 class AbstractContestRank(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     contest = models.ForeignKey(Contest, on_delete=models.CASCADE)
@@ -71,10 +81,32 @@ class ACMContestRank(AbstractContestRank):
     # {"23": {"is_ac": True, "ac_time": 8999, "error_number": 2, "is_first_ac": True}}
     # key is problem id
     submission_info = JSONField(default=dict)
+    # 以下字段在判题、违规和评价变化时由 update_penalty 更新，排名直接按这些字段排序
+    # {"23": 2} key is problem id, value is violation count
+    violation_info = JSONField(default=dict)
+    # 已经 AC 的题目上违规的罚时
+    penalty_time = models.IntegerField(default=0)
+    reviewed = models.BooleanField(default=False)
+    # 比赛进行中的排名使用 total_time_with_penalty, 比赛结束后使用加上未评价罚时的 final_total_time
+    total_time_with_penalty = models.IntegerField(default=0)
+    final_total_time = models.IntegerField(default=0)
 
     class Meta:
         db_table = "acm_contest_rank"
         unique_together = (("user", "contest"),)
+        indexes = [
+            models.Index(fields=["contest", "-accepted_number", "total_time_with_penalty"],
+                         name="acm_rank_live_order"),
+            models.Index(fields=["contest", "-accepted_number", "final_total_time"], name="acm_rank_final_order"),
+        ]
+
+    def update_penalty(self):
+        self.penalty_time = 0
+        for problem_id, count in self.violation_info.items():
+            if self.submission_info.get(problem_id, {}).get("is_ac"):
+                self.penalty_time += count * VIOLATION_PENALTY_SECONDS
+        self.total_time_with_penalty = self.total_time + self.penalty_time
+        self.final_total_time = self.total_time_with_penalty + (0 if self.reviewed else REVIEW_PENALTY_SECONDS)
 
 
 class OIContestRank(AbstractContestRank):
@@ -82,10 +114,34 @@ class OIContestRank(AbstractContestRank):
     # {"23": 333}
     # key is problem id, value is current score
     submission_info = JSONField(default=dict)
+    violation_count = models.IntegerField(default=0)
+    # 扣除违规分数后的总分，由 update_penalty 更新
+    total_score_with_penalty = models.IntegerField(default=0)
 
     class Meta:
         db_table = "oi_contest_rank"
         unique_together = (("user", "contest"),)
+        indexes = [models.Index(fields=["contest", "-total_score_with_penalty"], name="oi_rank_order")]
+
+    def update_penalty(self):
+        self.total_score_with_penalty = max(0, self.total_score - self.violation_count * VIOLATION_PENALTY_POINTS)
+
+
+class ContestRankSnapshot(models.Model):
+    """
+    封榜时保存的排名，由 contest.freeze.ScoreboardFreeze 维护
+    """
+    contest = models.OneToOneField(Contest, on_delete=models.CASCADE)
+    # 按名次排列的排名，格式与 ContestRankAPI 返回的 results 相同
+    ranks = JSONField(default=list)
+    # {"user_id:problem_id": 提交次数} 封榜后还没有公布的判题结果
+    pending = JSONField(default=dict)
+    # 全部公布后恢复实时排名
+    resolved = models.BooleanField(default=False)
+    create_time = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "contest_rank_snapshot"
 
 
 class ContestAnnouncement(models.Model):
@@ -0,0 +1,265 @@
+import time
+from collections import Counter
+
+from redis.exceptions import LockError
+
+from account.models import AdminType, User
+from utils.cache import cache
+from utils.constants import CacheKey, ContestRuleType, ContestStatus
+
+from .models import (ACMContestRank, AntiCheatViolation, ContestReview, OIContestRank,
+                     REVIEW_PENALTY_SECONDS, VIOLATION_PENALTY_POINTS, VIOLATION_PENALTY_SECONDS)
+
+
+def load_rank_penalty(contest, ranks):
+    """
+    根据违规记录和评价重新设置 rank 的 violation_info/violation_count 和 reviewed 并调用 update_penalty,
+    用于新建的 rank 和重新计算排名，之后的变化由 contest.signals 增量维护
+    """
+    ranks = list(ranks)
+    if not ranks:
+        return ranks
+    user_ids = [rank.user_id for rank in ranks]
+    violations = AntiCheatViolation.objects.filter(contest=contest, user_id__in=user_ids) \
+        .values_list("user_id", "problem_id")
+    if contest.rule_type == ContestRuleType.ACM:
+        problems = {user_id: {} for user_id in user_ids}
+        for user_id, problem_id in violations:
+            if problem_id:
+                problems[user_id][str(problem_id)] = problems[user_id].get(str(problem_id), 0) + 1
+        reviewed = set(ContestReview.objects.filter(contest=contest, user_id__in=user_ids)
+                       .values_list("user_id", flat=True))
+        for rank in ranks:
+            rank.violation_info = problems[rank.user_id]
+            rank.reviewed = rank.user_id in reviewed
+            rank.update_penalty()
+    else:
+        counts = Counter(user_id for user_id, _ in violations)
+        for rank in ranks:
+            rank.violation_count = counts[rank.user_id]
+            rank.update_penalty()
+    return ranks
+
+
+class ContestScoreboard:
+    """
+    比赛排名保存在 redis sorted set 中，member 是 user_id, 分页、总数和查询某个用户的名次都是 O(log n)。
+    ACM 的 score 为 accepted_number * time_base + (time_base - 1 - 罚时后的 total_time), 按 score 倒序即
+    AC 数多的在前，AC 数相同时用时少的在前；OI 的 score 为扣除违规分数后的总分。
+    罚时保存在 rank 的 total_time_with_penalty/final_total_time/total_score_with_penalty 字段中，
+    比赛结束后没有评价的用户使用 final_total_time, 因此比赛结束前后使用不同的 key
+    """
+    time_base = 10 ** 10
+    # 判题结果之外的变化 (例如修改了用户的状态) 最多在这段时间后生效
+    ttl = 600
+    lock_timeout = 30
+
+    def __init__(self, contest):
+        self.contest = contest
+        self.is_acm = contest.rule_type == ContestRuleType.ACM
+        self.model = ACMContestRank if self.is_acm else OIContestRank
+        self.ended = contest.status == ContestStatus.CONTEST_ENDED
+        self.key = f"{CacheKey.contest_scoreboard}:{contest.id}:{'ended' if self.ended else 'live'}"
+
+    @classmethod
+    def invalidate(cls, contest_id):
+        cache.delete_many([f"{CacheKey.contest_scoreboard}:{contest_id}:{phase}" for phase in ("live", "ended")])
+        ContestRankCache.bump(contest_id)
+
+    @property
+    def time_field(self):
+        return "final_total_time" if self.ended else "total_time_with_penalty"
+
+    @property
+    def ordering(self):
+        if self.is_acm:
+            return ("-accepted_number", self.time_field, "user_id")
+        return ("-total_score_with_penalty", "user_id")
+
+    def apply_penalty(self, rank):
+        """
+        根据 rank 中保存的罚时设置序列化需要的字段，不保存到数据库
+        """
+        if not self.is_acm:
+            rank.penalty_points = rank.violation_count * VIOLATION_PENALTY_POINTS
+            return rank
+        submission_info = {k: dict(v) for k, v in rank.submission_info.items()}
+        for problem_id, count in rank.violation_info.items():
+            info = submission_info.get(problem_id)
+            if info and info.get("is_ac"):
+                seconds = count * VIOLATION_PENALTY_SECONDS
+                info["original_ac_time"] = info["ac_time"]
+                info["ac_time"] += seconds
+                info["penalty_applied"] = seconds
+                info["violation_count"] = count
+        rank.submission_info = submission_info
+        rank.review_penalty_applied = REVIEW_PENALTY_SECONDS if self.ended and not rank.reviewed else 0
+        rank.total_penalty_time = rank.penalty_time + rank.review_penalty_applied
+        rank.total_violation_count = sum(rank.violation_info.values())
+        rank.original_total_time = rank.total_time
+        rank.total_time = getattr(rank, self.time_field)
+        return rank
+
+    def _score(self, accepted_number, total_time):
+        return accepted_number * self.time_base + (self.time_base - 1 - min(total_time, self.time_base - 1))
+
+    def score(self, rank):
+        if self.is_acm:
+            return self._score(rank.accepted_number, getattr(rank, self.time_field))
+        return rank.total_score_with_penalty
+
+    def _eligible(self, ranks):
+        user_ids = [rank.user_id for rank in ranks]
+        eligible = set(User.objects.filter(id__in=user_ids, admin_type=AdminType.REGULAR_USER, is_disabled=False)
+                       .values_list("id", flat=True))
+        return [rank for rank in ranks if rank.user_id in eligible]
+
+    def queryset(self):
+        """
+        参与排名的 rank, 按名次排序
+        """
+        return self.model.objects.filter(contest=self.contest, user__admin_type=AdminType.REGULAR_USER,
+                                         user__is_disabled=False).order_by(*self.ordering)
+
+    def rebuild(self):
+        if self.is_acm:
+            rows = self.queryset().values_list("user_id", "accepted_number", self.time_field)
+            scores = {user_id: self._score(accepted_number, total_time) for user_id, accepted_number, total_time in rows}
+        else:
+            scores = dict(self.queryset().values_list("user_id", "total_score_with_penalty"))
+        tmp_key = f"{self.key}:tmp"
+        pipe = cache.pipeline()
+        pipe.delete(tmp_key)
+        if scores:
+            pipe.zadd(tmp_key, scores)
+            pipe.rename(tmp_key, self.key)
+        else:
+            # 没有人提交时用一个空的标记，避免每次请求都重新构建
+            pipe.delete(self.key)
+            pipe.zadd(self.key, {"": -1})
+        pipe.expire(self.key, self.ttl)
+        pipe.execute()
+        ContestRankCache.bump(self.contest.id)
+
+    def ensure(self):
+        if cache.has_key(self.key):
+            return
+        # 同一时间只有一个进程重建，其他进程等待重建完成
+        with cache.lock(f"{self.key}:lock", timeout=self.lock_timeout, blocking_timeout=self.lock_timeout):
+            if not cache.has_key(self.key):
+                self.rebuild()
+
+    def update(self, ranks):
+        """
+        判题结果或者罚时变化后更新对应用户的 score, 排名不存在时等下次读取时再构建
+        """
+        if not ranks:
+            return
+        ContestRankCache.bump(self.contest.id)
+        if not cache.has_key(self.key):
+            return
+        scores = {rank.user_id: self.score(rank) for rank in self._eligible(list(ranks))}
+        if scores:
+            cache.zadd(self.key, scores)
+
+    def refresh_users(self, user_ids):
+        self.update(self.model.objects.filter(contest=self.contest, user_id__in=list(user_ids)))
+
+    def count(self):
+        self.ensure()
+        return max(cache.zcard(self.key) - int(cache.zscore(self.key, "") is not None), 0)
+
+    def page(self, offset, limit):
+        """
+        return 按名次排列的 user_id
+        """
+        self.ensure()
+        if limit <= 0:
+            return []
+        return [int(member) for member in cache.zrevrange(self.key, offset, offset + limit - 1) if member]
+
+    def rank_of(self, user_id):
+        """
+        return 从 1 开始的名次，没有参加比赛时返回 None
+        """
+        self.ensure()
+        rank = cache.zrevrank(self.key, user_id)
+        return None if rank is None else rank + 1
+
+    def ranks(self, user_ids):
+        """
+        return 按 user_ids 的顺序返回加上罚时的 rank 对象
+        """
+        ranks = {rank.user_id: rank for rank in
+                 self.model.objects.filter(contest=self.contest, user_id__in=user_ids).select_related("user")}
+        return [self.apply_penalty(ranks[user_id]) for user_id in user_ids if user_id in ranks]
+
+
+class ContestRankCache:
+    """
+    排名页面的缓存，保存的是已经序列化的 json 字符串。key 中包含比赛排名的版本号。判题结果、违规和评价改变排名时 bump 版本号，旧版本的缓存不再被读取，
+    等待自然过期。版本号变化后同一个页面只有一个请求重新计算，其他请求等待它的结果，避免同时重新计算
+    """
+    timeout = 300
+    # 等待其他请求计算的最长时间，超过后自己计算
+    wait_timeout = 5
+    wait_interval = 0.05
+
+    def __init__(self, scoreboard, frozen=False):
+        self.contest_id = scoreboard.contest.id
+        self.frozen = frozen
+        if frozen:
+            self.phase = "frozen"
+        else:
+            self.phase = "ended" if scoreboard.ended else "live"
+
+    @staticmethod
+    def _version_key(contest_id, frozen=False):
+        key = f"{CacheKey.contest_rank_version}:{contest_id}"
+        # 封榜的排名只在快照变化时更新，不受判题结果影响
+        return f"{key}:frozen" if frozen else key
+
+    @classmethod
+    def bump(cls, contest_id, frozen=False):
+        cache.redis_incr(cls._version_key(contest_id, frozen))
+
+    def version(self):
+        return cache.get(self._version_key(self.contest_id, self.frozen)) or 0
+
+    def get_or_compute(self, name, func):
+        key = f"{CacheKey.contest_rank_cache}:{self.contest_id}:{self.version()}:{self.phase}:{name}"
+        value = cache.get(key)
+        if value is not None:
+            return value
+        lock = cache.lock(f"{key}:lock", timeout=self.wait_timeout)
+        if lock.acquire(blocking=False):
+            try:
+                value = func()
+                cache.set(key, value, self.timeout)
+            finally:
+                try:
+                    lock.release()
+                except LockError:
+                    pass
+            return value
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            time.sleep(self.wait_interval)
+            value = cache.get(key)
+            if value is not None:
+                return value
+        return func()
+
+
+class ScoreboardRanks:
+    """
+    让 paginate_data 可以直接对 ContestScoreboard 切片和计数
+    """
+    def __init__(self, scoreboard):
+        self.scoreboard = scoreboard
+
+    def __getitem__(self, item):
+        return self.scoreboard.ranks(self.scoreboard.page(item.start, item.stop - item.start))
+
+    def count(self):
+        return self.scoreboard.count()
@@ -15,6 +15,7 @@ class CreateConetestSeriaizer(serializers.Serializer):
     visible = serializers.BooleanField()
     real_time_rank = serializers.BooleanField()
     allowed_ip_ranges = serializers.ListField(child=serializers.CharField(max_length=32), allow_empty=True)
+    freeze_time = serializers.DateTimeField(required=False, allow_null=True)
 
 
 class EditConetestSeriaizer(serializers.Serializer):
@@ -27,6 +28,7 @@ class EditConetestSeriaizer(serializers.Serializer):
     visible = serializers.BooleanField()
     real_time_rank = serializers.BooleanField()
     allowed_ip_ranges = serializers.ListField(child=serializers.CharField(max_length=32))
+    freeze_time = serializers.DateTimeField(required=False, allow_null=True)
 
 
 class ContestAdminSerializer(serializers.ModelSerializer):
@@ -187,6 +189,12 @@ class OIContestRankSerializer(serializers.ModelSerializer):
         return data
 
 
+class ResolveContestRankSerializer(serializers.Serializer):
+    contest_id = serializers.IntegerField()
+    # 为 True 时结束封榜，否则公布下一个 pending 的题目
+    finish = serializers.BooleanField(default=False)
+
+
 class ACMContesHelperSerializer(serializers.Serializer):
     contest_id = serializers.IntegerField()
     problem_id = serializers.CharField()
@@ -1,20 +1,70 @@
+from django.db import transaction
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from django.core.cache import cache
-from utils.constants import CacheKey
-from .models import AntiCheatViolation
+
+from utils.constants import ContestRuleType
+
+from .models import ACMContestRank, AntiCheatViolation, ContestReview, OIContestRank
+from .scoreboard import ContestScoreboard
+from .stream import ScoreboardStream
+
+
+def _update_rank(contest, user_id, func):
+    """
+    锁住用户的 rank 并修改罚时，用户还没有提交时 rank 不存在，创建时会重新读取违规和评价
+    """
+    model = ACMContestRank if contest.rule_type == ContestRuleType.ACM else OIContestRank
+    with transaction.atomic():
+        rank = model.objects.select_for_update().filter(contest=contest, user_id=user_id).first()
+        if rank is None:
+            return
+        func(rank)
+        rank.update_penalty()
+        rank.save()
+    scoreboard, stream = ContestScoreboard(contest), ScoreboardStream(contest)
+
+    def publish():
+        scoreboard.update([rank])
+        stream.publish([rank])
+
+    transaction.on_commit(publish)
+
 
 @receiver(post_save, sender=AntiCheatViolation)
 @receiver(post_delete, sender=AntiCheatViolation)
-def clear_contest_rank_cache(sender, instance, **kwargs):
+def update_rank_violation(sender, instance, **kwargs):
     """
-    Clear contest rank cache when violations are added or removed
+    违规会增加 ACM 比赛对应题目的罚时或者扣除 OI 比赛的分数
     """
-    try:
-        contest_id = instance.contest.id
-        cache_key = f"{CacheKey.contest_rank_cache}:{contest_id}"
-        cache.delete(cache_key)
-        print(f"Cleared contest rank cache for contest {contest_id}")
-    except Exception as e:
-        print(f"Error clearing contest rank cache: {e}")
-        pass
\ No newline at end of file
+    if kwargs.get("signal") is post_save and not kwargs.get("created"):
+        return
+    delta = 1 if kwargs.get("created") else -1
+
+    def func(rank):
+        if isinstance(rank, OIContestRank):
+            rank.violation_count = max(rank.violation_count + delta, 0)
+        elif instance.problem_id:
+            problem_id = str(instance.problem_id)
+            count = rank.violation_info.get(problem_id, 0) + delta
+            if count > 0:
+                rank.violation_info[problem_id] = count
+            else:
+                rank.violation_info.pop(problem_id, None)
+
+    _update_rank(instance.contest, instance.user_id, func)
+
+
+@receiver(post_save, sender=ContestReview)
+@receiver(post_delete, sender=ContestReview)
+def update_rank_review(sender, instance, **kwargs):
+    """
+    比赛结束后没有评价的用户增加罚时
+    """
+    if instance.contest.rule_type != ContestRuleType.ACM:
+        return
+    reviewed = kwargs.get("signal") is post_save
+
+    def func(rank):
+        rank.reviewed = reviewed
+
+    _update_rank(instance.contest, instance.user_id, func)
@@ -0,0 +1,148 @@
+import json
+import threading
+import time
+
+from django.conf import settings
+
+from utils.cache import cache
+from utils.constants import CacheKey
+
+from .freeze import ScoreboardFreeze
+from .scoreboard import ContestScoreboard
+
+
+class _StreamConnection:
+    """
+    包装 events 生成器，StreamingHttpResponse 关闭时释放连接数，生成器还没有开始执行时也能释放
+    """
+    def __init__(self, events, release):
+        self.events = events
+        self.release = release
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.events)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.events.close()
+            self.release()
+
+
+class ScoreboardStream:
+    """
+    排名变化的事件保存在 redis stream 中，ContestRankStreamAPI 用 XREAD 阻塞读取并通过 Server-Sent Events 推送给客户端，
+    客户端只需要在连接时获取一次完整的排名。stream 的 id 作为 SSE 的 event id, 断线重连时浏览器会带上 Last-Event-ID,
+    从该位置继续读取错过的事件，太旧的位置已经被裁剪时通知客户端重新获取完整的排名。
+
+    事件的类型
+     - rank: 一个用户的排名变化，data 中是该用户的名次、AC 数 (总分)、罚时和每个题目的结果
+     - resolve: 封榜后公布的一个题目，data 中是快照中该用户新的一行
+     - reload: 需要重新获取完整的排名，例如封榜结束
+    封榜期间 rank 事件只推送给比赛管理员
+
+    每个连接占用 web 进程的一个线程，部署时由单独的 gunicorn_stream 进程处理 (见 deploy/nginx/locations.conf),
+    每个进程的连接数不超过 settings.RANK_STREAM_MAX_CONNECTIONS, 超过时 connect 返回 None, 客户端改为轮询
+    """
+    max_length = 10000
+    # 最后一次变化之后 stream 保留的时间
+    ttl = 24 * 3600
+    # 每个连接的最长时间，之后客户端自动重连，避免长时间占用 web 进程的线程
+    connection_timeout = 60
+    block_timeout = 15
+
+    _connections = threading.BoundedSemaphore(settings.RANK_STREAM_MAX_CONNECTIONS)
+
+    def __init__(self, contest):
+        self.contest = contest
+        self.key = f"{CacheKey.contest_rank_stream}:{contest.id}"
+
+    def connect(self, last_id=None, is_contest_admin=False):
+        """
+        return 用于 StreamingHttpResponse 的迭代器，连接数已满时返回 None
+        """
+        if not self._connections.acquire(blocking=False):
+            return None
+        return _StreamConnection(self.events(last_id, is_contest_admin), self._connections.release)
+
+    def _add(self, pipe, event, data, frozen=False):
+        pipe.xadd(self.key, {"event": event, "frozen": int(frozen), "data": json.dumps(data, separators=(",", ":"))},
+                  maxlen=self.max_length, approximate=True)
+        pipe.expire(self.key, self.ttl)
+
+    def publish(self, ranks):
+        """
+        ranks 已经保存到数据库并更新了 ContestScoreboard
+        """
+        ranks = list(ranks)
+        if not ranks:
+            return
+        scoreboard = ContestScoreboard(self.contest)
+        freeze = ScoreboardFreeze(self.contest)
+        snapshot = freeze.snapshot() if freeze.started() else None
+        frozen = snapshot is not None and not snapshot.resolved
+        pipe = cache.pipeline()
+        for rank in scoreboard.ranks([rank.user_id for rank in ranks]):
+            data = {"user": {"id": rank.user_id, "username": rank.user.username},
+                    "rank": scoreboard.rank_of(rank.user_id), "submission_info": rank.submission_info}
+            if scoreboard.is_acm:
+                data.update(accepted_number=rank.accepted_number, total_time=rank.total_time,
+                            total_penalty_time=rank.total_penalty_time)
+            else:
+                data.update(total_score=rank.total_score_with_penalty, penalty_points=rank.penalty_points)
+            self._add(pipe, "rank", data, frozen)
+        pipe.execute()
+
+    def publish_resolve(self, ret):
+        pipe = cache.pipeline()
+        self._add(pipe, "resolve", ret)
+        pipe.execute()
+
+    def publish_reload(self):
+        pipe = cache.pipeline()
+        self._add(pipe, "reload", {})
+        pipe.execute()
+
+    def _expired(self, last_id):
+        """
+        客户端收到的最后一个事件已经被裁剪时，之后的事件可能也不完整
+        """
+        first = cache.xrange(self.key, count=1)
+        if not first:
+            return False
+        first_id = first[0][0].decode("utf-8")
+        return tuple(map(int, last_id.split("-"))) < tuple(map(int, first_id.split("-")))
+
+    def events(self, last_id=None, is_contest_admin=False):
+        """
+        生成 SSE 格式的数据，last_id 为空时只推送之后的新事件
+        """
+        # 客户端重连时的间隔 (毫秒)
+        yield "retry: 3000\n\n"
+        if not last_id:
+            last = cache.xrevrange(self.key, count=1)
+            last_id = last[0][0].decode("utf-8") if last else "0-0"
+        else:
+            try:
+                if self._expired(last_id):
+                    yield "event: reload\ndata: {}\n\n"
+                    return
+            except ValueError:
+                yield "event: reload\ndata: {}\n\n"
+                return
+        deadline = time.monotonic() + self.connection_timeout
+        while time.monotonic() < deadline:
+            items = cache.xread({self.key: last_id}, count=100, block=int(self.block_timeout * 1000))
+            if not items:
+                # 保持连接，避免被代理关闭
+                yield ": keepalive\n\n"
+                continue
+            for event_id, fields in items[0][1]:
+                last_id = event_id.decode("utf-8")
+                if int(fields[b"frozen"]) and not is_contest_admin:
+                    continue
+                yield f"id: {last_id}\nevent: {fields[b'event'].decode('utf-8')}\ndata: {fields[b'data'].decode('utf-8')}\n\n"
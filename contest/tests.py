@@ -1,11 +1,19 @@
 import copy
+import json
+
+from django.conf import settings
 from datetime import datetime, timedelta
 
 from django.utils import timezone
 
+from utils.api import APIView
 from utils.api.tests import APITestCase
+from utils.cache import cache
 
-from .models import ContestAnnouncement, ContestRuleType, Contest
+from .models import ACMContestRank, ContestAnnouncement, ContestRuleType, Contest, REVIEW_PENALTY_SECONDS
+from .freeze import ScoreboardFreeze
+from .scoreboard import ContestRankCache, ContestScoreboard
+from .stream import ScoreboardStream
 
 DEFAULT_CONTEST_DATA = {"title": "test title", "description": "test description",
                         "start_time": timezone.localtime(timezone.now()),
@@ -160,3 +168,180 @@ class ContestRankAPITest(APITestCase):
     def get_contest_rank(self):
         resp = self.client.get(self.url + "?contest_id=" + self.acm_contest.id)
         self.assertSuccess(resp)
+
+
+class ContestScoreboardTest(APITestCase):
+    def setUp(self):
+        admin = self.create_admin()
+        self.contest = Contest.objects.create(created_by=admin, **DEFAULT_CONTEST_DATA)
+        ContestScoreboard.invalidate(self.contest.id)
+        self.users = [self.create_user(f"user{i}", "test123", login=False) for i in range(3)]
+        # user2 AC 数最多，user0 和 user1 AC 数相同时 user1 用时少
+        for user, accepted_number, total_time in zip(self.users, (1, 1, 2), (3000, 2000, 5000)):
+            rank = ACMContestRank(user=user, contest=self.contest, accepted_number=accepted_number,
+                                  total_time=total_time)
+            rank.update_penalty()
+            rank.save()
+
+    def test_page_and_rank(self):
+        scoreboard = ContestScoreboard(self.contest)
+        self.assertEqual(scoreboard.count(), 3)
+        self.assertEqual(scoreboard.page(0, 10), [self.users[2].id, self.users[1].id, self.users[0].id])
+        self.assertEqual(scoreboard.rank_of(self.users[0].id), 3)
+
+        rank = ACMContestRank.objects.get(user=self.users[0], contest=self.contest)
+        rank.accepted_number = 3
+        rank.save()
+        scoreboard.update([rank])
+        self.assertEqual(scoreboard.rank_of(self.users[0].id), 1)
+
+    def test_violation_penalty(self):
+        scoreboard = ContestScoreboard(self.contest)
+        rank = ACMContestRank.objects.get(user=self.users[1], contest=self.contest)
+        rank.submission_info = {"1": {"is_ac": True, "ac_time": 2000, "error_number": 0, "is_first_ac": False}}
+        rank.violation_info = {"1": 2}
+        rank.update_penalty()
+        rank.save()
+        self.assertEqual(rank.total_time_with_penalty, 2000 + 2 * 600)
+        scoreboard.update([rank])
+        self.assertEqual(scoreboard.page(0, 10), [self.users[2].id, self.users[0].id, self.users[1].id])
+        self.assertEqual([item.user_id for item in scoreboard.queryset()], scoreboard.page(0, 10))
+        self.assertEqual(scoreboard.ranks([self.users[1].id])[0].submission_info["1"]["ac_time"], 3200)
+
+    def test_rank_cache_version(self):
+        scoreboard = ContestScoreboard(self.contest)
+        rank_cache = ContestRankCache(scoreboard)
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return scoreboard.page(0, 10)
+
+        self.assertEqual(rank_cache.get_or_compute("page", compute), rank_cache.get_or_compute("page", compute))
+        self.assertEqual(len(calls), 1)
+
+        # 排名变化后版本号增加，重新计算
+        scoreboard.update(ACMContestRank.objects.filter(contest=self.contest, user=self.users[0]))
+        rank_cache.get_or_compute("page", compute)
+        self.assertEqual(len(calls), 2)
+
+    def test_cached_page_matches_success(self):
+        url = self.reverse("contest_rank_api")
+        resp = self.client.get(url, data={"contest_id": self.contest.id, "limit": 10})
+        self.assertSuccess(resp)
+        # 缓存的整页拼接成的响应与 success() 序列化同样的数据得到的内容完全相同
+        self.assertEqual(resp.content, APIView().success(resp.data["data"]).content)
+        self.assertEqual(self.client.get(url, data={"contest_id": self.contest.id, "limit": 10}).content,
+                         resp.content)
+
+
+class ScoreboardFreezeTest(APITestCase):
+    def setUp(self):
+        admin = self.create_admin()
+        data = dict(DEFAULT_CONTEST_DATA, start_time=timezone.now() - timedelta(hours=5),
+                    end_time=timezone.now() - timedelta(hours=1))
+        self.contest = Contest.objects.create(created_by=admin, freeze_time=timezone.now() - timedelta(hours=2), **data)
+        ContestRankCache.bump(self.contest.id, frozen=True)
+        self.users = [self.create_user(f"user{i}", "test123", login=False) for i in range(2)]
+        for user, problem_id, ac_time in zip(self.users, ("1", "2"), (1000, 2000)):
+            rank = ACMContestRank(user=user, contest=self.contest, accepted_number=1, total_time=ac_time,
+                                  reviewed=True,
+                                  submission_info={problem_id: {"is_ac": True, "ac_time": ac_time, "error_number": 0,
+                                                                "is_first_ac": True}})
+            rank.update_penalty()
+            rank.save()
+
+    def test_resolve(self):
+        freeze = ScoreboardFreeze(self.contest)
+        snapshot = freeze.capture()
+        self.assertEqual([row["user"]["id"] for row in snapshot.ranks], [self.users[0].id, self.users[1].id])
+
+        # 封榜后 user1 又 AC 了一题
+        rank = ACMContestRank.objects.get(user=self.users[1], contest=self.contest)
+        rank.submission_info["1"] = {"is_ac": True, "ac_time": 15000, "error_number": 1, "is_first_ac": False}
+        rank.accepted_number = 2
+        rank.total_time += 15000 + 1200
+        rank.update_penalty()
+        rank.save()
+        freeze.add_pending([{"user_id": self.users[1].id, "problem_id": 1, "contest_time": 15000}])
+
+        self.assertEqual(json.loads(freeze.page(0, 10))["results"][1]["pending"], {"1": 1})
+        self.assertEqual(freeze.rank_of(self.users[1].id), 2)
+
+        ret = freeze.resolve()
+        self.assertEqual((ret["from_rank"], ret["to_rank"]), (2, 1))
+        self.assertEqual(freeze.rank_of(self.users[1].id), 1)
+        self.assertIsNone(freeze.resolve())
+
+        freeze.finish()
+        self.assertIsNone(freeze.page(0, 10))
+
+    def test_add_pending_before_freeze(self):
+        freeze = ScoreboardFreeze(self.contest)
+        freeze.capture()
+        # 封榜前的提交封榜后才判完，直接公布
+        rank = ACMContestRank.objects.get(user=self.users[1], contest=self.contest)
+        rank.submission_info["1"] = {"is_ac": True, "ac_time": 5000, "error_number": 0, "is_first_ac": False}
+        rank.accepted_number = 2
+        rank.total_time += 5000
+        rank.update_penalty()
+        rank.save()
+        freeze.add_pending([{"user_id": self.users[1].id, "problem_id": 1, "contest_time": 5000}])
+
+        snapshot = freeze.snapshot()
+        self.assertEqual(snapshot.pending, {})
+        self.assertEqual(snapshot.ranks[0]["user"]["id"], self.users[1].id)
+        self.assertEqual(snapshot.ranks[0]["accepted_number"], 2)
+
+    def test_resolve_penalty(self):
+        freeze = ScoreboardFreeze(self.contest)
+        freeze.capture()
+        # 封榜后 user0 的评价被撤销，公布时按当前的罚时计算
+        rank = ACMContestRank.objects.get(user=self.users[0], contest=self.contest)
+        rank.reviewed = False
+        rank.update_penalty()
+        rank.save()
+        freeze.add_pending([{"user_id": self.users[1].id, "problem_id": 2, "contest_time": 15000}])
+
+        ret = freeze.resolve()
+        self.assertTrue(ret["reload"])
+        row = freeze.snapshot().ranks[1]
+        self.assertEqual(row["user"]["id"], self.users[0].id)
+        self.assertEqual(row["total_time"], 1000 + REVIEW_PENALTY_SECONDS)
+        self.assertEqual(row["review_penalty_applied"], REVIEW_PENALTY_SECONDS)
+
+    def test_stream(self):
+        stream = ScoreboardStream(self.contest)
+        cache.delete(stream.key)
+        stream.publish(ACMContestRank.objects.filter(contest=self.contest, user=self.users[0]))
+        last_id = cache.xrevrange(stream.key, count=1)[0][0].decode("utf-8")
+        stream.publish_reload()
+        stream.connection_timeout = stream.block_timeout = 0.1
+
+        events = [item for item in stream.events(last_id) if item.startswith("id:")]
+        self.assertEqual(len(events), 1)
+        self.assertIn("event: reload", events[0])
+
+        # 封榜期间 rank 事件不推送给普通用户
+        ScoreboardFreeze(self.contest).capture()
+        stream.publish(ACMContestRank.objects.filter(contest=self.contest, user=self.users[1]))
+        last_id = events[0].split("\n")[0][len("id: "):]
+        self.assertFalse([item for item in stream.events(last_id) if item.startswith("id:")])
+        self.assertEqual(len([item for item in stream.events(last_id, is_contest_admin=True)
+                              if item.startswith("id:")]), 1)
+
+    def test_stream_connection_limit(self):
+        stream = ScoreboardStream(self.contest)
+        connections = []
+        while True:
+            connection = stream.connect()
+            if connection is None:
+                break
+            connections.append(connection)
+        self.assertEqual(len(connections), settings.RANK_STREAM_MAX_CONNECTIONS)
+        # 关闭一个连接后可以重新连接，还没有开始读取的连接也会释放
+        connections.pop().close()
+        connections.append(stream.connect())
+        self.assertIsNotNone(connections[-1])
+        for connection in connections:
+            connection.close()
@@ -1,11 +1,12 @@
 from django.conf.urls import url
 
-from ..views.admin import ContestAnnouncementAPI, ContestAPI, ACMContestHelper, DownloadContestSubmissions, ContestReviewAdminAPI, ContestReviewStatsAdminAPI
+from ..views.admin import ContestAnnouncementAPI, ContestAPI, ACMContestHelper, DownloadContestSubmissions, ContestReviewAdminAPI, ContestReviewStatsAdminAPI, ContestRankResolveAPI
 
 urlpatterns = [
     url(r"^contest/?$", ContestAPI.as_view(), name="contest_admin_api"),
     url(r"^contest/announcement/?$", ContestAnnouncementAPI.as_view(), name="contest_announcement_admin_api"),
     url(r"^contest/acm_helper/?$", ACMContestHelper.as_view(), name="acm_contest_helper"),
+    url(r"^contest/rank_resolve/?$", ContestRankResolveAPI.as_view(), name="contest_rank_resolve_api"),
     url(r"^download_submissions/?$", DownloadContestSubmissions.as_view(), name="acm_contest_helper"),
     
     url(r"^contest/reviews/?$", ContestReviewAdminAPI.as_view(), name="contest_reviews_admin_api"),
@@ -3,7 +3,7 @@ from django.conf.urls import url
 from ..views.oj import ContestAnnouncementListAPI
 from ..views.oj import ContestPasswordVerifyAPI, ContestAccessAPI
 from ..views.oj import ContestListAPI, ContestAPI
-from ..views.oj import ContestRankAPI
+from ..views.oj import ContestRankAPI, ContestRankStreamAPI
 from ..views.oj import AntiCheatViolationAPI, AntiCheatViolationListAPI, ProblemAntiCheatStatusAPI, AntiCheatStatusAPI, ContestViolationDetailsAPI, UserProblemViolationsAPI
 from ..views.oj import ContestReviewAPI, ContestReviewListAPI, ContestReviewStatsAPI
 
@@ -14,6 +14,7 @@ urlpatterns = [
     url(r"^contest/announcement/?$", ContestAnnouncementListAPI.as_view(), name="contest_announcement_api"),
     url(r"^contest/access/?$", ContestAccessAPI.as_view(), name="contest_access_api"),
     url(r"^contest_rank/?$", ContestRankAPI.as_view(), name="contest_rank_api"),
+    url(r"^contest_rank/stream/?$", ContestRankStreamAPI.as_view(), name="contest_rank_stream_api"),
     
     # Anti-cheat endpoints
     url(r"^contest/anti_cheat_violation/?$", AntiCheatViolationAPI.as_view(), name="contest_anti_cheat_violation_api"),
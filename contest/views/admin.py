@@ -10,18 +10,28 @@ from account.decorators import check_contest_permission, ensure_created_by
 from account.models import User
 from submission.models import Submission, JudgeStatus
 from utils.api import APIView, validate_serializer
-from utils.cache import cache
-from utils.constants import CacheKey
+from utils.constants import ContestStatus
 from utils.shortcuts import rand_str
 from utils.tasks import delete_files
 from ..models import Contest, ContestAnnouncement, ACMContestRank, ContestReview
+from ..freeze import ScoreboardFreeze
+from ..scoreboard import ContestScoreboard
+from ..stream import ScoreboardStream
 from ..serializers import (ContestAnnouncementSerializer, ContestAdminSerializer,
                            CreateConetestSeriaizer, CreateContestAnnouncementSerializer,
                            EditConetestSeriaizer, EditContestAnnouncementSerializer,
-                           ACMContesHelperSerializer,ContestReviewSerializer )
+                           ACMContesHelperSerializer,ContestReviewSerializer, ResolveContestRankSerializer)
 
 
 class ContestAPI(APIView):
+    def _parse_freeze_time(self, data):
+        if not data.get("freeze_time"):
+            return None
+        data["freeze_time"] = dateutil.parser.parse(data["freeze_time"])
+        if not data["start_time"] <= data["freeze_time"] <= data["end_time"]:
+            return "Freeze time must be between start time and end time"
+        return None
+
     @validate_serializer(CreateConetestSeriaizer)
     def post(self, request):
         data = request.data
@@ -30,6 +40,9 @@ class ContestAPI(APIView):
         data["created_by"] = request.user
         if data["end_time"] <= data["start_time"]:
             return self.error("Start time must occur earlier than end time")
+        error = self._parse_freeze_time(data)
+        if error:
+            return self.error(error)
         if data.get("password") and data["password"] == "":
             data["password"] = None
         for ip_range in data["allowed_ip_ranges"]:
@@ -52,6 +65,10 @@ class ContestAPI(APIView):
         data["end_time"] = dateutil.parser.parse(data["end_time"])
         if data["end_time"] <= data["start_time"]:
             return self.error("Start time must occur earlier than end time")
+        error = self._parse_freeze_time(data)
+        if error:
+            return self.error(error)
+        freeze_changed = "freeze_time" in data and data["freeze_time"] != contest.freeze_time
         if not data["password"]:
             data["password"] = None
         for ip_range in data["allowed_ip_ranges"]:
@@ -59,13 +76,13 @@ class ContestAPI(APIView):
                 ip_network(ip_range, strict=False)
             except ValueError:
                 return self.error(f"{ip_range} is not a valid cidr network")
-        if not contest.real_time_rank and data.get("real_time_rank"):
-            cache_key = f"{CacheKey.contest_rank_cache}:{contest.id}"
-            cache.delete(cache_key)
-
         for k, v in data.items():
             setattr(contest, k, v)
         contest.save()
+        # 比赛时间变化后罚时和是否结束的判断都会变化，重新构建排名
+        ContestScoreboard.invalidate(contest.id)
+        if freeze_changed:
+            ScoreboardFreeze(contest).reset()
         return self.success(ContestAdminSerializer(contest).data)
 
     def get(self, request):
@@ -195,6 +212,43 @@ class ACMContestHelper(APIView):
         return self.success()
 
 
+class ContestRankResolveAPI(APIView):
+    @check_contest_permission(check_type="ranks")
+    def get(self, request):
+        ensure_created_by(self.contest, request.user)
+        snapshot = ScoreboardFreeze(self.contest).snapshot()
+        return self.success({"freeze_time": self.contest.freeze_time,
+                             "captured": snapshot is not None,
+                             "resolved": snapshot is not None and snapshot.resolved,
+                             "pending": sum(snapshot.pending.values()) if snapshot else 0})
+
+    @check_contest_permission(check_type="ranks")
+    @validate_serializer(ResolveContestRankSerializer)
+    def post(self, request):
+        """
+        比赛结束后逐个公布封榜后的判题结果
+        """
+        ensure_created_by(self.contest, request.user)
+        if self.contest.status != ContestStatus.CONTEST_ENDED:
+            return self.error("Contest has not ended yet")
+        freeze = ScoreboardFreeze(self.contest)
+        if freeze.snapshot() is None:
+            return self.error("Contest rank is not frozen")
+        stream = ScoreboardStream(self.contest)
+        if request.data["finish"]:
+            freeze.finish()
+            stream.publish_reload()
+            return self.success()
+        ret = freeze.resolve()
+        if ret is not None:
+            # 罚时变化导致其他用户的名次也变化时客户端需要重新获取排名
+            if ret["reload"]:
+                stream.publish_reload()
+            else:
+                stream.publish_resolve(ret)
+        return self.success(ret)
+
+
 class DownloadContestSubmissions(APIView):
     def _dump_submissions(self, contest, exclude_admin=True):
         problem_ids = contest.problem_set.all().values_list("id", "_id")
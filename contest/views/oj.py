@@ -1,28 +1,30 @@
 import io
+import json
 
 import xlsxwriter
 from utils.api import APIView, validate_serializer
 import ipaddress
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.utils.timezone import now
-from django.core.cache import cache
 from django.db.models import Count, Q
 from django.db import models
 
 from problem.models import Problem
 from utils.api import APIView, validate_serializer
-from utils.constants import CacheKey, CONTEST_PASSWORD_SESSION_KEY
+from utils.constants import CONTEST_PASSWORD_SESSION_KEY
 from utils.shortcuts import datetime2str, check_is_id
-from account.models import AdminType
 from account.decorators import login_required, check_contest_permission, check_contest_password
 
 from utils.constants import ContestRuleType, ContestStatus
-from ..models import ContestAnnouncement, Contest, OIContestRank, ACMContestRank, AntiCheatViolation, ContestReview
+from ..models import ContestAnnouncement, Contest, AntiCheatViolation, ContestReview
 from submission.models import Submission
 from ..serializers import ContestAnnouncementSerializer
 from ..serializers import ContestSerializer, ContestPasswordVerifySerializer
 from ..serializers import OIContestRankSerializer, ACMContestRankSerializer
 from ..serializers import ContestReviewSerializer, CreateContestReviewSerializer
+from ..freeze import ScoreboardFreeze
+from ..scoreboard import ContestRankCache, ContestScoreboard, ScoreboardRanks
+from ..stream import ScoreboardStream
 
 
 class ContestAnnouncementListAPI(APIView):
@@ -110,116 +112,12 @@ class ContestAccessAPI(APIView):
 
 class ContestRankAPI(APIView):
     def get_rank(self):
-        import traceback
-        import logging
-        import json
-        from collections import defaultdict # Import defaultdict
-        
-        logger = logging.getLogger('contest')
-        
-        try:
-            logger.info(f"Getting rank for contest {self.contest.id}, rule type: {self.contest.rule_type}")
-            
-            if self.contest.rule_type == ContestRuleType.ACM:
-                logger.info("Processing ACM contest")
-                
-                ranks = ACMContestRank.objects.filter(
-                    contest=self.contest,
-                    user__admin_type=AdminType.REGULAR_USER,
-                    user__is_disabled=False
-                ).select_related("user")
-                
-                if not ranks.exists():
-                    return []
-                
-                penalty_data = []
-                # Check contest status once before the loop
-                is_contest_ended = self.contest.status == ContestStatus.CONTEST_ENDED
-
-                for rank in ranks:
-                    try:
-                        logger.debug(f"Processing penalties for user {rank.user.username}")
-
-                        # --- BUG FIX STARTS HERE --- (Existing code)
-                        violations_by_problem = defaultdict(int)
-                        user_violations = AntiCheatViolation.objects.filter(
-                            contest=self.contest,
-                            user=rank.user,
-                            problem__isnull=False
-                        )
-
-                        for v in user_violations:
-                            violations_by_problem[str(v.problem_id)] += 1
-                        
-                        logger.debug(f"User {rank.user.username} violation counts: {dict(violations_by_problem)}")
-                        # --- BUG FIX ENDS HERE ---
-
-                        modified_submission_info = json.loads(json.dumps(rank.submission_info))
-                        total_time_adjustment = 0
-                        
-                        for problem_id_str, violation_count in violations_by_problem.items():
-                            if problem_id_str in modified_submission_info and modified_submission_info[problem_id_str].get('is_ac', False):
-                                problem_penalty_seconds = violation_count * 600
-                                
-                                original_ac_time = modified_submission_info[problem_id_str]['ac_time']
-                                new_ac_time = original_ac_time + problem_penalty_seconds
-                                
-                                modified_submission_info[problem_id_str]['ac_time'] = new_ac_time
-                                modified_submission_info[problem_id_str]['penalty_applied'] = problem_penalty_seconds
-                                modified_submission_info[problem_id_str]['violation_count'] = violation_count
-                                modified_submission_info[problem_id_str]['original_ac_time'] = original_ac_time
-                                
-                                total_time_adjustment += problem_penalty_seconds
-                                logger.debug(f"Applied penalty to problem {problem_id_str}: {problem_penalty_seconds}s for {violation_count} violations.")
-                        
-                        # --- NEW: PENALTY FOR NO REVIEW ---
-                        review_penalty_seconds = 0
-                        # Only apply the penalty if the contest has officially ended.
-                        if is_contest_ended:
-                            review_exists = ContestReview.objects.filter(contest=self.contest, user=rank.user).exists()
-                            if not review_exists:
-                                review_penalty_seconds = 3600  # 60 minutes * 60 seconds
-                                total_time_adjustment += review_penalty_seconds
-                                logger.info(f"User {rank.user.username} has no review, applying {review_penalty_seconds}s penalty.")
-                        
-                        # Add penalty info to the rank object for the serializer
-                        rank.review_penalty_applied = review_penalty_seconds
-                        # --- END NEW LOGIC ---
-
-                        # Apply the calculated penalties to the user's rank object
-                        rank.submission_info = modified_submission_info
-                        rank.total_penalty_time = total_time_adjustment # Now includes both anti-cheat and review penalties
-                        rank.total_violation_count = sum(violations_by_problem.values())
-                        
-                        rank.original_total_time = rank.total_time
-                        rank.total_time += total_time_adjustment
-                        rank.total_time_with_penalty = rank.total_time
-                        
-                        penalty_data.append(rank)
-                        
-                    except Exception as e:
-                        logger.error(f"Error processing penalties for user {rank.user.username}: {str(e)}")
-                        rank.total_penalty_time = 0
-                        rank.total_violation_count = 0
-                        penalty_data.append(rank)
-                
-                penalty_data.sort(key=lambda x: (-x.accepted_number, x.total_time))
-                return penalty_data
-                
-            else: # OI Contest
-                # Note: A time-based penalty is not applicable to OI contests as they are score-based.
-                # A score deduction would be a more suitable penalty for this rule type.
-                ranks = OIContestRank.objects.filter(
-                    contest=self.contest,
-                    user__admin_type=AdminType.REGULAR_USER,
-                    user__is_disabled=False
-                ).select_related("user").order_by('-total_score')
-                return list(ranks)
-                
-        except Exception as e:
-            logger.error(f"Exception in get_rank: {str(e)}")
-            traceback.print_exc()
-            return []
+        """
+        完整的排名，已经加上了违规和未评价的罚时
+        """
+        scoreboard = ContestScoreboard(self.contest)
+        # 罚时已经保存在 rank 中，直接按索引排序
+        return [scoreboard.apply_penalty(rank) for rank in scoreboard.queryset().select_related("user")]
 
     def column_string(self, n):
         string = ""
@@ -230,97 +128,62 @@ class ContestRankAPI(APIView):
 
     @check_contest_permission(check_type="ranks")
     def get(self, request):
-        import traceback
-        import logging
-        
-        logger = logging.getLogger('contest')
-        
-        try:
-            logger.info(f"ContestRankAPI.get called for contest {self.contest.id}")
-            
-            download_csv = request.GET.get("download_csv")
-            force_refresh = request.GET.get("force_refresh")
-            is_contest_admin = request.user.is_authenticated and request.user.is_contest_admin(self.contest)
-            
-            logger.info(f"download_csv={download_csv}, force_refresh={force_refresh}, is_contest_admin={is_contest_admin}")
-            logger.info(f"Contest rule type: {self.contest.rule_type}")
-            
-            if self.contest.rule_type == ContestRuleType.OI:
-                serializer = OIContestRankSerializer
-                logger.info("Using OI serializer")
-            else:
-                serializer = ACMContestRankSerializer
-                logger.info("Using ACM serializer")
-
-            # Check if there are violations
-            logger.info("Checking for violations...")
-            has_violations = AntiCheatViolation.objects.filter(contest=self.contest).exists()
-            logger.info(f"Has violations: {has_violations}")
-            
-            # Get ranking data
-            if force_refresh == "1" and is_contest_admin:
-                logger.info("Force refresh requested by admin")
-                qs = self.get_rank()
-            elif has_violations:
-                logger.info("Has violations, calculating fresh data")
-                qs = self.get_rank()
-            else:
-                logger.info("Checking cache...")
-                cache_key = f"{CacheKey.contest_rank_cache}:{self.contest.id}"
-                qs = cache.get(cache_key)
-                if not qs:
-                    logger.info("Cache miss, calculating fresh data")
-                    qs = self.get_rank()
-                    # Only cache when there are no violations
-                    if not has_violations:
-                        logger.info("Caching results for 60 seconds")
-                        cache.set(cache_key, qs, 60)
-                else:
-                    logger.info("Cache hit")
-
-            logger.info(f"Got {len(qs) if qs else 0} ranking entries")
-
-            # Handle empty rankings
-            if not qs:
-                logger.info("No ranking data available, returning empty results")
-                return self.success({
-                    "total": 0,
-                    "results": []
-                })
+        download_csv = request.GET.get("download_csv")
+        force_refresh = request.GET.get("force_refresh")
+        is_contest_admin = request.user.is_authenticated and request.user.is_contest_admin(self.contest)
+        if self.contest.rule_type == ContestRuleType.OI:
+            serializer = OIContestRankSerializer
+        else:
+            serializer = ACMContestRankSerializer
+
+        scoreboard = ContestScoreboard(self.contest)
+        if force_refresh == "1" and is_contest_admin:
+            scoreboard.rebuild()
+
+        if download_csv:
+            # Skip CSV for now to focus on the main issue
+            return self.error("CSV download temporarily disabled during debugging")
+
+        def serialize_page():
+            # 排名保存在 sorted set 中，只读取当前页的 rank
+            page_qs = self.paginate_data(request, ScoreboardRanks(scoreboard))
+            page_qs["results"] = serializer(page_qs["results"], many=True, is_contest_admin=is_contest_admin).data
+            return self.response_class.dumps(page_qs)
+
+        # 缓存的是序列化之后的整页数据，命中时直接返回，不需要再查询数据库和序列化
+        offset, limit = self.get_page_params(request)
+        if not is_contest_admin:
+            # 封榜期间普通用户看到的是封榜时的排名
+            freeze = ScoreboardFreeze(self.contest)
+            data = freeze.page(offset, limit)
+            if data is not None:
+                data = data[:-1] + f',"frozen":true,"my_rank":{json.dumps(freeze.rank_of(request.user.id))}}}'
+                return self.success_raw(data)
+        data = ContestRankCache(scoreboard).get_or_compute(
+            f"page:{'admin' if is_contest_admin else 'user'}:{offset}:{limit}", serialize_page)
+        if request.user.is_authenticated:
+            data = data[:-1] + f',"my_rank":{json.dumps(scoreboard.rank_of(request.user.id))}}}'
+        return self.success_raw(data)
+
+
+class ContestRankStreamAPI(APIView):
+    @check_contest_permission(check_type="ranks")
+    def get(self, request):
+        """
+        Server-Sent Events, 推送排名的变化，客户端先通过 ContestRankAPI 获取完整的排名再连接
+        """
+        is_contest_admin = request.user.is_contest_admin(self.contest)
+        last_id = request.META.get("HTTP_LAST_EVENT_ID") or request.GET.get("last_event_id")
+        events = ScoreboardStream(self.contest).connect(last_id, is_contest_admin)
+        if events is None:
+            # 不是 text/event-stream 的响应会让 EventSource 停止重连，客户端改为轮询 ContestRankAPI
+            return self.error(err="stream-unavailable", msg="Too many rank streams, please poll the rank instead")
+        resp = StreamingHttpResponse(events, content_type="text/event-stream")
+        resp["Cache-Control"] = "no-cache"
+        # 关闭 nginx 对这个响应的缓冲
+        resp["X-Accel-Buffering"] = "no"
+        return resp
 
-            if download_csv:
-                logger.info("CSV download requested")
-                # Skip CSV for now to focus on the main issue
-                return self.error("CSV download temporarily disabled during debugging")
-            
-            logger.info("Paginating data...")
-            try:
-                page_qs = self.paginate_data(request, qs)
-                logger.info(f"Paginated to {len(page_qs['results']) if page_qs and 'results' in page_qs else 0} entries")
-            except Exception as e:
-                logger.error(f"Pagination error: {str(e)}")
-                # Return unpaginated data if pagination fails
-                page_qs = {
-                    "total": len(qs),
-                    "results": qs
-                }
-            
-            logger.info("Serializing data...")
-            try:
-                serialized_data = serializer(page_qs["results"], many=True, is_contest_admin=is_contest_admin).data
-                page_qs["results"] = serialized_data
-                logger.info(f"Serialization complete, returning {len(serialized_data)} entries")
-            except Exception as e:
-                logger.error(f"Serialization error: {str(e)}")
-                traceback.print_exc()
-                return self.error(f"Serialization error: {str(e)}")
-            
-            return self.success(page_qs)
-            
-        except Exception as e:
-            logger.error(f"Exception in ContestRankAPI.get: {str(e)}")
-            traceback.print_exc()
-            return self.error(f"Internal server error: {str(e)}")
 
 class AntiCheatViolationAPI(APIView):
     @login_required
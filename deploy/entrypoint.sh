@@ -32,9 +32,24 @@ else
 fi
 
 if [ ! -z "$LOWER_IP_HEADER" ]; then
-    sed -i "s/__IP_HEADER__/\$http_$LOWER_IP_HEADER/g" api_proxy.conf;
+    sed -i "s/__IP_HEADER__/\$http_$LOWER_IP_HEADER/g" api_proxy.conf stream_proxy.conf;
 else
-    sed -i "s/__IP_HEADER__/\$remote_addr/g" api_proxy.conf;
+    sed -i "s/__IP_HEADER__/\$remote_addr/g" api_proxy.conf stream_proxy.conf;
+fi
+
+if [ -z "$RANK_STREAM_MAX_CONNECTIONS" ]; then
+    export RANK_STREAM_MAX_CONNECTIONS=64
+fi
+
+# 比赛、练习、重判三个判题队列的 worker 线程数，按 6/3/1 的比例分配
+if [ -z "$JUDGE_CONTEST_THREADS" ]; then
+    export JUDGE_CONTEST_THREADS=6
+fi
+if [ -z "$JUDGE_PRACTICE_THREADS" ]; then
+    export JUDGE_PRACTICE_THREADS=3
+fi
+if [ -z "$JUDGE_REJUDGE_THREADS" ]; then
+    export JUDGE_REJUDGE_THREADS=1
 fi
 
 if [ -z "$MAX_WORKER_NUM" ]; then
@@ -61,7 +76,6 @@ do
     python manage.py migrate --no-input &&
     python manage.py inituser --username=root --password=rootroot --action=create_super_admin &&
     echo "from options.options import SysOptions; SysOptions.judge_server_token='$JUDGE_SERVER_TOKEN'" | python manage.py shell &&
-    echo "from conf.models import JudgeServer; JudgeServer.objects.update(task_number=0)" | python manage.py shell &&
     break
     n=$(($n+1))
     echo "Failed to migrate, going to retry..."
@@ -74,4 +88,10 @@ adduser -u 900 -S -G spj server
 chown -R server:spj $DATA $APP/dist
 find $DATA/test_case -type d -exec chmod 710 {} \;
 find $DATA/test_case -type f -exec chmod 640 {} \;
+
+mkdir -p /tmp/supervisord.d
+if [ "$JUDGE_DISPATCH_MODE" = "async" ]; then
+    ln -sf $APP/deploy/supervisord_judge_engine.conf /tmp/supervisord.d/judge_engine.conf
+fi
+
 exec supervisord -c /app/deploy/supervisord.conf
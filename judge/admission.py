@@ -0,0 +1,98 @@
+import math
+from datetime import timedelta
+
+import dramatiq
+from django.utils import timezone
+
+from judge.dispatcher import JUDGE_PRIORITY_WEIGHTS, async_judge_queue_key, waiting_queue_key
+from judge.registry import JudgeServerRegistry
+from judge.scheduling import JudgeLatencyTracker, judge_server_capacity
+from judge.tasks import JUDGE_TASKS
+from options.options import SysOptions
+from submission.models import JudgeStatus, Submission
+from utils.cache import cache
+
+
+class JudgeQueueMonitor:
+    """
+    统计还没有开始判题的任务数，包括 dramatiq 各判题队列、没有空闲判题机时的等待队列和异步判题队列
+    """
+    # 还没有判题耗时数据时按每个任务 2 秒估算
+    default_latency = 2000
+
+    def depth(self):
+        """
+        return {"dramatiq": 10, "waiting": 3, "async": 0, "total": 13}
+        """
+        ret = {"dramatiq": 0}
+        broker = dramatiq.get_broker()
+        # 只有 RedisBroker 可以直接读取队列长度
+        client = getattr(broker, "client", None)
+        if client is not None:
+            pipe = client.pipeline()
+            for actor in JUDGE_TASKS.values():
+                pipe.llen(f"{broker.namespace}:{actor.queue_name}")
+            ret["dramatiq"] = sum(pipe.execute())
+        pipe = cache.pipeline()
+        for priority in JUDGE_PRIORITY_WEIGHTS:
+            pipe.llen(waiting_queue_key(priority))
+        for priority in JUDGE_PRIORITY_WEIGHTS:
+            pipe.llen(async_judge_queue_key(priority))
+        lengths = pipe.execute()
+        ret["waiting"] = sum(lengths[:len(JUDGE_PRIORITY_WEIGHTS)])
+        ret["async"] = sum(lengths[len(JUDGE_PRIORITY_WEIGHTS):])
+        ret["total"] = ret["dramatiq"] + ret["waiting"] + ret["async"]
+        return ret
+
+    def estimated_wait(self, depth):
+        """
+        按在线判题机的槽位总数和平均判题耗时估算排队的秒数，没有可用的判题机时返回 None
+        """
+        servers = [server for server in JudgeServerRegistry().alive_servers() if not server.is_disabled]
+        capacity = sum(judge_server_capacity(server) for server in servers)
+        if not capacity:
+            return None
+        latencies = JudgeLatencyTracker().latencies()
+        known = [latencies[server.id] for server in servers if server.id in latencies]
+        latency = sum(known) / len(known) if known else self.default_latency
+        return math.ceil(depth * latency / 1000 / capacity)
+
+    def status(self):
+        depth = self.depth()
+        return {"depth": depth, "estimated_wait": self.estimated_wait(depth["total"])}
+
+
+class JudgeAdmission:
+    """
+    提交前的准入检查，配置见 SysOptions.judge_admission, 值为 0 表示不限制
+    user_in_flight_limit: 每个用户同时处于等待和判题中的提交数
+    queue_soft_limit: 排队的任务数超过该值时拒绝新的提交，并返回预计的等待时间
+    contest_exempt: 比赛中的提交不受 queue_soft_limit 限制
+    """
+    # 超过这个时间还没有结果的提交不再计入，避免判题异常中断的提交一直占用名额
+    in_flight_window = timedelta(minutes=10)
+
+    def __init__(self):
+        self.config = SysOptions.judge_admission
+
+    def check(self, user_id, contest_id=None):
+        """
+        return 错误信息，允许提交时返回 None
+        """
+        user_limit = self.config.get("user_in_flight_limit", 0)
+        if user_limit:
+            in_flight = Submission.objects.filter(user_id=user_id,
+                                                  result__in=[JudgeStatus.PENDING, JudgeStatus.JUDGING],
+                                                  create_time__gte=timezone.now() - self.in_flight_window).count()
+            if in_flight >= user_limit:
+                return f"You already have {in_flight} submissions waiting for judging, please wait for their results"
+
+        soft_limit = self.config.get("queue_soft_limit", 0)
+        if soft_limit and not (contest_id and self.config.get("contest_exempt", True)):
+            monitor = JudgeQueueMonitor()
+            depth = monitor.depth()["total"]
+            if depth >= soft_limit:
+                wait = monitor.estimated_wait(depth)
+                if wait is None:
+                    return "The judge server is busy, please try again later"
+                return f"The judge server is busy, please try again in about {wait} seconds"
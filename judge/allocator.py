@@ -0,0 +1,102 @@
+import time
+
+from judge.registry import JudgeServerRegistry
+from judge.scheduling import get_schedule_policy, judge_server_capacity
+from utils.cache import cache, redis_script
+from utils.constants import CacheKey
+from utils.shortcuts import rand_str
+
+# KEYS: 每台判题机的租约 zset, member 为租约 id, score 为过期时间
+# ARGV: now, expire_at, lease_id, capacity_1, cost_1, capacity_2, cost_2, ...
+# 先清理过期租约，再在仍有空闲槽位的判题机中选出 (used + 1) * cost / capacity 最小的一台，写入租约后返回其在 KEYS 中的下标
+_ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local best, best_score = nil, nil
+for i, key in ipairs(KEYS) do
+    redis.call("ZREMRANGEBYSCORE", key, "-inf", now)
+    local used = redis.call("ZCARD", key)
+    local capacity = tonumber(ARGV[2 * i + 2])
+    local score = (used + 1) * tonumber(ARGV[2 * i + 3]) / capacity
+    if used < capacity and (best_score == nil or score < best_score) then
+        best, best_score = i, score
+    end
+end
+if best then
+    redis.call("ZADD", KEYS[best], ARGV[2], ARGV[3])
+end
+return best
+"""
+
+
+def _lease_key(server_id):
+    return f"{CacheKey.judge_server_leases}:{server_id}"
+
+
+class JudgeSlotLease:
+    def __init__(self, server, lease_id, expire_at):
+        self.server = server
+        self.lease_id = lease_id
+        self.expire_at = expire_at
+
+
+class JudgeSlotAllocator:
+    """
+    判题机槽位分配
+    每个被占用的槽位是 redis 中一个带过期时间的租约，申请和释放都是一次原子操作，不再对 judge_server 表加行锁。
+    判题进程异常退出时没有释放的租约会在过期后被回收，不需要重启服务来重置 task_number
+    """
+    default_lease_timeout = 600
+
+    capacity = staticmethod(judge_server_capacity)
+
+    @staticmethod
+    def lease_timeout(problem):
+        """
+        租约时长为编译时间加上所有测试点的最长运行时间（判题机的 real_time 限制为 cpu_time 的 3 倍）, 再留出网络传输的余量
+        """
+        test_case_number = max(len(problem.test_case_score or []), 1)
+        return 60 + problem.time_limit * 3 * test_case_number // 1000
+
+    def available_servers(self):
+        return [server for server in JudgeServerRegistry().alive_servers() if not server.is_disabled]
+
+    def acquire(self, timeout=None, exclude=()):
+        servers = [server for server in self.available_servers() if server.id not in exclude]
+        if not servers:
+            return None
+        now = time.time()
+        expire_at = now + (timeout or self.default_lease_timeout)
+        lease_id = rand_str()
+        args = [now, expire_at, lease_id]
+        for server, cost in zip(servers, get_schedule_policy().costs(servers)):
+            args += [self.capacity(server), cost]
+        index = redis_script(_ACQUIRE_SCRIPT)(keys=[_lease_key(server.id) for server in servers], args=args)
+        if index is None:
+            return None
+        return JudgeSlotLease(servers[index - 1], lease_id, expire_at)
+
+    def release(self, lease):
+        cache.zrem(_lease_key(lease.server.id), lease.lease_id)
+
+    def reap(self, server_id):
+        """
+        回收过期的租约, 返回回收的数量
+        """
+        return cache.zremrangebyscore(_lease_key(server_id), "-inf", time.time())
+
+    def free_slots(self):
+        """
+        所有可用判题机上的空闲槽位总数
+        """
+        servers = self.available_servers()
+        usage = self.usage([server.id for server in servers])
+        return sum(max(self.capacity(server) - usage[server.id], 0) for server in servers)
+
+    def usage(self, server_ids):
+        """
+        return {server_id: 未过期的租约数}
+        """
+        pipe = cache.pipeline()
+        for server_id in server_ids:
+            pipe.zcount(_lease_key(server_id), time.time(), "+inf")
+        return dict(zip(server_ids, pipe.execute()))
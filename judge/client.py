@@ -0,0 +1,82 @@
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.cache import cache
+from utils.constants import CacheKey
+
+logger = logging.getLogger(__name__)
+
+
+class JudgeServerUnavailable(Exception):
+    """
+    连接判题机失败，可以换一台判题机重试
+    """
+    pass
+
+
+class JudgeSessionPool:
+    """
+    每个进程按判题机的 service_url 复用一个 requests.Session, 保持长连接，不再为每次判题新建 TCP 连接
+    各判题机的请求数、失败数、超时数和总耗时记录在 redis 中，便于观察
+    """
+    connect_timeout = 3
+
+    def __init__(self, pool_maxsize=16):
+        self.pool_maxsize = pool_maxsize
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get_session(self, service_url):
+        session = self._sessions.get(service_url)
+        if session:
+            return session
+        with self._lock:
+            if service_url not in self._sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize, max_retries=0)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[service_url] = session
+            return self._sessions[service_url]
+
+    def post(self, service_url, url, read_timeout, **kwargs):
+        session = self.get_session(service_url)
+        start = time.time()
+        try:
+            resp = session.post(url, timeout=(self.connect_timeout, read_timeout), **kwargs)
+            self._record(service_url, start)
+            return resp
+        except (requests.ConnectionError, requests.ConnectTimeout) as e:
+            self._record(service_url, start, "connect_errors")
+            raise JudgeServerUnavailable(str(e))
+        except requests.ReadTimeout:
+            self._record(service_url, start, "timeouts")
+            raise
+
+    def _record(self, service_url, start, error=None):
+        pipe = cache.pipeline()
+        pipe.hincrby(CacheKey.judge_server_http_stats, f"{service_url}:requests", 1)
+        pipe.hincrby(CacheKey.judge_server_http_stats, f"{service_url}:elapsed_ms", int((time.time() - start) * 1000))
+        if error:
+            pipe.hincrby(CacheKey.judge_server_http_stats, f"{service_url}:{error}", 1)
+        try:
+            pipe.execute()
+        except Exception as e:
+            logger.exception(e)
+
+    def metrics(self):
+        """
+        return {service_url: {"requests": 10, "elapsed_ms": 1200, "connect_errors": 0, "timeouts": 1, "pooled": True}}
+        """
+        ret = {}
+        for field, value in cache.hgetall(CacheKey.judge_server_http_stats).items():
+            service_url, name = field.decode("utf-8").rsplit(":", 1)
+            ret.setdefault(service_url, {"pooled": service_url in self._sessions})[name] = int(value)
+        return ret
+
+
+session_pool = JudgeSessionPool()
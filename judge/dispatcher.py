@@ -1,67 +1,114 @@
 import hashlib
 import json
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urljoin
 
-import requests
-from django.db import transaction, IntegrityError
-from django.db.models import F
+from redis.exceptions import LockError
 
-from account.models import User
 from conf.models import JudgeServer
-from contest.models import ContestRuleType, ACMContestRank, OIContestRank, ContestStatus
-from options.options import SysOptions
+from contest.models import ContestStatus
+from judge.allocator import JudgeSlotAllocator
+from judge.client import JudgeServerUnavailable, session_pool
+from judge.ingestion import VerdictIngestion
+from judge.registry import SPJArtifactTracker
+from judge.scheduling import JudgeLatencyTracker
+from judge.sharding import TestCaseSharder
+from judge.verdict_cache import VerdictCache
+from options.options import SysOptions, language_registry
 from problem.models import Problem, ProblemRuleType
 from problem.utils import parse_problem_template
 from submission.models import JudgeStatus, Submission
 from utils.cache import cache
-from utils.constants import CacheKey
+from utils.constants import CacheKey, JudgePriority
 
 logger = logging.getLogger(__name__)
 
 
+# 没有空闲判题机时各优先级的提交分别排队，派发时按权重轮流从各队列中取出
+JUDGE_PRIORITY_WEIGHTS = {
+    JudgePriority.CONTEST: 6,
+    JudgePriority.PRACTICE: 3,
+    JudgePriority.REJUDGE: 1,
+}
+
+
+def waiting_queue_key(priority):
+    return f"{CacheKey.waiting_queue}:{priority}"
+
+
+def async_judge_queue_key(priority):
+    return f"{CacheKey.async_judge_queue}:{priority}"
+
+
 # 继续处理在队列中的问题
+# 判题机容量变化时（判题结束、心跳、判题机重新启用）按空闲槽位数尽量多地重新派发排队的提交
 def process_pending_task():
-    if cache.llen(CacheKey.waiting_queue):
+    pipe = cache.pipeline()
+    for priority in JUDGE_PRIORITY_WEIGHTS:
+        pipe.llen(waiting_queue_key(priority))
+    if not any(pipe.execute()):
+        return
+    # 同一时间只允许一个进程派发，防止重复派发
+    lock = cache.lock(CacheKey.waiting_queue_lock, timeout=10)
+    if not lock.acquire(blocking=False):
+        return
+    try:
         # 防止循环引入
-        from judge.tasks import judge_task
-        tmp_data = cache.rpop(CacheKey.waiting_queue)
-        if tmp_data:
-            data = json.loads(tmp_data.decode("utf-8"))
-            judge_task.send(**data)
+        from judge.tasks import JUDGE_TASKS
+        free_slots = JudgeSlotAllocator().free_slots()
+        while free_slots > 0:
+            sent = 0
+            for priority, weight in JUDGE_PRIORITY_WEIGHTS.items():
+                for _ in range(min(weight, free_slots)):
+                    tmp_data = cache.rpop(waiting_queue_key(priority))
+                    if not tmp_data:
+                        break
+                    data = json.loads(tmp_data.decode("utf-8"))
+                    JUDGE_TASKS[priority].send(**data)
+                    free_slots -= 1
+                    sent += 1
+            if not sent:
+                break
+    finally:
+        try:
+            lock.release()
+        except LockError:
+            pass
 
 
 class ChooseJudgeServer:
-    def __init__(self):
-        self.server = None
+    def __init__(self, timeout=None, exclude=()):
+        self.timeout = timeout
+        self.exclude = exclude
+        self.lease = None
+        self.allocator = JudgeSlotAllocator()
 
     def __enter__(self) -> [JudgeServer, None]:
-        with transaction.atomic():
-            servers = JudgeServer.objects.select_for_update().filter(is_disabled=False).order_by("task_number")
-            servers = [s for s in servers if s.status == "normal"]
-            for server in servers:
-                if server.task_number <= server.cpu_core * 2:
-                    server.task_number = F("task_number") + 1
-                    server.save(update_fields=["task_number"])
-                    self.server = server
-                    return server
-        return None
+        self.lease = self.allocator.acquire(timeout=self.timeout, exclude=self.exclude)
+        return self.lease.server if self.lease else None
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.server:
-            JudgeServer.objects.filter(id=self.server.id).update(task_number=F("task_number") - 1)
+        if self.lease:
+            self.allocator.release(self.lease)
 
 
 class DispatcherBase(object):
     def __init__(self):
         self.token = hashlib.sha256(SysOptions.judge_server_token.encode("utf-8")).hexdigest()
 
-    def _request(self, url, data=None):
+    def _request(self, server, path, data=None, timeout=60):
+        """
+        连接判题机失败时抛出 JudgeServerUnavailable, 调用方可以换一台判题机重试；其他错误返回 None
+        """
         kwargs = {"headers": {"X-Judge-Server-Token": self.token}}
         if data:
             kwargs["json"] = data
         try:
-            return requests.post(url, **kwargs).json()
+            return session_pool.post(server.service_url, urljoin(server.service_url, path), timeout, **kwargs).json()
+        except JudgeServerUnavailable:
+            raise
         except Exception as e:
             logger.exception(e)
 
@@ -69,8 +116,7 @@ class DispatcherBase(object):
 class SPJCompiler(DispatcherBase):
     def __init__(self, spj_code, spj_version, spj_language):
         super().__init__()
-        spj_compile_config = list(filter(lambda config: spj_language == config["name"], SysOptions.spj_languages))[0]["spj"][
-            "compile"]
+        spj_compile_config = language_registry.get_spj(spj_language)["compile"]
         self.data = {
             "src": spj_code,
             "spj_version": spj_version,
@@ -81,16 +127,28 @@ class SPJCompiler(DispatcherBase):
         with ChooseJudgeServer() as server:
             if not server:
                 return "No available judge_server"
-            result = self._request(urljoin(server.service_url, "compile_spj"), data=self.data)
-            if not result:
-                return "Failed to call judge server"
-            if result["err"]:
-                return result["data"]
+            return self.compile_on(server)
+
+    def compile_on(self, server):
+        try:
+            result = self._request(server, "compile_spj", data=self.data)
+        except JudgeServerUnavailable:
+            result = None
+        if not result:
+            return "Failed to call judge server"
+        if result["err"]:
+            return result["data"]
+        SPJArtifactTracker().add(server.id, self.data["spj_version"])
 
 
 class JudgeDispatcher(DispatcherBase):
-    def __init__(self, submission_id, problem_id):
+    # 连接判题机失败时最多尝试的判题机数量
+    max_failover = 3
+
+    def __init__(self, submission_id, problem_id, bulk=False):
         super().__init__()
+        # 批量重判的提交由 RejudgeJobRunner 在全部判完后统一更新统计
+        self.bulk = bulk
         self.submission = Submission.objects.get(id=submission_id)
         self.contest_id = self.submission.contest_id
         self.last_result = self.submission.result if self.submission.info else None
@@ -101,6 +159,30 @@ class JudgeDispatcher(DispatcherBase):
         else:
             self.problem = Problem.objects.get(id=problem_id)
 
+    @property
+    def priority(self):
+        if self.bulk or self.last_result is not None:
+            return JudgePriority.REJUDGE
+        if self.contest_id:
+            return JudgePriority.CONTEST
+        return JudgePriority.PRACTICE
+
+    @property
+    def early_exit(self):
+        return self.problem.rule_type == ProblemRuleType.ACM and self.problem.acm_early_exit
+
+    def _skip_after_first_failure(self, resp):
+        """
+        ACM 模式下只保留到第一个错误的测试点，其余测试点记录在 skipped_test_cases 中
+        """
+        for index, item in enumerate(resp["data"]):
+            if item["result"] != JudgeStatus.ACCEPTED:
+                resp["data"] = resp["data"][:index + 1]
+                break
+        judged = {str(item["test_case"]) for item in resp["data"]}
+        test_cases = [str(i) for i in range(1, len(self.problem.test_case_score) + 1)]
+        resp["skipped_test_cases"] = [item for item in test_cases if item not in judged]
+
     def _compute_statistic_info(self, resp_data):
         # 用时和内存占用保存为多个测试点中最长的那个
         self.submission.statistic_info["time_cost"] = max([x["cpu_time"] for x in resp_data])
@@ -122,15 +204,12 @@ class JudgeDispatcher(DispatcherBase):
                 return
             self.submission.statistic_info["score"] = score
 
-    def judge(self):
+    def build_request_data(self):
         language = self.submission.language
-        sub_config = list(filter(lambda item: language == item["name"], SysOptions.languages))[0]
+        sub_config = language_registry.get(language)
         spj_config = {}
         if self.problem.spj_code:
-            for lang in SysOptions.spj_languages:
-                if lang["name"] == self.problem.spj_language:
-                    spj_config = lang["spj"]
-                    break
+            spj_config = language_registry.get_spj(self.problem.spj_language) or {}
 
         if language in self.problem.template:
             template = parse_problem_template(self.problem.template[language])
@@ -151,15 +230,156 @@ class JudgeDispatcher(DispatcherBase):
             "spj_src": self.problem.spj_code,
             "io_mode": self.problem.io_mode
         }
+        if self.early_exit:
+            data["early_exit"] = True
+        self.request_data = data
+        return data
+
+    def cached_verdict(self):
+        """
+        之前判过完全相同的代码和题目数据时，直接使用缓存的结果
+        """
+        resp = VerdictCache().get(self.request_data)
+        if resp is None:
+            return False
+        self.handle_response(resp, cached=True)
+        return True
+
+    def requeue(self, reset_status=False):
+        """
+        没有空闲的判题机，放回等待队列，有判题机空闲时再重新派发
+        """
+        if reset_status:
+            Submission.objects.filter(id=self.submission.id).update(result=JudgeStatus.PENDING)
+        data = {"submission_id": self.submission.id, "problem_id": self.problem.id}
+        if self.bulk:
+            data["bulk"] = True
+        cache.lpush(waiting_queue_key(self.priority), json.dumps(data))
+
+    def mark_judging(self):
+        Submission.objects.filter(id=self.submission.id).update(result=JudgeStatus.JUDGING)
+
+    def plan_shards(self):
+        """
+        开启了分组判题的题目, 返回测试点的分组；否则返回 None
+        """
+        if self.problem.judge_shards <= 1:
+            return None
+        try:
+            shards = TestCaseSharder(self.problem.test_case_id).shard(self.problem.judge_shards)
+        except (OSError, ValueError, KeyError) as e:
+            logger.exception(e)
+            return None
+        return shards if len(shards) > 1 else None
+
+    def request_data_for(self, server, data):
+        """
+        判题机上已经编译过该版本的 spj 时不再发送 spj 代码
+        """
+        if data["spj_src"] and SPJArtifactTracker().has(server.id, data["spj_version"]):
+            return dict(data, spj_src=None)
+        return data
+
+    def track_spj_artifact(self, server, data, resp):
+        """
+        根据判题结果更新判题机上的 spj 记录，返回是否需要带上 spj 代码重新发送
+        """
+        if not self.problem.spj_code or not resp:
+            return False
+        tracker = SPJArtifactTracker()
+        if resp["err"] == "SPJCompileError":
+            tracker.discard(server.id, self.problem.spj_version)
+            return data["spj_src"] is None
+        if not resp["err"]:
+            tracker.add(server.id, self.problem.spj_version)
+        return False
+
+    def judge_on(self, server, data, timeout):
+        payload = self.request_data_for(server, data)
+        resp = self._request(server, "/judge", data=payload, timeout=timeout)
+        if self.track_spj_artifact(server, payload, resp):
+            # 判题机上的 spj 已经不存在了
+            resp = self._request(server, "/judge", data=data, timeout=timeout)
+            self.track_spj_artifact(server, data, resp)
+        return resp
 
-        with ChooseJudgeServer() as server:
-            if not server:
-                data = {"submission_id": self.submission.id, "problem_id": self.problem.id}
-                cache.lpush(CacheKey.waiting_queue, json.dumps(data))
-                return
-            Submission.objects.filter(id=self.submission.id).update(result=JudgeStatus.JUDGING)
-            resp = self._request(urljoin(server.service_url, "/judge"), data=data)
+    def judge(self):
+        data = self.build_request_data()
+        if self.cached_verdict():
+            return
+        shards = self.plan_shards()
+        if shards:
+            self.judge_sharded(data, shards)
+            return
+        timeout = JudgeSlotAllocator.lease_timeout(self.problem)
+        tried_servers = []
+        while True:
+            with ChooseJudgeServer(timeout=timeout, exclude=tried_servers) as server:
+                if not server:
+                    self.requeue(reset_status=bool(tried_servers))
+                    return
+                self.mark_judging()
+                try:
+                    start = time.time()
+                    resp = self.judge_on(server, data, timeout)
+                    if resp:
+                        JudgeLatencyTracker().record(server, time.time() - start)
+                    break
+                except JudgeServerUnavailable as e:
+                    # 连接不上的判题机直接换下一台，不在这里等待
+                    logger.warning(f"Judge server {server.hostname} is unavailable: {e}")
+                    tried_servers.append(server.id)
+                    if len(tried_servers) >= self.max_failover:
+                        resp = None
+                        break
+        self.handle_response(resp)
+
+    def judge_sharded(self, data, shards):
+        """
+        每组测试点发送到一台判题机，同时判题后合并结果。判题机不够时多组依次在同一台判题机上判题
+        """
+        allocator = JudgeSlotAllocator()
+        timeout = JudgeSlotAllocator.lease_timeout(self.problem)
+        leases = []
+        for _ in shards:
+            lease = allocator.acquire(timeout=timeout, exclude=[item.server.id for item in leases])
+            if not lease:
+                break
+            leases.append(lease)
+        if not leases:
+            self.requeue()
+            return
+        self.mark_judging()
+        servers = [lease.server for lease in leases]
+        groups = [list(range(len(shards)))[i::len(servers)] for i in range(len(servers))]
+        responses = [None] * len(shards)
+
+        def run(group_index):
+            for shard_index in groups[group_index]:
+                shard_data = dict(data, test_case_id=shards[shard_index][0])
+                # 连接失败时依次换其余的判题机
+                for i in range(len(servers)):
+                    server = servers[(group_index + i) % len(servers)]
+                    try:
+                        responses[shard_index] = self.judge_on(server, shard_data, timeout)
+                        break
+                    except JudgeServerUnavailable as e:
+                        logger.warning(f"Judge server {server.hostname} is unavailable: {e}")
 
+        try:
+            with ThreadPoolExecutor(max_workers=len(servers)) as executor:
+                list(executor.map(run, range(len(servers))))
+        finally:
+            for lease in leases:
+                allocator.release(lease)
+        self.handle_response(TestCaseSharder.merge(shards, responses))
+
+    def handle_response(self, resp, cached=False):
+        """
+        保存判题结果，题目、用户和比赛排名的统计由 VerdictIngestion 异步批量更新
+        """
+        if not cached:
+            VerdictCache().set(self.request_data, resp)
         if not resp:
             Submission.objects.filter(id=self.submission.id).update(result=JudgeStatus.SYSTEM_ERROR)
             return
@@ -170,6 +390,8 @@ class JudgeDispatcher(DispatcherBase):
             self.submission.statistic_info["score"] = 0
         else:
             resp["data"].sort(key=lambda x: int(x["test_case"]))
+            if self.early_exit:
+                self._skip_after_first_failure(resp)
             self.submission.info = resp
             self._compute_statistic_info(resp["data"])
             error_test_case = list(filter(lambda case: case["result"] != 0, resp["data"]))
@@ -183,221 +405,19 @@ class JudgeDispatcher(DispatcherBase):
                 self.submission.result = JudgeStatus.PARTIALLY_ACCEPTED
         self.submission.save()
 
-        if self.contest_id:
-            if self.contest.status != ContestStatus.CONTEST_UNDERWAY or \
-                    User.objects.get(id=self.submission.user_id).is_contest_admin(self.contest):
-                logger.info(
-                    "Contest debug mode, id: " + str(self.contest_id) + ", submission id: " + self.submission.id)
-                return
-            with transaction.atomic():
-                self.update_contest_problem_status()
-                self.update_contest_rank()
-        else:
-            if self.last_result:
-                self.update_problem_status_rejudge()
-            else:
-                self.update_problem_status()
+        if not self.bulk:
+            VerdictIngestion().publish(self.verdict_event())
 
         # 至此判题结束，尝试处理任务队列中剩余的任务
         process_pending_task()
 
-    def update_problem_status_rejudge(self):
-        result = str(self.submission.result)
-        problem_id = str(self.problem.id)
-        with transaction.atomic():
-            # update problem status
-            problem = Problem.objects.select_for_update().get(contest_id=self.contest_id, id=self.problem.id)
-            if self.last_result != JudgeStatus.ACCEPTED and self.submission.result == JudgeStatus.ACCEPTED:
-                problem.accepted_number += 1
-            problem_info = problem.statistic_info
-            problem_info[self.last_result] = problem_info.get(self.last_result, 1) - 1
-            problem_info[result] = problem_info.get(result, 0) + 1
-            problem.save(update_fields=["accepted_number", "statistic_info"])
-
-            profile = User.objects.select_for_update().get(id=self.submission.user_id).userprofile
-            if problem.rule_type == ProblemRuleType.ACM:
-                acm_problems_status = profile.acm_problems_status.get("problems", {})
-                if acm_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    acm_problems_status[problem_id]["status"] = self.submission.result
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        profile.accepted_number += 1
-                profile.acm_problems_status["problems"] = acm_problems_status
-                profile.save(update_fields=["accepted_number", "acm_problems_status"])
-
-            else:
-                oi_problems_status = profile.oi_problems_status.get("problems", {})
-                score = self.submission.statistic_info["score"]
-                if oi_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    # minus last time score, add this tim score
-                    profile.add_score(this_time_score=score,
-                                      last_time_score=oi_problems_status[problem_id]["score"])
-                    oi_problems_status[problem_id]["score"] = score
-                    oi_problems_status[problem_id]["status"] = self.submission.result
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        profile.accepted_number += 1
-                profile.oi_problems_status["problems"] = oi_problems_status
-                profile.save(update_fields=["accepted_number", "oi_problems_status"])
-
-    def update_problem_status(self):
-        result = str(self.submission.result)
-        problem_id = str(self.problem.id)
-        with transaction.atomic():
-            # update problem status
-            problem = Problem.objects.select_for_update().get(contest_id=self.contest_id, id=self.problem.id)
-            problem.submission_number += 1
-            if self.submission.result == JudgeStatus.ACCEPTED:
-                problem.accepted_number += 1
-            problem_info = problem.statistic_info
-            problem_info[result] = problem_info.get(result, 0) + 1
-            problem.save(update_fields=["accepted_number", "submission_number", "statistic_info"])
-
-            # update_userprofile
-            user = User.objects.select_for_update().get(id=self.submission.user_id)
-            user_profile = user.userprofile
-            user_profile.submission_number += 1
-            if problem.rule_type == ProblemRuleType.ACM:
-                acm_problems_status = user_profile.acm_problems_status.get("problems", {})
-                if problem_id not in acm_problems_status:
-                    acm_problems_status[problem_id] = {"status": self.submission.result, "_id": self.problem._id}
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        user_profile.accepted_number += 1
-                elif acm_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    acm_problems_status[problem_id]["status"] = self.submission.result
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        user_profile.accepted_number += 1
-                user_profile.acm_problems_status["problems"] = acm_problems_status
-                user_profile.save(update_fields=["submission_number", "accepted_number", "acm_problems_status"])
-
-            else:
-                oi_problems_status = user_profile.oi_problems_status.get("problems", {})
-                score = self.submission.statistic_info["score"]
-                if problem_id not in oi_problems_status:
-                    user_profile.add_score(score)
-                    oi_problems_status[problem_id] = {"status": self.submission.result,
-                                                      "_id": self.problem._id,
-                                                      "score": score}
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        user_profile.accepted_number += 1
-                elif oi_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    # minus last time score, add this time score
-                    user_profile.add_score(this_time_score=score,
-                                           last_time_score=oi_problems_status[problem_id]["score"])
-                    oi_problems_status[problem_id]["score"] = score
-                    oi_problems_status[problem_id]["status"] = self.submission.result
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        user_profile.accepted_number += 1
-                user_profile.oi_problems_status["problems"] = oi_problems_status
-                user_profile.save(update_fields=["submission_number", "accepted_number", "oi_problems_status"])
-
-    def update_contest_problem_status(self):
-        with transaction.atomic():
-            user = User.objects.select_for_update().get(id=self.submission.user_id)
-            user_profile = user.userprofile
-            problem_id = str(self.problem.id)
-            if self.contest.rule_type == ContestRuleType.ACM:
-                contest_problems_status = user_profile.acm_problems_status.get("contest_problems", {})
-                if problem_id not in contest_problems_status:
-                    contest_problems_status[problem_id] = {"status": self.submission.result, "_id": self.problem._id}
-                elif contest_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    contest_problems_status[problem_id]["status"] = self.submission.result
-                else:
-                    # 如果已AC， 直接跳过 不计入任何计数器
-                    return
-                user_profile.acm_problems_status["contest_problems"] = contest_problems_status
-                user_profile.save(update_fields=["acm_problems_status"])
-
-            elif self.contest.rule_type == ContestRuleType.OI:
-                contest_problems_status = user_profile.oi_problems_status.get("contest_problems", {})
-                score = self.submission.statistic_info["score"]
-                if problem_id not in contest_problems_status:
-                    contest_problems_status[problem_id] = {"status": self.submission.result,
-                                                           "_id": self.problem._id,
-                                                           "score": score}
-                else:
-                    contest_problems_status[problem_id]["score"] = score
-                    contest_problems_status[problem_id]["status"] = self.submission.result
-                user_profile.oi_problems_status["contest_problems"] = contest_problems_status
-                user_profile.save(update_fields=["oi_problems_status"])
-
-            problem = Problem.objects.select_for_update().get(contest_id=self.contest_id, id=self.problem.id)
-            result = str(self.submission.result)
-            problem_info = problem.statistic_info
-            problem_info[result] = problem_info.get(result, 0) + 1
-            problem.submission_number += 1
-            if self.submission.result == JudgeStatus.ACCEPTED:
-                problem.accepted_number += 1
-            problem.save(update_fields=["submission_number", "accepted_number", "statistic_info"])
-
-    def update_contest_rank(self):
-        if self.contest.rule_type == ContestRuleType.OI or self.contest.real_time_rank:
-            cache.delete(f"{CacheKey.contest_rank_cache}:{self.contest.id}")
-
-        def get_rank(model):
-            return model.objects.select_for_update().get(user_id=self.submission.user_id, contest=self.contest)
-
-        if self.contest.rule_type == ContestRuleType.ACM:
-            model = ACMContestRank
-            func = self._update_acm_contest_rank
-        else:
-            model = OIContestRank
-            func = self._update_oi_contest_rank
-
-        try:
-            rank = get_rank(model)
-        except model.DoesNotExist:
-            try:
-                model.objects.create(user_id=self.submission.user_id, contest=self.contest)
-                rank = get_rank(model)
-            except IntegrityError:
-                rank = get_rank(model)
-        func(rank)
-
-    def _update_acm_contest_rank(self, rank):
-        info = rank.submission_info.get(str(self.submission.problem_id))
-        # 因前面更改过，这里需要重新获取
-        problem = Problem.objects.select_for_update().get(contest_id=self.contest_id, id=self.problem.id)
-        # 此题提交过
-        if info:
-            if info["is_ac"]:
-                return
-
-            rank.submission_number += 1
-            if self.submission.result == JudgeStatus.ACCEPTED:
-                rank.accepted_number += 1
-                info["is_ac"] = True
-                info["ac_time"] = (self.submission.create_time - self.contest.start_time).total_seconds()
-                rank.total_time += info["ac_time"] + info["error_number"] * 20 * 60
-
-                if problem.accepted_number == 1:
-                    info["is_first_ac"] = True
-            elif self.submission.result != JudgeStatus.COMPILE_ERROR:
-                info["error_number"] += 1
-
-        # 第一次提交
-        else:
-            rank.submission_number += 1
-            info = {"is_ac": False, "ac_time": 0, "error_number": 0, "is_first_ac": False}
-            if self.submission.result == JudgeStatus.ACCEPTED:
-                rank.accepted_number += 1
-                info["is_ac"] = True
-                info["ac_time"] = (self.submission.create_time - self.contest.start_time).total_seconds()
-                rank.total_time += info["ac_time"]
-
-                if problem.accepted_number == 1:
-                    info["is_first_ac"] = True
-
-            elif self.submission.result != JudgeStatus.COMPILE_ERROR:
-                info["error_number"] = 1
-        rank.submission_info[str(self.submission.problem_id)] = info
-        rank.save()
-
-    def _update_oi_contest_rank(self, rank):
-        problem_id = str(self.submission.problem_id)
-        current_score = self.submission.statistic_info["score"]
-        last_score = rank.submission_info.get(problem_id)
-        if last_score:
-            rank.total_score = rank.total_score - last_score + current_score
-        else:
-            rank.total_score = rank.total_score + current_score
-        rank.submission_info[problem_id] = current_score
-        rank.save()
+    def verdict_event(self):
+        event = {"submission_id": self.submission.id, "problem_id": self.problem.id, "contest_id": self.contest_id,
+                 "user_id": self.submission.user_id, "result": self.submission.result,
+                 "score": self.submission.statistic_info.get("score", 0), "last_result": self.last_result,
+                 "contest_time": 0, "contest_underway": False}
+        if self.contest_id:
+            event["contest_time"] = (self.submission.create_time - self.contest.start_time).total_seconds()
+            # 按出结果时比赛的状态判断是否计入统计
+            event["contest_underway"] = self.contest.status == ContestStatus.CONTEST_UNDERWAY
+        return event
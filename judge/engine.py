@@ -0,0 +1,144 @@
+import asyncio
+import functools
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+import aiohttp
+from django.db import close_old_connections
+
+from account.models import User
+from judge.allocator import JudgeSlotAllocator
+from judge.client import JudgeServerUnavailable, JudgeSessionPool
+from judge.dispatcher import JudgeDispatcher, JUDGE_PRIORITY_WEIGHTS, async_judge_queue_key
+from judge.scheduling import JudgeLatencyTracker
+from utils.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncJudgeEngine:
+    """
+    异步判题模式（JUDGE_DISPATCH_MODE=async）
+    judge_task 只把任务放入 redis 队列，由少数几个进程在 asyncio 事件循环中同时保持大量进行中的判题请求，
+    并发数只受判题机数量限制，而不是 dramatiq 的进程数和线程数。
+    读写数据库的部分（准备判题数据、保存结果、更新题目和排名统计）仍然在线程池中调用 JudgeDispatcher 完成
+    """
+    max_failover = JudgeDispatcher.max_failover
+
+    def __init__(self, concurrency=200, threads=8):
+        self.concurrency = concurrency
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        # brpop 会阻塞，单独使用一个线程
+        self.poller = ThreadPoolExecutor(max_workers=1)
+        self.allocator = JudgeSlotAllocator()
+        self.latency_tracker = JudgeLatencyTracker()
+        # 按优先级从高到低，brpop 总是先取高优先级队列中的任务
+        self.queue_keys = [async_judge_queue_key(priority) for priority in JUDGE_PRIORITY_WEIGHTS]
+
+    def run(self):
+        asyncio.run(self.main())
+
+    @staticmethod
+    def _call(func, *args):
+        close_old_connections()
+        try:
+            return func(*args)
+        finally:
+            close_old_connections()
+
+    async def _in_thread(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(self._call, func, *args))
+
+    async def _pop(self):
+        loop = asyncio.get_running_loop()
+        item = await loop.run_in_executor(self.poller, functools.partial(cache.brpop, self.queue_keys, 1))
+        if item:
+            return json.loads(item[1].decode("utf-8"))
+
+    async def main(self):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            while True:
+                await semaphore.acquire()
+                try:
+                    item = await self._pop()
+                except Exception as e:
+                    logger.exception(e)
+                    item = None
+                if not item:
+                    semaphore.release()
+                    continue
+                task = asyncio.create_task(self.judge(session, item["submission_id"], item["problem_id"],
+                                                      item.get("bulk", False)))
+                task.add_done_callback(lambda _: semaphore.release())
+
+    @staticmethod
+    def _prepare(submission_id, problem_id, bulk=False):
+        dispatcher = JudgeDispatcher(submission_id, problem_id, bulk=bulk)
+        if User.objects.filter(id=dispatcher.submission.user_id, is_disabled=True).exists():
+            return None
+        return dispatcher
+
+    async def judge(self, session, submission_id, problem_id, bulk=False):
+        try:
+            dispatcher = await self._in_thread(self._prepare, submission_id, problem_id, bulk)
+            if not dispatcher:
+                return
+            data = await self._in_thread(dispatcher.build_request_data)
+            if await self._in_thread(dispatcher.cached_verdict):
+                return
+            shards = await self._in_thread(dispatcher.plan_shards)
+            if shards:
+                # 分组判题的题目较少，直接在线程池中完成
+                await self._in_thread(dispatcher.judge_sharded, data, shards)
+                return
+            timeout = JudgeSlotAllocator.lease_timeout(dispatcher.problem)
+            tried_servers = []
+            while True:
+                lease = await self._in_thread(self.allocator.acquire, timeout, tried_servers)
+                if not lease:
+                    await self._in_thread(dispatcher.requeue, bool(tried_servers))
+                    return
+                try:
+                    await self._in_thread(dispatcher.mark_judging)
+                    start = time.time()
+                    resp = await self._judge_on(session, dispatcher, lease.server, data, timeout)
+                    if resp:
+                        await self._in_thread(self.latency_tracker.record, lease.server, time.time() - start)
+                    break
+                except JudgeServerUnavailable as e:
+                    logger.warning(f"Judge server {lease.server.hostname} is unavailable: {e}")
+                    tried_servers.append(lease.server.id)
+                    if len(tried_servers) >= self.max_failover:
+                        resp = None
+                        break
+                finally:
+                    await self._in_thread(self.allocator.release, lease)
+            await self._in_thread(dispatcher.handle_response, resp)
+        except Exception as e:
+            logger.exception(e)
+
+    async def _judge_on(self, session, dispatcher, server, data, timeout):
+        payload = await self._in_thread(dispatcher.request_data_for, server, data)
+        resp = await self._request(session, dispatcher, server, payload, timeout)
+        if await self._in_thread(dispatcher.track_spj_artifact, server, payload, resp):
+            resp = await self._request(session, dispatcher, server, data, timeout)
+            await self._in_thread(dispatcher.track_spj_artifact, server, data, resp)
+        return resp
+
+    @staticmethod
+    async def _request(session, dispatcher, server, data, timeout):
+        client_timeout = aiohttp.ClientTimeout(total=None, connect=JudgeSessionPool.connect_timeout, sock_read=timeout)
+        try:
+            async with session.post(urljoin(server.service_url, "/judge"), json=data, timeout=client_timeout,
+                                    headers={"X-Judge-Server-Token": dispatcher.token}) as resp:
+                return await resp.json(content_type=None)
+        except aiohttp.ClientConnectorError as e:
+            raise JudgeServerUnavailable(str(e))
+        except Exception as e:
+            logger.exception(e)
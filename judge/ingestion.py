@@ -0,0 +1,291 @@
+import json
+import logging
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+from redis.exceptions import LockError
+
+from account.models import AdminType, User, UserProfile
+from contest.freeze import ScoreboardFreeze
+from contest.models import ACMContestRank, Contest, ContestRuleType, OIContestRank
+from contest.scoreboard import ContestScoreboard, load_rank_penalty
+from contest.stream import ScoreboardStream
+from problem.counters import ProblemCounters
+from problem.models import Problem, ProblemRuleType, UserProblemStatus
+from submission.models import JudgeStatus
+from utils.cache import cache
+from utils.constants import CacheKey
+
+logger = logging.getLogger(__name__)
+
+
+class VerdictIngestion:
+    """
+    判题结果保存后只发布一个事件，题目、用户和比赛排名的统计由 ingest_verdicts_task 批量更新。
+    同一批事件中每个题目、用户和排名只加锁和写入一次，判题的 worker 不再等待这些行锁
+
+    事件的格式
+    {"submission_id": "xxx", "problem_id": 1, "contest_id": None, "user_id": 1, "result": 0, "score": 0,
+     "last_result": None, "contest_time": 0, "contest_underway": True}
+    last_result 不为 None 时是重判，contest_time 是提交时间距离比赛开始的秒数
+    """
+    batch_size = 500
+    # 第一个事件发布后等待一段时间再处理，使一批中包含更多的事件
+    flush_delay = 200
+
+    def publish(self, event):
+        # 避免循环引用
+        from judge.tasks import ingest_verdicts_task
+
+        cache.lpush(CacheKey.verdict_events, json.dumps(event))
+        if cache.set(CacheKey.verdict_ingestion_scheduled, 1, timeout=60, nx=True):
+            ingest_verdicts_task.send_with_options(delay=self.flush_delay)
+
+    def run(self):
+        """
+        处理队列中所有的事件，其他进程正在处理时返回 False
+        """
+        cache.delete(CacheKey.verdict_ingestion_scheduled)
+        lock = cache.lock(CacheKey.verdict_ingestion_lock, timeout=60)
+        if not lock.acquire(blocking=False):
+            return False
+        try:
+            while True:
+                # 新的事件从左侧加入，从右侧取出最早的一批，处理成功后再删除，中途失败的事件下次重新处理
+                items = cache.lrange(CacheKey.verdict_events, -self.batch_size, -1)
+                if not items:
+                    break
+                events = [json.loads(item.decode("utf-8")) for item in reversed(items)]
+                self.apply(events)
+                cache.ltrim(CacheKey.verdict_events, 0, -len(items) - 1)
+        finally:
+            try:
+                lock.release()
+            except LockError:
+                pass
+        return True
+
+    def apply(self, events):
+        contests = {contest.id: contest for contest in
+                    Contest.objects.filter(id__in={event["contest_id"] for event in events if event["contest_id"]})}
+        events = self._exclude_contest_debug(events, contests)
+        if not events:
+            return
+        with transaction.atomic():
+            # 题目的计数写入 ProblemCounters, 不再锁 Problem 行
+            problems = {problem.id: problem for problem in
+                        Problem.objects.filter(id__in={event["problem_id"] for event in events})}
+            # 按固定的顺序加锁，避免多个进程之间死锁
+            profiles = {profile.user_id: profile for profile in UserProfile.objects.select_for_update()
+                        .filter(user_id__in={event["user_id"] for event in events}).order_by("user_id")}
+            events = self._exclude_missing(events, contests, problems, profiles)
+            if not events:
+                return
+
+            counted = self.update_profiles(events, problems, profiles)
+            self.update_problems(counted, problems)
+            UserProfile.objects.bulk_update(profiles.values(), ["submission_number", "accepted_number", "total_score"])
+
+            contest_events = defaultdict(list)
+            for event in events:
+                if event["contest_id"]:
+                    contest_events[event["contest_id"]].append(event)
+            for contest_id in sorted(contest_events):
+                self.update_contest_rank(contests[contest_id], contest_events[contest_id])
+
+    def _exclude_missing(self, events, contests, problems, profiles):
+        """
+        提交之后题目、用户或比赛被删除的事件无法处理，丢弃并记录日志，避免整批事件一直重试失败
+        """
+        ret = []
+        for event in events:
+            if event["problem_id"] not in problems or event["user_id"] not in profiles or \
+                    (event["contest_id"] and event["contest_id"] not in contests):
+                logger.warning(f"Drop verdict event of deleted problem, user or contest: {event}")
+                continue
+            ret.append(event)
+        return ret
+
+    @staticmethod
+    def super_admin_ids(user_ids):
+        return set(User.objects.filter(id__in=user_ids, admin_type=AdminType.SUPER_ADMIN).values_list("id", flat=True))
+
+    @staticmethod
+    def is_contest_debug(contest, user_id, underway, super_admins):
+        """
+        比赛未在进行中或者比赛管理员的提交不计入统计，StatisticsRecomputer 重新计算时使用相同的规则
+        """
+        return not underway or user_id in super_admins or user_id == contest.created_by_id
+
+    @staticmethod
+    def is_resubmission_after_ac(problem, status):
+        """
+        ACM 比赛中已经 AC 的题目再次提交不计入任何计数器
+        """
+        return bool(problem.contest_id) and problem.rule_type == ProblemRuleType.ACM and \
+            status == JudgeStatus.ACCEPTED
+
+    def _exclude_contest_debug(self, events, contests):
+        super_admins = self.super_admin_ids({event["user_id"] for event in events if event["contest_id"]})
+        ret = []
+        for event in events:
+            contest = contests.get(event["contest_id"])
+            if contest and self.is_contest_debug(contest, event["user_id"], event["contest_underway"], super_admins):
+                logger.info(f"Contest debug mode, id: {contest.id}, submission id: {event['submission_id']}")
+                continue
+            ret.append(event)
+        return ret
+
+    def update_profiles(self, events, problems, profiles):
+        """
+        return 需要计入题目统计的事件，ACM 比赛中已经 AC 的题目再次提交不计入
+        """
+        statuses = {(status.user_id, status.problem_id): status for status in UserProblemStatus.objects
+                    .select_for_update().filter(user_id__in=profiles.keys(), problem_id__in=problems.keys())
+                    .order_by("id")}
+        counted = []
+        for event in events:
+            problem = problems[event["problem_id"]]
+            profile = profiles[event["user_id"]]
+            key = (event["user_id"], event["problem_id"])
+            status = statuses.get(key)
+            if status is None:
+                status = statuses[key] = UserProblemStatus(user_id=event["user_id"], problem_id=problem.id,
+                                                           contest_id=problem.contest_id, status=None)
+            if event["contest_id"]:
+                if self._update_contest_problem_status(event, problem, status):
+                    counted.append(event)
+            else:
+                if event["last_result"] is None:
+                    profile.submission_number += 1
+                self._update_problem_status(event, problem, profile, status)
+                counted.append(event)
+
+        now = timezone.now()
+        to_create, to_update = [], []
+        for status in statuses.values():
+            if status.status is None:
+                continue
+            status.last_update_time = now
+            (to_update if status.pk else to_create).append(status)
+        UserProblemStatus.objects.bulk_create(to_create)
+        UserProblemStatus.objects.bulk_update(to_update, ["status", "score", "last_update_time"])
+        return counted
+
+    def _update_problem_status(self, event, problem, profile, status):
+        result, score = event["result"], event["score"]
+        if status.status == JudgeStatus.ACCEPTED:
+            return
+        if problem.rule_type == ProblemRuleType.OI:
+            # minus last time score, add this time score
+            profile.total_score += score - status.score
+            status.score = score
+        status.status = result
+        if result == JudgeStatus.ACCEPTED:
+            profile.accepted_number += 1
+
+    def _update_contest_problem_status(self, event, problem, status):
+        if self.is_resubmission_after_ac(problem, status.status):
+            return False
+        if problem.rule_type != ProblemRuleType.ACM:
+            status.score = event["score"]
+        status.status = event["result"]
+        return True
+
+    def update_problems(self, events, problems):
+        counters = ProblemCounters()
+        # flush 会先取出增量再写入数据库，持有锁保证读到的数据库中的值和增量是一致的
+        with counters.lock():
+            live = counters.get_many(problems.keys())
+            accepted = {problem_id: accepted_number + live.get(problem_id, {}).get("accepted_number", 0)
+                        for problem_id, accepted_number in
+                        Problem.objects.filter(id__in=problems.keys()).values_list("id", "accepted_number")}
+            deltas = defaultdict(lambda: defaultdict(int))
+            for event in events:
+                problem_id = event["problem_id"]
+                result, last_result = event["result"], event["last_result"]
+                delta = deltas[problem_id]
+                if last_result is None:
+                    delta["submission_number"] += 1
+                else:
+                    delta[str(last_result)] -= 1
+                    if last_result == JudgeStatus.ACCEPTED:
+                        delta["accepted_number"] -= 1
+                        accepted[problem_id] -= 1
+                delta[str(result)] += 1
+                if result == JudgeStatus.ACCEPTED:
+                    delta["accepted_number"] += 1
+                    accepted[problem_id] += 1
+                    # 排名中的一血按题目统计处理到这个事件时的 AC 数判断
+                    event["first_ac"] = accepted[problem_id] == 1
+        # 数据库事务失败时这批事件会重新处理，提交后再写入增量
+        transaction.on_commit(lambda: counters.add(deltas))
+
+    def update_contest_rank(self, contest, events):
+        if contest.rule_type == ContestRuleType.ACM:
+            model = ACMContestRank
+            func = self._update_acm_contest_rank
+        else:
+            model = OIContestRank
+            func = self._update_oi_contest_rank
+        # 封榜后先保存封榜时的排名，这批判题结果只记为 pending
+        freeze = ScoreboardFreeze(contest)
+        frozen = freeze.started()
+        if frozen:
+            freeze.capture()
+        user_ids = {event["user_id"] for event in events}
+        model.objects.bulk_create([model(user_id=user_id, contest=contest) for user_id in user_ids],
+                                  ignore_conflicts=True)
+        ranks = {rank.user_id: rank for rank in model.objects.select_for_update()
+                 .filter(contest=contest, user_id__in=user_ids).order_by("user_id")}
+        # 刚创建的 rank 读取已有的违规和评价，之后由 contest.signals 维护
+        load_rank_penalty(contest, [rank for rank in ranks.values() if rank.submission_number == 0])
+        for event in events:
+            func(ranks[event["user_id"]], event)
+        for rank in ranks.values():
+            rank.update_penalty()
+        if model is ACMContestRank:
+            fields = ["submission_number", "accepted_number", "total_time", "submission_info", "violation_info",
+                      "reviewed", "penalty_time", "total_time_with_penalty", "final_total_time"]
+        else:
+            fields = ["submission_number", "total_score", "submission_info", "violation_count",
+                      "total_score_with_penalty"]
+        model.objects.bulk_update(ranks.values(), fields)
+        if frozen:
+            freeze.add_pending(events)
+        transaction.on_commit(lambda: self._publish_contest_rank(contest, ranks.values()))
+
+    def _publish_contest_rank(self, contest, ranks):
+        ContestScoreboard(contest).update(ranks)
+        ScoreboardStream(contest).publish(ranks)
+
+    def _update_acm_contest_rank(self, rank, event):
+        problem_id = str(event["problem_id"])
+        info = rank.submission_info.get(problem_id)
+        if info is None:
+            info = rank.submission_info[problem_id] = {"is_ac": False, "ac_time": 0, "error_number": 0,
+                                                       "is_first_ac": False}
+        elif info["is_ac"]:
+            return
+
+        rank.submission_number += 1
+        if event["result"] == JudgeStatus.ACCEPTED:
+            rank.accepted_number += 1
+            info["is_ac"] = True
+            info["ac_time"] = event["contest_time"]
+            rank.total_time += info["ac_time"] + info["error_number"] * 20 * 60
+            if event.get("first_ac"):
+                info["is_first_ac"] = True
+        elif event["result"] != JudgeStatus.COMPILE_ERROR:
+            info["error_number"] += 1
+
+    def _update_oi_contest_rank(self, rank, event):
+        problem_id = str(event["problem_id"])
+        current_score = event["score"]
+        last_score = rank.submission_info.get(problem_id)
+        if last_score:
+            rank.total_score = rank.total_score - last_score + current_score
+        else:
+            rank.total_score = rank.total_score + current_score
+        rank.submission_info[problem_id] = current_score
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from options.options import SysOptions
+from submission.models import JudgeStatus
+
+
+def parse_verdicts(value):
+    """
+    "0:0.6,-1:0.3,1:0.1" -> ([0, -1, 1], [0.6, 0.3, 0.1])
+    """
+    results, weights = [], []
+    for item in value.split(","):
+        result, weight = item.split(":")
+        results.append(int(result))
+        weights.append(float(weight))
+    return results, weights
+
+
+class FakeJudge:
+    """
+    模拟判题机，不运行代码，按配置的耗时和结果分布返回判题结果
+    """
+    judger_version = "fake"
+
+    def __init__(self, token, latency, jitter, verdicts, compile_error_rate):
+        self.token = hashlib.sha256(token.encode("utf-8")).hexdigest()
+        self.latency = latency
+        self.jitter = jitter
+        self.results, self.weights = parse_verdicts(verdicts)
+        self.compile_error_rate = compile_error_rate
+        self.running = 0
+        self._lock = threading.Lock()
+
+    def _sleep(self, scale=1):
+        time.sleep(max(random.gauss(self.latency, self.jitter), 0) * scale / 1000)
+
+    @staticmethod
+    def test_case_count(data):
+        test_case_id = data.get("test_case_id")
+        if test_case_id:
+            try:
+                with open(os.path.join(settings.TEST_CASE_DIR, test_case_id, "info"), encoding="utf-8") as f:
+                    return len(json.load(f)["test_cases"])
+            except (OSError, ValueError, KeyError):
+                pass
+        return len(data.get("test_case") or []) or 1
+
+    def judge(self, data):
+        with self._lock:
+            self.running += 1
+        try:
+            if random.random() < self.compile_error_rate:
+                self._sleep(0.2)
+                return {"err": "CompileError", "data": "fake compile error"}
+            count = self.test_case_count(data)
+            self._sleep()
+            result = random.choices(self.results, self.weights)[0]
+            # ACM 模式下第一个错误的测试点之后都按错误处理，OI 模式下得到部分分
+            first_failure = count + 1 if result == JudgeStatus.ACCEPTED else random.randint(1, count)
+            ret = []
+            for index in range(1, count + 1):
+                ret.append({"cpu_time": random.randint(1, max(data.get("max_cpu_time", 1000) // 2, 1)),
+                            "real_time": random.randint(1, 1000),
+                            "memory": random.randint(1, 64) * 1024 * 1024,
+                            "signal": 0, "exit_code": 0, "error": 0,
+                            "result": JudgeStatus.ACCEPTED if index < first_failure else result,
+                            "test_case": str(index), "output_md5": None, "output": None})
+            return {"err": None, "data": ret}
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    def compile_spj(self, data):
+        self._sleep(0.5)
+        return {"err": None, "data": "success"}
+
+
+def make_handler(judge):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, data, status=200):
+            body = json.dumps(data).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            data = json.loads(self.rfile.read(length) or b"{}")
+            if self.headers.get("X-Judge-Server-Token") != judge.token:
+                return self._reply({"err": "InvalidToken", "data": "Invalid token"})
+            path = self.path.rstrip("/")
+            if path == "/judge":
+                return self._reply(judge.judge(data))
+            elif path == "/compile_spj":
+                return self._reply(judge.compile_spj(data))
+            elif path == "/ping":
+                return self._reply({"err": None, "data": {"judger_version": judge.judger_version}})
+            return self._reply({"err": "NotFound", "data": self.path}, status=404)
+
+    return Handler
+
+
+class Command(BaseCommand):
+    help = "Run a fake judge server which returns random verdicts, used to benchmark the dispatcher"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="0.0.0.0")
+        parser.add_argument("--port", type=int, default=12358)
+        parser.add_argument("--hostname", default=None, help="Hostname reported in heartbeats")
+        parser.add_argument("--service-url", default=None, help="Defaults to http://127.0.0.1:<port>")
+        parser.add_argument("--backend-url", default="http://127.0.0.1:8000",
+                            help="Backend to send heartbeats to")
+        parser.add_argument("--cpu-core", type=int, default=4)
+        parser.add_argument("--latency", type=float, default=500, help="Mean judge latency in ms")
+        parser.add_argument("--jitter", type=float, default=100, help="Standard deviation of the latency in ms")
+        parser.add_argument("--verdicts", default="0:0.6,-1:0.3,1:0.05,4:0.05",
+                            help="result:weight pairs, result codes are JudgeStatus values")
+        parser.add_argument("--compile-error-rate", type=float, default=0.05)
+
+    def heartbeat(self, judge, options):
+        url = options["backend_url"].rstrip("/") + "/api/judge_server_heartbeat/"
+        data = {"hostname": options["hostname"] or f"fake-{socket.gethostname()}-{options['port']}",
+                "judger_version": judge.judger_version,
+                "cpu_core": options["cpu_core"],
+                "service_url": options["service_url"] or f"http://127.0.0.1:{options['port']}",
+                "action": "heartbeat"}
+        while True:
+            load = min(judge.running / options["cpu_core"] * 100, 100)
+            try:
+                requests.post(url, json=dict(data, cpu=load, memory=random.uniform(10, 30)),
+                              headers={"X-Judge-Server-Token": judge.token}, timeout=3)
+            except requests.RequestException as e:
+                self.stderr.write(f"Heartbeat failed: {e}")
+            time.sleep(3)
+
+    def handle(self, *args, **options):
+        try:
+            judge = FakeJudge(SysOptions.judge_server_token, options["latency"], options["jitter"],
+                              options["verdicts"], options["compile_error_rate"])
+        except ValueError:
+            raise CommandError("Invalid --verdicts")
+        server = ThreadingHTTPServer((options["host"], options["port"]), make_handler(judge))
+        server.daemon_threads = True
+        threading.Thread(target=self.heartbeat, args=(judge, options), daemon=True).start()
+        self.stdout.write(self.style.SUCCESS(f"Fake judge server listening on {options['host']}:{options['port']}"))
+        server.serve_forever()
@@ -0,0 +1,188 @@
+import json
+import os
+import random
+import shutil
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, close_old_connections
+from django.utils import timezone
+
+from account.models import User, UserProfile, AdminType
+from contest.models import Contest, ContestRuleType
+from judge.tasks import contest_judge_task
+from problem.models import Problem, ProblemRuleType
+from submission.models import JudgeStatus, Submission
+from utils.shortcuts import rand_str
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+class LockWaitSampler(threading.Thread):
+    """
+    定时采样 pg_stat_activity 中等待锁的连接数，估算判题过程中数据库锁等待的总时间
+    """
+    def __init__(self, interval=0.1):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        close_old_connections()
+        try:
+            with connection.cursor() as cursor:
+                while not self._stop_event.is_set():
+                    cursor.execute("SELECT count(*) FROM pg_stat_activity "
+                                   "WHERE wait_event_type = 'Lock' AND datname = current_database()")
+                    self.samples.append(cursor.fetchone()[0])
+                    time.sleep(self.interval)
+        finally:
+            connection.close()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def report(self):
+        return {"lock_wait_seconds": round(sum(self.samples) * self.interval, 2),
+                "max_lock_waiters": max(self.samples, default=0),
+                "samples": len(self.samples)}
+
+
+class Command(BaseCommand):
+    help = "Replay a synthetic contest through dramatiq and report judge throughput, latency and db lock wait. " \
+           "Run dramatiq workers and one or more fakejudgeserver first"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--problems", type=int, default=5)
+        parser.add_argument("--test-cases", type=int, default=10, help="Test cases per problem")
+        parser.add_argument("--submissions", type=int, default=500)
+        parser.add_argument("--rate", type=float, default=0, help="Submissions per second, 0 means no limit")
+        parser.add_argument("--rule-type", choices=(ContestRuleType.ACM, ContestRuleType.OI),
+                            default=ContestRuleType.ACM)
+        parser.add_argument("--timeout", type=int, default=600, help="Seconds to wait for all verdicts")
+        parser.add_argument("--keep", action="store_true", help="Do not delete the generated data")
+
+    def setup(self, options):
+        run_id = rand_str(6)
+        self.test_case_ids = []
+        creator = User.objects.create(username=f"bench_{run_id}_admin", admin_type=AdminType.ADMIN)
+        UserProfile.objects.create(user=creator)
+        self.users = [creator]
+        for i in range(options["users"]):
+            user = User.objects.create(username=f"bench_{run_id}_{i}")
+            UserProfile.objects.create(user=user)
+            self.users.append(user)
+        now = timezone.now()
+        self.contest = Contest.objects.create(title=f"benchmark {run_id}", description="benchmark",
+                                              real_time_rank=True, rule_type=options["rule_type"],
+                                              start_time=now - timedelta(hours=1), end_time=now + timedelta(days=1),
+                                              created_by=creator)
+        self.problems = []
+        for i in range(options["problems"]):
+            test_case_id = self.create_test_case(options["test_cases"])
+            score = [{"input_name": f"{j}.in", "output_name": f"{j}.out", "score": 10}
+                     for j in range(1, options["test_cases"] + 1)]
+            self.problems.append(Problem.objects.create(
+                _id=str(i + 1), contest=self.contest, title=f"benchmark {i + 1}", description="", input_description="",
+                output_description="", samples=[], test_case_id=test_case_id, test_case_score=score, languages=["C"],
+                template={}, created_by=creator, time_limit=1000, memory_limit=256, rule_type=options["rule_type"],
+                difficulty="Low", total_score=10 * options["test_cases"] if options["rule_type"] == ProblemRuleType.OI else 0))
+
+    def create_test_case(self, count):
+        """
+        只生成 info 文件，fakejudgeserver 根据它返回对应数量的测试点结果
+        """
+        test_case_id = rand_str()
+        test_case_dir = os.path.join(settings.TEST_CASE_DIR, test_case_id)
+        os.makedirs(test_case_dir)
+        info = {"spj": False, "test_cases": {str(i): {"input_name": f"{i}.in", "output_name": f"{i}.out"}
+                                             for i in range(1, count + 1)}}
+        with open(os.path.join(test_case_dir, "info"), "w", encoding="utf-8") as f:
+            f.write(json.dumps(info))
+        self.test_case_ids.append(test_case_id)
+        return test_case_id
+
+    def cleanup(self):
+        Submission.objects.filter(contest=self.contest).delete()
+        self.contest.delete()
+        User.objects.filter(id__in=[user.id for user in self.users]).delete()
+        for test_case_id in self.test_case_ids:
+            shutil.rmtree(os.path.join(settings.TEST_CASE_DIR, test_case_id), ignore_errors=True)
+
+    def submit(self, options):
+        sent_at = {}
+        interval = 1 / options["rate"] if options["rate"] else 0
+        for i in range(options["submissions"]):
+            problem = random.choice(self.problems)
+            user = random.choice(self.users[1:])
+            submission = Submission.objects.create(user_id=user.id, username=user.username, language="C",
+                                                   code=f"// {i}\nint main() {{ return 0; }}", problem_id=problem.id,
+                                                   ip="127.0.0.1", contest_id=self.contest.id)
+            sent_at[submission.id] = time.time()
+            contest_judge_task.send(submission.id, problem.id)
+            if interval:
+                time.sleep(interval)
+        return sent_at
+
+    def wait(self, sent_at, timeout):
+        """
+        轮询提交状态，记录每个提交得到结果的时间
+        """
+        finished_at = {}
+        results = Counter()
+        deadline = time.time() + timeout
+        while len(finished_at) < len(sent_at) and time.time() < deadline:
+            done = Submission.objects.filter(contest=self.contest) \
+                .exclude(result__in=[JudgeStatus.PENDING, JudgeStatus.JUDGING]) \
+                .exclude(id__in=list(finished_at.keys())).values_list("id", "result")
+            now = time.time()
+            for submission_id, result in done:
+                finished_at[submission_id] = now
+                results[result] += 1
+            time.sleep(0.2)
+        return finished_at, results
+
+    def handle(self, *args, **options):
+        self.setup(options)
+        sampler = LockWaitSampler()
+        sampler.start()
+        try:
+            start = time.time()
+            sent_at = self.submit(options)
+            submit_elapsed = time.time() - start
+            finished_at, results = self.wait(sent_at, options["timeout"])
+            elapsed = (max(finished_at.values()) if finished_at else time.time()) - start
+        finally:
+            sampler.stop()
+            if not options["keep"]:
+                self.cleanup()
+
+        latencies = [finished_at[k] - sent_at[k] for k in finished_at]
+        report = {
+            "submitted": len(sent_at),
+            "finished": len(finished_at),
+            "submit_seconds": round(submit_elapsed, 2),
+            "elapsed_seconds": round(elapsed, 2),
+            "throughput_per_second": round(len(finished_at) / elapsed, 2) if elapsed else 0,
+            # 轮询间隔为 0.2 秒，延迟的精度也是 0.2 秒
+            "latency_p50": round(percentile(latencies, 50), 2),
+            "latency_p99": round(percentile(latencies, 99), 2),
+            "latency_max": round(max(latencies, default=0), 2),
+            "results": dict(results),
+        }
+        report.update(sampler.report())
+        self.stdout.write(json.dumps(report, indent=4))
+        if len(finished_at) < len(sent_at):
+            self.stderr.write(f"{len(sent_at) - len(finished_at)} submissions did not finish in {options['timeout']}s")
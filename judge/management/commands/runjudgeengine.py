@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from judge.engine import AsyncJudgeEngine
+
+
+class Command(BaseCommand):
+    help = "Run the asyncio judge engine used when JUDGE_DISPATCH_MODE is async"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=200, help="Max in-flight judge requests")
+        parser.add_argument("--threads", type=int, default=8, help="Threads for database bookkeeping")
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS(f"Judge engine started, concurrency: {options['concurrency']}"))
+        AsyncJudgeEngine(concurrency=options["concurrency"], threads=options["threads"]).run()
@@ -0,0 +1,142 @@
+import time
+from datetime import datetime
+
+from django.utils import timezone
+
+from conf.models import JudgeServer
+from utils.cache import cache
+from utils.constants import CacheKey
+
+
+def _server_key(hostname):
+    return f"{CacheKey.judge_server_registry}:{hostname}"
+
+
+def _admin_key(hostname):
+    return f"{CacheKey.judge_server_admin}:{hostname}"
+
+
+def _spj_key(server_id):
+    return f"{CacheKey.judge_server_spj}:{server_id}"
+
+
+class JudgeServerRegistry:
+    """
+    判题机心跳注册表
+    每台判题机在 redis 中有一个过期时间为 heartbeat_timeout 的 key, 心跳只刷新这个 key, key 存在即为在线。
+    judge_server 表只用于后台展示，每隔 persist_interval 秒或者判题机的版本、地址等信息变化时才写一次。
+    管理员修改的字段 (是否禁用) 保存在另一个不过期的 key 中，心跳不会写这个 key, 避免覆盖管理员同时做的修改
+    """
+    # 与 JudgeServer.status 保持一致
+    heartbeat_timeout = 6
+    persist_interval = 60
+    fields = ("id", "hostname", "ip", "judger_version", "cpu_core", "memory_usage", "cpu_usage",
+              "service_url")
+    # 由管理员修改的字段
+    admin_fields = ("is_disabled",)
+    # 这些字段变化时立即写入数据库
+    static_fields = ("ip", "judger_version", "cpu_core", "service_url")
+
+    def _save(self, entry, timeout=None):
+        cache.set(_server_key(entry["hostname"]), entry, timeout or self.heartbeat_timeout)
+        cache.sadd(CacheKey.judge_server_registry, entry["hostname"])
+
+    @staticmethod
+    def _to_server(entry, admin):
+        server = JudgeServer(**{k: entry[k] for k in JudgeServerRegistry.fields}, **(admin or {}))
+        server.last_heartbeat = datetime.fromtimestamp(entry["last_heartbeat"], tz=timezone.utc)
+        return server
+
+    def register(self, server):
+        """
+        judge_server 表中新建的判题机
+        """
+        entry = {k: getattr(server, k) for k in self.fields}
+        entry["last_heartbeat"] = entry["persisted_at"] = time.time()
+        self._save(entry)
+        cache.set(_admin_key(server.hostname), {k: getattr(server, k) for k in self.admin_fields}, None)
+        SPJArtifactTracker().clear(server.id)
+
+    def heartbeat(self, hostname, **info):
+        """
+        更新判题机状态，判题机不在 judge_server 表中时返回 None
+        """
+        now = time.time()
+        entries = cache.get_many([_server_key(hostname), _admin_key(hostname)])
+        entry, admin = entries.get(_server_key(hostname)), entries.get(_admin_key(hostname))
+        if entry is None:
+            # 新上线或者心跳中断后重新上线的判题机, 从数据库中取 id 和是否被禁用
+            server = JudgeServer.objects.filter(hostname=hostname).first()
+            if server is None:
+                return None
+            entry = {k: getattr(server, k) for k in self.fields}
+            entry["persisted_at"] = 0
+            if admin is None:
+                admin = {k: getattr(server, k) for k in self.admin_fields}
+                # 只在 key 不存在时写入，管理员在读取数据库之后做的修改不会被覆盖
+                if not cache.add(_admin_key(hostname), admin, None):
+                    admin = cache.get(_admin_key(hostname))
+            # 判题机可能重启过，之前编译好的 spj 不一定还在
+            SPJArtifactTracker().clear(server.id)
+        changed = any(k in info and info[k] != entry[k] for k in self.static_fields)
+        entry.update(info)
+        entry["last_heartbeat"] = now
+        if changed or now - entry["persisted_at"] >= self.persist_interval:
+            JudgeServer.objects.filter(id=entry["id"]).update(last_heartbeat=timezone.now(), **info)
+            entry["persisted_at"] = now
+        self._save(entry)
+        return self._to_server(entry, admin)
+
+    def update(self, hostname, **kwargs):
+        """
+        修改 admin_fields 中的字段，例如是否禁用，判题机不在线时也会保存
+        """
+        key = _admin_key(hostname)
+        admin = cache.get(key) or {}
+        admin.update({k: v for k, v in kwargs.items() if k in self.admin_fields})
+        cache.set(key, admin, None)
+
+    def remove(self, hostname):
+        cache.delete_many([_server_key(hostname), _admin_key(hostname)])
+        cache.srem(CacheKey.judge_server_registry, hostname)
+
+    def alive_servers(self):
+        """
+        在线的判题机, 返回未保存到数据库中的 JudgeServer 对象
+        """
+        hostnames = [item.decode("utf-8") for item in cache.smembers(CacheKey.judge_server_registry)]
+        if not hostnames:
+            return []
+        keys = [_server_key(hostname) for hostname in hostnames]
+        entries = cache.get_many(keys + [_admin_key(hostname) for hostname in hostnames])
+        return [self._to_server(entries[key], entries.get(_admin_key(hostname)))
+                for hostname, key in zip(hostnames, keys) if key in entries]
+
+    def live_status(self):
+        """
+        return {hostname: 在线判题机的 JudgeServer 对象}
+        """
+        return {server.hostname: server for server in self.alive_servers()}
+
+
+class SPJArtifactTracker:
+    """
+    记录每台判题机上已经编译好的 spj_version, 判题时不用再发送 spj 代码
+    """
+    ttl = 3600 * 24 * 7
+
+    def has(self, server_id, spj_version):
+        return bool(cache.sismember(_spj_key(server_id), spj_version))
+
+    def add(self, server_id, spj_version):
+        key = _spj_key(server_id)
+        pipe = cache.pipeline()
+        pipe.sadd(key, spj_version)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def discard(self, server_id, spj_version):
+        cache.srem(_spj_key(server_id), spj_version)
+
+    def clear(self, server_id):
+        cache.delete(_spj_key(server_id))
@@ -0,0 +1,277 @@
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from account.models import AdminType, User, UserProfile
+from contest.models import ACMContestRank, Contest, ContestRuleType, OIContestRank
+from contest.scoreboard import ContestScoreboard, load_rank_penalty
+from judge.ingestion import VerdictIngestion
+from problem.counters import ProblemCounters
+from problem.models import Problem, ProblemRuleType, UserProblemStatus
+from submission.models import JudgeStatus, RejudgeJob, RejudgeJobStatus, Submission
+
+logger = logging.getLogger(__name__)
+
+
+class RejudgeJobRunner:
+    """
+    批量重判，每隔 interval 秒按 job.rate 发送一批提交到低优先级的重判队列，发送进度保存在 job 中，中断后可以继续。
+    重判的提交不再逐个更新题目、用户和排名的统计，全部判完后由 StatisticsRecomputer 一次性重新计算
+    """
+    interval = 5
+    # 已发送还没判完的提交数超过每批数量的这个倍数时暂停发送
+    max_in_flight_batches = 4
+    # 发送完成后等待判题的最长时间，超过后不再等待卡住的提交
+    finalize_timeout = timedelta(minutes=30)
+
+    def __init__(self, job):
+        self.job = job
+
+    @property
+    def batch_size(self):
+        return max(int(self.job.rate * self.interval), 1)
+
+    def base_queryset(self):
+        job = self.job
+        qs = Submission.objects.all()
+        if job.problem_id:
+            qs = qs.filter(problem_id=job.problem_id)
+        if job.contest_id:
+            qs = qs.filter(contest_id=job.contest_id)
+        if job.submission_ids:
+            qs = qs.filter(id__in=job.submission_ids)
+        return qs
+
+    def queryset(self):
+        qs = self.base_queryset()
+        if self.job.results:
+            qs = qs.filter(result__in=self.job.results)
+        return qs
+
+    def sent_queryset(self):
+        if not self.job.last_create_time:
+            return Submission.objects.none()
+        return self.base_queryset().filter(create_time__lte=self.job.last_create_time)
+
+    def in_flight(self):
+        return self.sent_queryset().filter(result__in=[JudgeStatus.PENDING, JudgeStatus.JUDGING]).count()
+
+    def tick(self):
+        """
+        return 下次执行前等待的秒数，任务结束时返回 None
+        """
+        # 避免循环引用
+        from judge.tasks import rejudge_task
+
+        job = self.job
+        if job.status == RejudgeJobStatus.FINALIZING:
+            return self.finalize()
+        if job.status != RejudgeJobStatus.RUNNING:
+            return None
+        if self.in_flight() >= self.batch_size * self.max_in_flight_batches:
+            return self.interval
+
+        qs = self.queryset()
+        if job.last_create_time:
+            qs = qs.filter(Q(create_time__gt=job.last_create_time) |
+                           Q(create_time=job.last_create_time, id__gt=job.last_submission_id))
+        batch = list(qs.order_by("create_time", "id").values("id", "problem_id", "create_time")[:self.batch_size])
+        if not batch:
+            # 这时管理员可能刚好暂停或取消了任务，generation 变化后不再修改状态
+            if not RejudgeJob.objects.filter(id=job.id, generation=job.generation, status=RejudgeJobStatus.RUNNING) \
+                    .update(status=RejudgeJobStatus.FINALIZING, last_update_time=timezone.now()):
+                return None
+            job.status = RejudgeJobStatus.FINALIZING
+            return self.interval
+
+        Submission.objects.filter(id__in=[item["id"] for item in batch]) \
+            .update(result=JudgeStatus.PENDING, statistic_info={})
+        for item in batch:
+            rejudge_task.send(item["id"], item["problem_id"], bulk=True)
+        job.sent += len(batch)
+        job.last_create_time = batch[-1]["create_time"]
+        job.last_submission_id = batch[-1]["id"]
+        job.save(update_fields=["sent", "last_create_time", "last_submission_id", "last_update_time"])
+        return self.interval
+
+    def finalize(self):
+        job = self.job
+        in_flight = self.in_flight()
+        if in_flight and timezone.now() - job.last_update_time < self.finalize_timeout:
+            return self.interval
+        if in_flight:
+            # 超时后还没有判完的提交不计入统计，由 StatisticsRecomputer 忽略
+            logger.warning(f"Rejudge job {job.id} finalized with {in_flight} unfinished submissions")
+        StatisticsRecomputer(self.sent_queryset()).run()
+        job.status = RejudgeJobStatus.FINISHED
+        job.finish_time = timezone.now()
+        job.save(update_fields=["status", "finish_time", "last_update_time"])
+        return None
+
+
+class StatisticsRecomputer:
+    """
+    根据提交记录重新计算题目、用户和比赛排名的统计，每类数据只读取和写入一次。
+    还在等待或正在判题的提交没有结果，不计入统计
+    """
+    unfinished = (JudgeStatus.PENDING, JudgeStatus.JUDGING)
+
+    def __init__(self, submissions):
+        rows = list(submissions.values_list("problem_id", "user_id", "contest_id").distinct())
+        self.problem_ids = {row[0] for row in rows}
+        self.user_ids = {row[1] for row in rows}
+        self.contest_ids = {row[2] for row in rows if row[2]}
+
+    def run(self):
+        if not self.problem_ids:
+            return
+        with transaction.atomic():
+            problems, stats, latest = self.replay()
+            self.recompute_problems(stats)
+            self.recompute_profiles(problems, latest)
+            for contest in Contest.objects.filter(id__in=self.contest_ids):
+                self.recompute_contest_rank(contest)
+
+    def replay(self):
+        """
+        按时间顺序重放这些题目上所有判完的提交，规则与 VerdictIngestion 相同:
+        比赛未在进行中和比赛管理员的提交不计入，ACM 比赛中 AC 之后的提交不计入，非比赛题目 AC 之后状态不再变化
+        return 题目，每个题目各结果的数量，每个用户在每个题目上最后的状态
+        """
+        problems = {problem.id: problem for problem in Problem.objects.filter(id__in=self.problem_ids)}
+        contests = {contest.id: contest for contest in
+                    Contest.objects.filter(id__in={problem.contest_id for problem in problems.values()})}
+        submissions = Submission.objects.filter(problem_id__in=self.problem_ids).exclude(result__in=self.unfinished) \
+            .order_by("create_time", "id").values("user_id", "problem_id", "result", "create_time", "statistic_info")
+        super_admins = VerdictIngestion.super_admin_ids(
+            submissions.filter(contest_id__isnull=False).values("user_id"))
+
+        stats = defaultdict(lambda: defaultdict(int))
+        latest = defaultdict(dict)
+        for row in submissions.iterator():
+            problem = problems[row["problem_id"]]
+            contest = contests.get(problem.contest_id)
+            if contest and VerdictIngestion.is_contest_debug(
+                    contest, row["user_id"], contest.start_time <= row["create_time"] <= contest.end_time,
+                    super_admins):
+                continue
+            current = latest[row["user_id"]].get(problem.id)
+            status = current["status"] if current else None
+            if VerdictIngestion.is_resubmission_after_ac(problem, status):
+                continue
+            stats[problem.id][str(row["result"])] += 1
+            if status == JudgeStatus.ACCEPTED and not problem.contest_id:
+                continue
+            latest[row["user_id"]][problem.id] = {"status": row["result"],
+                                                  "score": row["statistic_info"].get("score", 0)}
+        return problems, stats, latest
+
+    def recompute_problems(self, stats):
+        counters = ProblemCounters()
+        with counters.lock():
+            problems = list(Problem.objects.select_for_update().filter(id__in=self.problem_ids).order_by("id"))
+            # 统计直接由提交计算，还没有写入数据库的增量已经包含在内
+            counters.discard(self.problem_ids)
+        for problem in problems:
+            info = dict(stats[problem.id])
+            problem.statistic_info = info
+            problem.submission_number = sum(info.values())
+            problem.accepted_number = info.get(str(JudgeStatus.ACCEPTED), 0)
+        Problem.objects.bulk_update(problems, ["statistic_info", "submission_number", "accepted_number"])
+
+    def recompute_profiles(self, problems, latest):
+        profiles = list(UserProfile.objects.select_for_update().filter(user_id__in=self.user_ids).order_by("id"))
+        statuses = {(status.user_id, status.problem_id): status for status in UserProblemStatus.objects
+                    .select_for_update().filter(user_id__in=self.user_ids, problem_id__in=self.problem_ids)
+                    .order_by("id")}
+        now = timezone.now()
+        to_create, to_update = [], []
+        for profile in profiles:
+            for problem_id, item in latest[profile.user_id].items():
+                problem = problems[problem_id]
+                status = statuses.get((profile.user_id, problem_id))
+                if status is None:
+                    status = UserProblemStatus(user_id=profile.user_id, problem_id=problem_id,
+                                               contest_id=problem.contest_id, status=None)
+                    to_create.append(status)
+                else:
+                    to_update.append(status)
+                old_status, old_score = status.status, status.score
+                status.status, status.score, status.last_update_time = item["status"], item["score"], now
+                if problem.contest_id:
+                    continue
+                # 只有非比赛题目计入用户的 AC 数和总分
+                was_ac = old_status == JudgeStatus.ACCEPTED
+                is_ac = status.status == JudgeStatus.ACCEPTED
+                profile.accepted_number += int(is_ac) - int(was_ac)
+                if problem.rule_type == ProblemRuleType.OI:
+                    profile.total_score += status.score - old_score
+        UserProblemStatus.objects.bulk_create(to_create)
+        UserProblemStatus.objects.bulk_update(to_update, ["status", "score", "last_update_time"])
+        UserProfile.objects.bulk_update(profiles, ["accepted_number", "total_score"])
+
+    def recompute_contest_rank(self, contest):
+        """
+        与 VerdictIngestion.update_contest_rank 的规则相同，只统计比赛进行中非比赛管理员的提交
+        """
+        admin_ids = set(User.objects.filter(Q(admin_type=AdminType.SUPER_ADMIN) | Q(id=contest.created_by_id))
+                        .values_list("id", flat=True))
+        submissions = Submission.objects.filter(contest=contest, create_time__gte=contest.start_time,
+                                                create_time__lte=contest.end_time) \
+            .exclude(user_id__in=admin_ids).exclude(result__in=self.unfinished).order_by("create_time") \
+            .values("user_id", "problem_id", "result", "create_time", "statistic_info")
+
+        ranks = {}
+        first_ac = set()
+        for item in submissions:
+            rank = ranks.setdefault(item["user_id"], {"submission_number": 0, "accepted_number": 0,
+                                                      "total_time": 0, "total_score": 0, "submission_info": {}})
+            problem_id = str(item["problem_id"])
+            if contest.rule_type == ContestRuleType.ACM:
+                info = rank["submission_info"].setdefault(problem_id, {"is_ac": False, "ac_time": 0,
+                                                                       "error_number": 0, "is_first_ac": False})
+                if info["is_ac"]:
+                    continue
+                rank["submission_number"] += 1
+                if item["result"] == JudgeStatus.ACCEPTED:
+                    rank["accepted_number"] += 1
+                    info["is_ac"] = True
+                    info["ac_time"] = (item["create_time"] - contest.start_time).total_seconds()
+                    rank["total_time"] += info["ac_time"] + info["error_number"] * 20 * 60
+                    if problem_id not in first_ac:
+                        first_ac.add(problem_id)
+                        info["is_first_ac"] = True
+                elif item["result"] != JudgeStatus.COMPILE_ERROR:
+                    info["error_number"] += 1
+            else:
+                score = item["statistic_info"].get("score", 0)
+                rank["submission_number"] += 1
+                rank["total_score"] += score - rank["submission_info"].get(problem_id, 0)
+                rank["submission_info"][problem_id] = score
+
+        if contest.rule_type == ContestRuleType.ACM:
+            model, fields = ACMContestRank, ["submission_number", "accepted_number", "total_time", "submission_info"]
+            penalty_fields = ["violation_info", "reviewed", "penalty_time", "total_time_with_penalty",
+                              "final_total_time"]
+        else:
+            model, fields = OIContestRank, ["submission_number", "total_score", "submission_info"]
+            penalty_fields = ["violation_count", "total_score_with_penalty"]
+        existing = {rank.user_id: rank for rank in model.objects.select_for_update().filter(contest=contest)}
+        to_update, to_create = [], []
+        for user_id, values in ranks.items():
+            rank = existing.get(user_id)
+            if rank is None:
+                rank = model(user_id=user_id, contest=contest)
+                to_create.append(rank)
+            else:
+                to_update.append(rank)
+            for field in fields:
+                setattr(rank, field, values[field])
+        load_rank_penalty(contest, to_update + to_create)
+        model.objects.bulk_update(to_update, fields + penalty_fields)
+        model.objects.bulk_create(to_create)
+        transaction.on_commit(lambda: ContestScoreboard.invalidate(contest.id))
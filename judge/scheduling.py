@@ -0,0 +1,96 @@
+from options.options import SysOptions
+from utils.cache import cache, redis_script
+from utils.constants import CacheKey
+
+# KEYS[1]: 各判题机判题耗时的指数加权移动平均 (毫秒)
+# ARGV: server_id, 本次耗时, alpha
+_EWMA_SCRIPT = """
+local old = redis.call("HGET", KEYS[1], ARGV[1])
+local value = tonumber(ARGV[2])
+if old then
+    value = tonumber(old) * (1 - tonumber(ARGV[3])) + value * tonumber(ARGV[3])
+end
+redis.call("HSET", KEYS[1], ARGV[1], value)
+return tostring(value)
+"""
+
+
+def judge_server_capacity(server):
+    return server.cpu_core * 2
+
+
+class JudgeLatencyTracker:
+    """
+    记录每台判题机实际的判题耗时
+    """
+    alpha = 0.2
+
+    def record(self, server, seconds):
+        redis_script(_EWMA_SCRIPT)(keys=[CacheKey.judge_server_latency], args=[server.id, int(seconds * 1000), self.alpha])
+
+    def latencies(self):
+        """
+        return {server_id: 判题耗时的 EWMA (毫秒)}
+        """
+        return {int(k): float(v) for k, v in cache.hgetall(CacheKey.judge_server_latency).items()}
+
+
+class SchedulePolicy:
+    """
+    为每台候选判题机给出一个代价，分配槽位时选择 (已占用槽位数 + 1) * 代价 / 槽位总数 最小的判题机
+    """
+    name = None
+
+    def costs(self, servers):
+        raise NotImplementedError()
+
+
+class LeastLoadedPolicy(SchedulePolicy):
+    """
+    选择正在运行的任务数最少的判题机
+    """
+    name = "least_loaded"
+
+    def costs(self, servers):
+        return [judge_server_capacity(server) for server in servers]
+
+
+class CPUCoreWeightedPolicy(SchedulePolicy):
+    """
+    按 cpu 核数分配，核数多的判题机承担更多任务
+    """
+    name = "cpu_weighted"
+
+    def costs(self, servers):
+        return [1 for _ in servers]
+
+
+class HeartbeatLoadPolicy(SchedulePolicy):
+    """
+    参考心跳上报的 cpu 和内存占用率
+    """
+    name = "heartbeat_load"
+
+    def costs(self, servers):
+        return [1 + server.cpu_usage / 100 + server.memory_usage / 100 for server in servers]
+
+
+class LatencyEWMAPolicy(SchedulePolicy):
+    """
+    参考每台判题机实际判题耗时的 EWMA, 慢的判题机分到的任务更少；还没有数据的判题机按平均耗时计算
+    """
+    name = "latency_ewma"
+
+    def costs(self, servers):
+        latencies = JudgeLatencyTracker().latencies()
+        known = [latencies[server.id] for server in servers if server.id in latencies]
+        default = sum(known) / len(known) if known else 1
+        return [max(latencies.get(server.id, default), 1) for server in servers]
+
+
+SCHEDULE_POLICIES = {policy.name: policy for policy in
+                     (LeastLoadedPolicy, CPUCoreWeightedPolicy, HeartbeatLoadPolicy, LatencyEWMAPolicy)}
+
+
+def get_schedule_policy():
+    return SCHEDULE_POLICIES.get(SysOptions.judge_schedule_policy, LeastLoadedPolicy)()
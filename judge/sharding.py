@@ -0,0 +1,79 @@
+import json
+import os
+import shutil
+
+from django.conf import settings
+
+from utils.shortcuts import rand_str
+
+
+class TestCaseSharder:
+    """
+    把一道题的测试点拆成多组，每组是测试点目录下 shards/<shard_count>_<index> 中的一个子目录,
+    其中的文件是原测试点的硬链接，info 文件只包含该组的测试点，判题机可以像普通的 test_case_id 一样使用。
+    后台和判题机共享 TEST_CASE_DIR, 重新上传测试点会生成新的 test_case_id, 所以拆分结果不会过期
+    """
+
+    def __init__(self, test_case_id):
+        self.test_case_id = test_case_id
+        self.test_case_dir = os.path.join(settings.TEST_CASE_DIR, test_case_id)
+
+    def load_info(self):
+        with open(os.path.join(self.test_case_dir, "info"), encoding="utf-8") as f:
+            return json.load(f)
+
+    def shard(self, shard_count):
+        """
+        return [(分组的 test_case_id, [该组中每个测试点在原题中的编号]), ...]
+        """
+        info = self.load_info()
+        test_cases = sorted(info["test_cases"].keys(), key=int)
+        shard_count = min(shard_count, len(test_cases))
+        ret = []
+        for index in range(shard_count):
+            # 按编号交错分组，让大测试点尽量分散到不同的判题机
+            members = test_cases[index::shard_count]
+            name = f"{shard_count}_{index}"
+            shard_dir = os.path.join(self.test_case_dir, "shards", name)
+            if not os.path.isdir(shard_dir):
+                self._create(shard_dir, info, members)
+            ret.append((f"{self.test_case_id}/shards/{name}", members))
+        return ret
+
+    def _create(self, shard_dir, info, members):
+        # 多个判题进程可能同时拆分同一道题，先写到临时目录，再原子地重命名
+        tmp_dir = f"{shard_dir}.{rand_str(8)}"
+        os.makedirs(tmp_dir)
+        os.chmod(tmp_dir, 0o710)
+        shard_info = {k: v for k, v in info.items() if k != "test_cases"}
+        shard_info["test_cases"] = {}
+        for new_id, old_id in enumerate(members, start=1):
+            item = info["test_cases"][old_id]
+            for field in ("input_name", "output_name"):
+                if item.get(field):
+                    os.link(os.path.join(self.test_case_dir, item[field]), os.path.join(tmp_dir, item[field]))
+            shard_info["test_cases"][str(new_id)] = item
+        with open(os.path.join(tmp_dir, "info"), "w", encoding="utf-8") as f:
+            f.write(json.dumps(shard_info, indent=4))
+        os.chmod(os.path.join(tmp_dir, "info"), 0o640)
+        try:
+            os.rename(tmp_dir, shard_dir)
+        except OSError:
+            # 其他进程已经拆分完成
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    @staticmethod
+    def merge(shards, responses):
+        """
+        合并各组的判题结果，测试点编号还原为原题中的编号
+        任意一组编译错误则返回该组的结果，任意一组失败则返回 None
+        """
+        data = []
+        for (_, members), resp in zip(shards, responses):
+            if not resp or resp["err"]:
+                return resp
+            resp["data"].sort(key=lambda x: int(x["test_case"]))
+            for old_id, item in zip(members, resp["data"]):
+                item["test_case"] = old_id
+                data.append(item)
+        return {"err": None, "data": data}
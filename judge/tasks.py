@@ -1,14 +1,104 @@
+import json
+import logging
+
 import dramatiq
+from django.conf import settings
 
 from account.models import User
-from submission.models import Submission
-from judge.dispatcher import JudgeDispatcher
+from problem.models import Problem
+from submission.models import RejudgeJob, Submission
+from judge.dispatcher import JudgeDispatcher, SPJCompiler, async_judge_queue_key
+from judge.ingestion import VerdictIngestion
+from judge.registry import JudgeServerRegistry, SPJArtifactTracker
+from judge.rejudge import RejudgeJobRunner
+from utils.cache import cache
+from utils.constants import CacheKey, JudgePriority
 from utils.shortcuts import DRAMATIQ_WORKER_ARGS
 
+logger = logging.getLogger(__name__)
 
-@dramatiq.actor(**DRAMATIQ_WORKER_ARGS())
-def judge_task(submission_id, problem_id):
+
+def _judge(submission_id, problem_id, priority, bulk=False):
+    # 异步模式下交给 runjudgeengine 处理，worker 不再阻塞等待判题结果
+    if settings.JUDGE_DISPATCH_MODE == "async":
+        data = {"submission_id": submission_id, "problem_id": problem_id}
+        if bulk:
+            data["bulk"] = True
+        cache.lpush(async_judge_queue_key(priority), json.dumps(data))
+        return
     uid = Submission.objects.get(id=submission_id).user_id
     if User.objects.get(id=uid).is_disabled:
         return
-    JudgeDispatcher(submission_id, problem_id).judge()
+    JudgeDispatcher(submission_id, problem_id, bulk=bulk).judge()
+
+
+# 不同优先级的判题任务放在不同的队列中，部署时每个队列由单独的 worker 处理，
+# 线程数按 6/3/1 分配 (见 deploy/supervisord.conf), 与 JUDGE_PRIORITY_WEIGHTS 相同
+JUDGE_QUEUES = {
+    JudgePriority.CONTEST: "judge_contest",
+    JudgePriority.PRACTICE: "judge_practice",
+    JudgePriority.REJUDGE: "judge_rejudge",
+}
+
+
+@dramatiq.actor(queue_name=JUDGE_QUEUES[JudgePriority.CONTEST], priority=0, **DRAMATIQ_WORKER_ARGS())
+def contest_judge_task(submission_id, problem_id):
+    _judge(submission_id, problem_id, JudgePriority.CONTEST)
+
+
+@dramatiq.actor(queue_name=JUDGE_QUEUES[JudgePriority.PRACTICE], priority=10, **DRAMATIQ_WORKER_ARGS())
+def judge_task(submission_id, problem_id):
+    _judge(submission_id, problem_id, JudgePriority.PRACTICE)
+
+
+@dramatiq.actor(queue_name=JUDGE_QUEUES[JudgePriority.REJUDGE], priority=100, **DRAMATIQ_WORKER_ARGS())
+def rejudge_task(submission_id, problem_id, bulk=False):
+    _judge(submission_id, problem_id, JudgePriority.REJUDGE, bulk=bulk)
+
+
+JUDGE_TASKS = {
+    JudgePriority.CONTEST: contest_judge_task,
+    JudgePriority.PRACTICE: judge_task,
+    JudgePriority.REJUDGE: rejudge_task,
+}
+
+
+@dramatiq.actor(**DRAMATIQ_WORKER_ARGS())
+def precompile_spj_task(problem_id):
+    """
+    保存题目后在所有在线的判题机上预先编译 spj
+    """
+    problem = Problem.objects.filter(id=problem_id).first()
+    if not problem or not problem.spj_code:
+        return
+    compiler = SPJCompiler(problem.spj_code, problem.spj_version, problem.spj_language)
+    tracker = SPJArtifactTracker()
+    for server in JudgeServerRegistry().alive_servers():
+        if server.is_disabled or tracker.has(server.id, problem.spj_version):
+            continue
+        error = compiler.compile_on(server)
+        if error:
+            logger.warning(f"Failed to compile spj of problem {problem_id} on {server.hostname}: {error}")
+
+
+@dramatiq.actor(queue_name=JUDGE_QUEUES[JudgePriority.REJUDGE], priority=100, **DRAMATIQ_WORKER_ARGS())
+def rejudge_job_task(job_id, generation=0):
+    """
+    每次发送一批提交，之后延迟调用自身，暂停或取消的任务不再继续。
+    暂停后马上继续时旧的调用可能还在延迟队列中，generation 不一致的调用直接退出
+    """
+    # 同一个任务同时只有一个 tick, 避免读到相同的进度后重复发送同一批提交
+    with cache.lock(f"{CacheKey.rejudge_job_lock}:{job_id}", timeout=60, blocking_timeout=60):
+        job = RejudgeJob.objects.filter(id=job_id).first()
+        if not job or job.generation != generation:
+            return
+        delay = RejudgeJobRunner(job).tick()
+    if delay is not None:
+        rejudge_job_task.send_with_options(args=(job_id, generation), delay=delay * 1000)
+
+
+@dramatiq.actor(queue_name="verdict_ingestion", **DRAMATIQ_WORKER_ARGS(max_retries=3))
+def ingest_verdicts_task():
+    if not VerdictIngestion().run():
+        # 其他 worker 正在处理，稍后再检查是否有遗留的事件
+        ingest_verdicts_task.send_with_options(delay=VerdictIngestion.flush_delay)
@@ -0,0 +1,418 @@
+import asyncio
+import hashlib
+import json
+import os
+from copy import deepcopy
+from io import StringIO
+from unittest import mock
+
+import aiohttp
+import requests
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from django.core.management import call_command
+from django.utils import timezone
+
+from conf.models import JudgeServer
+from problem.models import Problem
+from submission.models import JudgeStatus, Submission
+from submission.tests import DEFAULT_PROBLEM_DATA, DEFAULT_SUBMISSION_DATA
+from utils.api.tests import APITestCase
+from utils.cache import cache
+from utils.constants import CacheKey, JudgePriority
+from utils.shortcuts import rand_str
+
+from .client import JudgeServerUnavailable, JudgeSessionPool
+from .dispatcher import (JUDGE_PRIORITY_WEIGHTS, JudgeDispatcher, async_judge_queue_key, process_pending_task,
+                         waiting_queue_key)
+from .engine import AsyncJudgeEngine
+from .registry import JudgeServerRegistry, SPJArtifactTracker
+from .tasks import JUDGE_TASKS, rejudge_job_task
+from .verdict_cache import VerdictCache
+
+
+class ProcessPendingTaskTest(APITestCase):
+    def setUp(self):
+        cache.delete_many([waiting_queue_key(priority) for priority in JUDGE_PRIORITY_WEIGHTS] +
+                          [CacheKey.waiting_queue_lock])
+        # 每个队列 20 个提交，先进先出
+        for priority in JUDGE_PRIORITY_WEIGHTS:
+            for i in range(20):
+                cache.lpush(waiting_queue_key(priority), json.dumps({"submission_id": f"{priority}-{i}",
+                                                                     "problem_id": 1}))
+        self.sent = []
+        patchers = [mock.patch.object(actor, "send", side_effect=lambda priority=priority, **data:
+                                      self.sent.append((priority, data["submission_id"])))
+                    for priority, actor in JUDGE_TASKS.items()]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _drain(self, free_slots):
+        with mock.patch("judge.dispatcher.JudgeSlotAllocator.free_slots", return_value=free_slots):
+            process_pending_task()
+
+    def test_weighted_drain(self):
+        self._drain(10)
+        # 每一轮按 6/3/1 的比例从各个队列中取
+        self.assertEqual([priority for priority, _ in self.sent],
+                         [JudgePriority.CONTEST] * 6 + [JudgePriority.PRACTICE] * 3 + [JudgePriority.REJUDGE])
+        self.assertEqual(self.sent[0], (JudgePriority.CONTEST, f"{JudgePriority.CONTEST}-0"))
+        self.assertEqual(cache.llen(waiting_queue_key(JudgePriority.CONTEST)), 14)
+
+        self.sent.clear()
+        self._drain(20)
+        counts = {priority: [item[0] for item in self.sent].count(priority) for priority in JUDGE_PRIORITY_WEIGHTS}
+        self.assertEqual(counts, {JudgePriority.CONTEST: 12, JudgePriority.PRACTICE: 6, JudgePriority.REJUDGE: 2})
+
+    def test_empty_queue_gives_slots_to_others(self):
+        cache.delete(waiting_queue_key(JudgePriority.CONTEST))
+        self._drain(8)
+        self.assertEqual([priority for priority, _ in self.sent],
+                         [JudgePriority.PRACTICE] * 3 + [JudgePriority.REJUDGE] +
+                         [JudgePriority.PRACTICE] * 3 + [JudgePriority.REJUDGE])
+
+    def test_stop_without_free_slot(self):
+        self._drain(0)
+        self.assertEqual(self.sent, [])
+        # 剩余的槽位少于权重时，不会多发
+        self._drain(4)
+        self.assertEqual([priority for priority, _ in self.sent], [JudgePriority.CONTEST] * 4)
+        for priority in JUDGE_PRIORITY_WEIGHTS:
+            self.assertEqual(cache.llen(waiting_queue_key(priority)), 16 if priority == JudgePriority.CONTEST else 20)
+
+
+class JudgeQueueRoutingTest(APITestCase):
+    def test_send_to_lane(self):
+        expected = {JudgePriority.CONTEST: "judge_contest", JudgePriority.PRACTICE: "judge_practice",
+                    JudgePriority.REJUDGE: "judge_rejudge"}
+        for priority, actor in JUDGE_TASKS.items():
+            with mock.patch.object(actor.broker, "enqueue") as enqueue:
+                actor.send(1, 2)
+            self.assertEqual(enqueue.call_args[0][0].queue_name, expected[priority])
+            self.assertEqual(enqueue.call_args[0][0].args, (1, 2))
+        with mock.patch.object(rejudge_job_task.broker, "enqueue") as enqueue:
+            rejudge_job_task.send(1, 0)
+        self.assertEqual(enqueue.call_args[0][0].queue_name, "judge_rejudge")
+
+
+class JudgeSessionPoolTest(APITestCase):
+    def setUp(self):
+        cache.delete(CacheKey.judge_server_http_stats)
+        self.pool = JudgeSessionPool()
+
+    def test_reuse_session(self):
+        session = self.pool.get_session("http://judge0:8080")
+        self.assertIs(self.pool.get_session("http://judge0:8080"), session)
+        self.assertIsNot(self.pool.get_session("http://judge1:8080"), session)
+
+        with mock.patch("requests.Session.post", autospec=True) as post:
+            self.pool.post("http://judge0:8080", "http://judge0:8080/judge", 10)
+            self.pool.post("http://judge0:8080", "http://judge0:8080/ping", 10)
+        self.assertEqual([call[0][0] for call in post.call_args_list], [session, session])
+        self.assertEqual(post.call_args[1]["timeout"], (JudgeSessionPool.connect_timeout, 10))
+        self.assertEqual(self.pool.metrics()["http://judge0:8080"]["requests"], 2)
+
+    def test_connect_error(self):
+        with mock.patch("requests.Session.post", side_effect=requests.ConnectionError("Connection refused")):
+            with self.assertRaises(JudgeServerUnavailable):
+                self.pool.post("http://judge0:8080", "http://judge0:8080/judge", 10)
+        self.assertEqual(self.pool.metrics()["http://judge0:8080"]["connect_errors"], 1)
+
+        # 读取超时不换判题机
+        with mock.patch("requests.Session.post", side_effect=requests.ReadTimeout()):
+            with self.assertRaises(requests.ReadTimeout):
+                self.pool.post("http://judge0:8080", "http://judge0:8080/judge", 10)
+        self.assertEqual(self.pool.metrics()["http://judge0:8080"]["timeouts"], 1)
+
+
+class JudgeDispatcherTestBase(APITestCase):
+    accepted = {"err": None, "data": [{"test_case": "1", "result": JudgeStatus.ACCEPTED, "cpu_time": 1, "memory": 1,
+                                       "real_time": 1, "signal": 0, "exit_code": 0, "error": 0}]}
+
+    def setUp(self):
+        user = self.create_admin(login=False)
+        problem_data = deepcopy(DEFAULT_PROBLEM_DATA)
+        problem_data.pop("tags")
+        self.problem = Problem.objects.create(created_by=user, **problem_data)
+        # 代码不同，不会命中其他测试缓存的判题结果
+        self.submission = Submission.objects.create(**dict(DEFAULT_SUBMISSION_DATA, problem_id=self.problem.id,
+                                                           user_id=user.id, code=rand_str()))
+        self.register_servers([f"http://judge{i}:8080" for i in range(4)])
+        patcher = mock.patch("judge.dispatcher.VerdictIngestion.publish")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def register_servers(self, service_urls):
+        """
+        只有这些判题机在线
+        """
+        cache.delete(CacheKey.judge_server_registry)
+        self.servers = []
+        for service_url in service_urls:
+            server = JudgeServer.objects.create(hostname=rand_str(8), judger_version="2.0.0", cpu_core=4,
+                                                cpu_usage=0, memory_usage=0, last_heartbeat=timezone.now(),
+                                                service_url=service_url)
+            cache.delete(f"{CacheKey.judge_server_leases}:{server.id}")
+            JudgeServerRegistry().register(server)
+            self.servers.append(server)
+
+    def _judge(self, judge_on):
+        with mock.patch.object(JudgeDispatcher, "judge_on", autospec=True, side_effect=judge_on) as mocked:
+            JudgeDispatcher(self.submission.id, self.problem.id).judge()
+        return [call[0][1].id for call in mocked.call_args_list]
+
+
+class JudgeDispatcherFailoverTest(JudgeDispatcherTestBase):
+    def test_failover_to_next_server(self):
+        def judge_on(dispatcher, server, data, timeout):
+            if judge_on.failures < 2:
+                judge_on.failures += 1
+                raise JudgeServerUnavailable("Connection refused")
+            return deepcopy(self.accepted)
+        judge_on.failures = 0
+
+        tried = self._judge(judge_on)
+        self.assertEqual(len(tried), 3)
+        self.assertEqual(len(set(tried)), 3)
+        self.assertEqual(Submission.objects.get(id=self.submission.id).result, JudgeStatus.ACCEPTED)
+
+    def test_failover_limit(self):
+        tried = self._judge(JudgeServerUnavailable("Connection refused"))
+        # 4 台判题机都在线，最多只尝试 max_failover 台
+        self.assertEqual(len(tried), JudgeDispatcher.max_failover)
+        self.assertEqual(len(set(tried)), JudgeDispatcher.max_failover)
+        self.assertEqual(Submission.objects.get(id=self.submission.id).result, JudgeStatus.SYSTEM_ERROR)
+
+
+class InlineJudgeEngine(AsyncJudgeEngine):
+    """
+    数据库操作直接在事件循环所在的线程中执行，测试用例的事务中的数据对其可见
+    """
+    async def _in_thread(self, func, *args):
+        return func(*args)
+
+
+class AsyncJudgeEngineTest(JudgeDispatcherTestBase):
+    def setUp(self):
+        super().setUp()
+        # 在事件循环中同步读写数据库
+        patcher = mock.patch.dict(os.environ, {"DJANGO_ALLOW_ASYNC_UNSAFE": "true"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.engine = InlineJudgeEngine(concurrency=4, threads=1)
+        self.requests = []
+
+    async def _handle(self, request):
+        self.requests.append({"token": request.headers.get("X-Judge-Server-Token"), "data": await request.json()})
+        if self.judge_delay:
+            await asyncio.sleep(self.judge_delay)
+        return web.json_response(self.accepted)
+
+    def _run(self, coro_func, judge_delay=0):
+        self.judge_delay = judge_delay
+
+        async def run():
+            app = web.Application()
+            app.router.add_post("/judge", self._handle)
+            async with TestServer(app) as server:
+                self.register_servers([str(server.make_url("/"))])
+                await coro_func()
+        asyncio.run(run())
+
+    def _result(self):
+        return Submission.objects.get(id=self.submission.id).result
+
+    def test_judge(self):
+        async def judge():
+            async with aiohttp.ClientSession() as session:
+                await self.engine.judge(session, self.submission.id, self.problem.id)
+        self._run(judge)
+
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(self.requests[0]["token"], JudgeDispatcher(self.submission.id, self.problem.id).token)
+        self.assertEqual(self.requests[0]["data"]["test_case_id"], self.problem.test_case_id)
+        # 判题结果通过 JudgeDispatcher.handle_response 保存
+        self.assertEqual(self._result(), JudgeStatus.ACCEPTED)
+        self.assertEqual(Submission.objects.get(id=self.submission.id).statistic_info["time_cost"], 1)
+
+    def test_dispatch_from_queue(self):
+        cache.delete_many([async_judge_queue_key(priority) for priority in JUDGE_PRIORITY_WEIGHTS])
+        cache.lpush(async_judge_queue_key(JudgePriority.PRACTICE),
+                    json.dumps({"submission_id": self.submission.id, "problem_id": self.problem.id}))
+
+        async def dispatch():
+            main = asyncio.create_task(self.engine.main())
+            for _ in range(100):
+                await asyncio.sleep(0.05)
+                if self._result() == JudgeStatus.ACCEPTED:
+                    break
+            main.cancel()
+        self._run(dispatch)
+
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(self._result(), JudgeStatus.ACCEPTED)
+
+    def test_timeout(self):
+        async def judge():
+            async with aiohttp.ClientSession() as session:
+                await self.engine.judge(session, self.submission.id, self.problem.id)
+        # 判题超时不换判题机，直接记为系统错误
+        with mock.patch("judge.engine.JudgeSlotAllocator.lease_timeout", return_value=0.2):
+            self._run(judge, judge_delay=2)
+
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(self._result(), JudgeStatus.SYSTEM_ERROR)
+
+    def test_command(self):
+        with mock.patch.object(AsyncJudgeEngine, "run") as run, \
+                mock.patch.object(AsyncJudgeEngine, "__init__", return_value=None) as init:
+            call_command("runjudgeengine", concurrency=50, threads=2, stdout=StringIO())
+        init.assert_called_once_with(concurrency=50, threads=2)
+        run.assert_called_once_with()
+
+
+class ACMEarlyExitTest(JudgeDispatcherTestBase):
+    def setUp(self):
+        super().setUp()
+        self.problem.acm_early_exit = True
+        self.problem.test_case_score = [dict(self.problem.test_case_score[0], input_name=f"{i}.in",
+                                             output_name=f"{i}.out", score=10) for i in range(1, 4)]
+        self.problem.save()
+
+    def _resp(self):
+        resp = deepcopy(self.accepted)
+        resp["data"] = [dict(resp["data"][0], test_case=str(i), result=result)
+                        for i, result in enumerate((JudgeStatus.ACCEPTED, JudgeStatus.WRONG_ANSWER,
+                                                    JudgeStatus.ACCEPTED), 1)]
+        return resp
+
+    def _judge_once(self):
+        sent = []
+
+        def judge_on(dispatcher, server, data, timeout):
+            sent.append(data)
+            return self._resp()
+        self._judge(judge_on)
+        return sent[0], Submission.objects.get(id=self.submission.id)
+
+    def test_skip_after_first_failure(self):
+        data, submission = self._judge_once()
+        self.assertTrue(data["early_exit"])
+        self.assertEqual(submission.result, JudgeStatus.WRONG_ANSWER)
+        self.assertEqual([item["test_case"] for item in submission.info["data"]], ["1", "2"])
+        self.assertEqual(submission.info["skipped_test_cases"], ["3"])
+
+    def test_oi_problem_unaffected(self):
+        self.problem.rule_type = "OI"
+        self.problem.save()
+        data, submission = self._judge_once()
+        self.assertNotIn("early_exit", data)
+        self.assertEqual(submission.result, JudgeStatus.PARTIALLY_ACCEPTED)
+        self.assertEqual(len(submission.info["data"]), 3)
+        self.assertNotIn("skipped_test_cases", submission.info)
+        self.assertEqual(submission.statistic_info["score"], 20)
+
+
+class VerdictCacheTest(JudgeDispatcherTestBase):
+    def _judge_count(self):
+        calls = []
+
+        def judge_on(dispatcher, server, data, timeout):
+            calls.append(data)
+            return deepcopy(self.accepted)
+        self._judge(judge_on)
+        return len(calls)
+
+    def test_key(self):
+        data = JudgeDispatcher(self.submission.id, self.problem.id).build_request_data()
+        content = json.dumps(data, sort_keys=True).encode("utf-8")
+        self.assertEqual(VerdictCache.make_key(data),
+                         f"{CacheKey.judge_verdict_cache}:{hashlib.sha256(content).hexdigest()}")
+        # 与字段的顺序无关
+        self.assertEqual(VerdictCache.make_key(dict(reversed(list(data.items())))), VerdictCache.make_key(data))
+        self.assertNotEqual(VerdictCache.make_key(dict(data, max_cpu_time=2000)), VerdictCache.make_key(data))
+
+    def test_hit_skips_judge(self):
+        self.assertEqual(self._judge_count(), 1)
+        # 相同的代码和题目再次判题时直接使用缓存的结果
+        Submission.objects.filter(id=self.submission.id).update(result=JudgeStatus.PENDING, info={})
+        self.assertEqual(self._judge_count(), 0)
+        self.assertEqual(Submission.objects.get(id=self.submission.id).result, JudgeStatus.ACCEPTED)
+
+    def test_invalidate_on_problem_change(self):
+        self.assertEqual(self._judge_count(), 1)
+        self.problem.test_case_id = rand_str()
+        self.problem.save()
+        self.assertEqual(self._judge_count(), 1)
+
+        self.problem.spj = True
+        self.problem.spj_code = "int main() { return 0; }"
+        self.problem.spj_version = rand_str(8)
+        self.problem.save()
+        self.assertEqual(self._judge_count(), 1)
+        self.problem.spj_code = "int main() { return 1; }"
+        self.problem.spj_version = rand_str(8)
+        self.problem.save()
+        self.assertEqual(self._judge_count(), 1)
+        self.assertEqual(self._judge_count(), 0)
+
+    def test_nondeterministic_result_not_cached(self):
+        data = JudgeDispatcher(self.submission.id, self.problem.id).build_request_data()
+        for result in (JudgeStatus.CPU_TIME_LIMIT_EXCEEDED, JudgeStatus.REAL_TIME_LIMIT_EXCEEDED,
+                       JudgeStatus.MEMORY_LIMIT_EXCEEDED, JudgeStatus.RUNTIME_ERROR, JudgeStatus.SYSTEM_ERROR):
+            resp = deepcopy(self.accepted)
+            resp["data"].append(dict(resp["data"][0], test_case="2", result=result))
+            VerdictCache().set(data, resp)
+            self.assertIsNone(VerdictCache().get(data))
+
+        resp = deepcopy(self.accepted)
+        resp["data"].append(dict(resp["data"][0], test_case="2", result=JudgeStatus.WRONG_ANSWER))
+        VerdictCache().set(data, resp)
+        self.assertEqual(VerdictCache().get(data), resp)
+
+
+class SPJArtifactResendTest(JudgeDispatcherTestBase):
+    def setUp(self):
+        super().setUp()
+        self.problem.spj = True
+        self.problem.spj_code = "int main() { return 0; }"
+        self.problem.spj_version = rand_str(8)
+        self.problem.save()
+        self.register_servers(["http://judge0:8080"])
+        self.server = self.servers[0]
+        self.tracker = SPJArtifactTracker()
+        self.tracker.add(self.server.id, self.problem.spj_version)
+
+    def test_tracker(self):
+        self.assertTrue(self.tracker.has(self.server.id, self.problem.spj_version))
+        self.tracker.discard(self.server.id, self.problem.spj_version)
+        self.assertFalse(self.tracker.has(self.server.id, self.problem.spj_version))
+        self.tracker.add(self.server.id, self.problem.spj_version)
+        self.tracker.clear(self.server.id)
+        self.assertFalse(self.tracker.has(self.server.id, self.problem.spj_version))
+
+    def _judge_with(self, responses):
+        sent = []
+
+        def request(dispatcher, server, path, data=None, timeout=60):
+            sent.append(data)
+            return deepcopy(responses[len(sent) - 1])
+        with mock.patch.object(JudgeDispatcher, "_request", autospec=True, side_effect=request):
+            JudgeDispatcher(self.submission.id, self.problem.id).judge()
+        return sent
+
+    def test_resend_missing_spj(self):
+        missing = {"err": "SPJCompileError", "data": "spj not found"}
+        sent = self._judge_with([missing, self.accepted])
+        # 判题机上已经编译过的 spj 不发送代码，判题机报告不存在后带上代码重新发送一次
+        self.assertEqual([data["spj_src"] for data in sent], [None, self.problem.spj_code])
+        self.assertTrue(self.tracker.has(self.server.id, self.problem.spj_version))
+        self.assertEqual(Submission.objects.get(id=self.submission.id).result, JudgeStatus.ACCEPTED)
+
+    def test_resend_once(self):
+        missing = {"err": "SPJCompileError", "data": "spj compile error"}
+        sent = self._judge_with([missing, missing, missing])
+        self.assertEqual(len(sent), 2)
+        self.assertFalse(self.tracker.has(self.server.id, self.problem.spj_version))
+        self.assertEqual(Submission.objects.get(id=self.submission.id).result, JudgeStatus.COMPILE_ERROR)
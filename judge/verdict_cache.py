@@ -0,0 +1,49 @@
+import hashlib
+import json
+
+from submission.models import JudgeStatus
+from utils.cache import cache
+from utils.constants import CacheKey
+
+
+class VerdictCache:
+    """
+    以判题请求的内容 (语言配置、拼接模板后的代码、测试点、spj、时间和内存限制等) 的 hash 作为 key 缓存判题结果,
+    完全相同的提交和题目没有变化的重判不再发送到判题机。任何一项变化都会得到不同的 key, 旧的结果自然失效
+    """
+    ttl = 3600 * 24
+    # 只缓存这些结果，超时、超内存和运行错误可能因为判题机负载不同而变化
+    deterministic_results = (JudgeStatus.ACCEPTED, JudgeStatus.WRONG_ANSWER, JudgeStatus.PARTIALLY_ACCEPTED)
+
+    @staticmethod
+    def make_key(data):
+        content = json.dumps(data, sort_keys=True).encode("utf-8")
+        return f"{CacheKey.judge_verdict_cache}:{hashlib.sha256(content).hexdigest()}"
+
+    def _record(self, field):
+        cache.hincrby(CacheKey.judge_verdict_cache_stats, field, 1)
+
+    def get(self, data):
+        resp = cache.get(self.make_key(data))
+        self._record("hits" if resp is not None else "misses")
+        return resp
+
+    def set(self, data, resp):
+        if not resp:
+            return
+        # 只缓存编译错误，判题机自身的错误不缓存
+        if resp["err"]:
+            if resp["err"] == "CompileError":
+                cache.set(self.make_key(data), resp, self.ttl)
+            return
+        if any(item["result"] not in self.deterministic_results for item in resp["data"]):
+            return
+        cache.set(self.make_key(data), resp, self.ttl)
+
+    def stats(self):
+        """
+        return {"hits": 10, "misses": 100}
+        """
+        stats = {"hits": 0, "misses": 0}
+        stats.update({k.decode("utf-8"): int(v) for k, v in cache.hgetall(CacheKey.judge_verdict_cache_stats).items()})
+        return stats
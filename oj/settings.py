@@ -235,6 +235,16 @@ DRAMATIQ_BROKER = {
     ]
 }
 
+# sync: 每个 dramatiq 线程同步等待判题结果; async: 由 runjudgeengine 异步派发判题请求
+JUDGE_DISPATCH_MODE = get_env("JUDGE_DISPATCH_MODE", "sync")
+
+# 每个 web 进程同时保持的排名 Server-Sent Events 连接数，超过后客户端改为轮询。
+# 部署时由单独的 gunicorn_stream 进程处理这些连接，普通的 web 进程只允许很少的连接，避免占满处理请求的线程
+if get_env("RANK_STREAM_PROCESS", "0") == "1":
+    RANK_STREAM_MAX_CONNECTIONS = int(get_env("RANK_STREAM_MAX_CONNECTIONS", "64"))
+else:
+    RANK_STREAM_MAX_CONNECTIONS = 1
+
 DRAMATIQ_RESULT_BACKEND = {
     "BACKEND": "dramatiq.results.backends.redis.RedisBackend",
     "BACKEND_OPTIONS": {
@@ -5,6 +5,8 @@ import time
 
 from django.db import transaction, IntegrityError
 
+from utils.cache import cache
+from utils.constants import CacheKey
 from utils.shortcuts import rand_str
 from judge.languages import languages
 from .models import SysOptions as SysOptionsModel
@@ -103,6 +105,8 @@ class OptionKeys:
     judge_server_token = "judge_server_token"
     throttling = "throttling"
     languages = "languages"
+    judge_schedule_policy = "judge_schedule_policy"
+    judge_admission = "judge_admission"
 
 
 class OptionDefaultValue:
@@ -117,6 +121,9 @@ class OptionDefaultValue:
     throttling = {"ip": {"capacity": 100, "fill_rate": 0.1, "default_capacity": 50},
                   "user": {"capacity": 20, "fill_rate": 0.03, "default_capacity": 10}}
     languages = languages
+    judge_schedule_policy = "least_loaded"
+    # 默认不限制，与之前的行为相同，由管理员在后台开启
+    judge_admission = {"user_in_flight_limit": 0, "queue_soft_limit": 0, "contest_exempt": True}
 
 
 class _SysOptionsMeta(type):
@@ -253,25 +260,42 @@ class _SysOptionsMeta(type):
     def throttling(cls, value):
         cls._set_option(OptionKeys.throttling, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def languages(cls):
-        return cls._get_option(OptionKeys.languages)
+        return language_registry.languages
 
     @languages.setter
     def languages(cls, value):
         cls._set_option(OptionKeys.languages, value)
+        language_registry.invalidate()
 
     @my_property(ttl=DEFAULT_SHORT_TTL)
-    def spj_languages(cls):
-        return [item for item in cls.languages if "spj" in item]
+    def judge_schedule_policy(cls):
+        return cls._get_option(OptionKeys.judge_schedule_policy)
+
+    @judge_schedule_policy.setter
+    def judge_schedule_policy(cls, value):
+        cls._set_option(OptionKeys.judge_schedule_policy, value)
 
     @my_property(ttl=DEFAULT_SHORT_TTL)
+    def judge_admission(cls):
+        return cls._get_option(OptionKeys.judge_admission)
+
+    @judge_admission.setter
+    def judge_admission(cls, value):
+        cls._set_option(OptionKeys.judge_admission, value)
+
+    @my_property
+    def spj_languages(cls):
+        return language_registry.spj_languages
+
+    @my_property
     def language_names(cls):
-        return [item["name"] for item in cls.languages]
+        return list(language_registry.names)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def spj_language_names(cls):
-        return [item["name"] for item in cls.languages if "spj" in item]
+        return list(language_registry.spj_names)
 
     def reset_languages(cls):
         cls.languages = languages
@@ -279,3 +303,73 @@ class _SysOptionsMeta(type):
 
 class SysOptions(metaclass=_SysOptionsMeta):
     pass
+
+
+class LanguageRegistry:
+    """
+    按名称索引的语言和 spj 配置，各进程只构建一次，
+    SysOptions.languages 被修改时 redis 中的版本号加一，其他进程下次读取时发现版本号变化再重新构建
+    """
+    def __init__(self, loader):
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._version = None
+        self._languages = []
+        self._spj_languages = []
+        self._by_name = {}
+        self._spj_by_name = {}
+
+    def _check(self):
+        version = cache.get(CacheKey.languages_version, 0)
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            # 先读版本号再读配置，并发修改时最多多构建一次
+            items = self._loader()
+            self._by_name = {item["name"]: item for item in items}
+            self._spj_by_name = {item["name"]: item["spj"] for item in items if "spj" in item}
+            self._spj_languages = [item for item in items if "spj" in item]
+            self._languages = items
+            self._version = version
+
+    def invalidate(self):
+        cache.redis_incr(CacheKey.languages_version)
+
+    @property
+    def languages(self):
+        self._check()
+        return self._languages
+
+    @property
+    def spj_languages(self):
+        self._check()
+        return self._spj_languages
+
+    @property
+    def names(self):
+        self._check()
+        return self._by_name.keys()
+
+    @property
+    def spj_names(self):
+        self._check()
+        return self._spj_by_name.keys()
+
+    def get(self, name):
+        """
+        return 语言配置, 不存在时返回 None
+        """
+        self._check()
+        return self._by_name.get(name)
+
+    def get_spj(self, name):
+        """
+        return 该语言的 spj 配置 {"config": ..., "compile": ...}, 不存在时返回 None
+        """
+        self._check()
+        return self._spj_by_name.get(name)
+
+
+language_registry = LanguageRegistry(lambda: _SysOptionsMeta._get_option(OptionKeys.languages))
@@ -0,0 +1,132 @@
+from django.db import transaction
+
+from utils.cache import cache, redis_script
+from utils.constants import CacheKey
+
+from .models import Problem
+
+# 取出并删除计数，flush 期间新的计数写入新的 hash
+POP_SCRIPT = """
+local ret = redis.call('HGETALL', KEYS[1])
+redis.call('DEL', KEYS[1])
+return ret
+"""
+
+
+class ProblemCounters:
+    """
+    题目的 submission_number, accepted_number 和 statistic_info 的增量先写入 redis hash (HINCRBY),
+    由 flush_problem_counters_task 定期合并到数据库中，判题结果不再需要锁 Problem 行。
+    hash 中 submission_number 和 accepted_number 以外的 field 是 statistic_info 中判题结果的计数。
+    读取时用 overlay 将还没有写入数据库的增量加到序列化的结果上
+    """
+    fields = ("submission_number", "accepted_number")
+    flush_interval = 10
+    flush_batch_size = 200
+
+    @staticmethod
+    def _key(problem_id):
+        return f"{CacheKey.problem_counters}:{problem_id}"
+
+    def lock(self):
+        return cache.lock(CacheKey.problem_counters_lock, timeout=30, blocking_timeout=30)
+
+    def add(self, deltas):
+        """
+        deltas: {problem_id: {"submission_number": 1, "accepted_number": 1, "0": 1}}
+        """
+        # 避免循环引用
+        from problem.tasks import flush_problem_counters_task
+
+        deltas = {k: {field: v for field, v in delta.items() if v} for k, delta in deltas.items()}
+        deltas = {k: v for k, v in deltas.items() if v}
+        if not deltas:
+            return
+        pipe = cache.pipeline()
+        for problem_id, delta in deltas.items():
+            for field, value in delta.items():
+                pipe.hincrby(self._key(problem_id), field, value)
+            pipe.sadd(CacheKey.problem_counters_dirty, problem_id)
+        pipe.execute()
+        if cache.set(CacheKey.problem_counters_scheduled, 1, timeout=self.flush_interval * 6, nx=True):
+            flush_problem_counters_task.send_with_options(delay=self.flush_interval * 1000)
+
+    def get_many(self, problem_ids):
+        """
+        return {problem_id: {"submission_number": 1, ...}}, 只包含有增量的题目
+        """
+        problem_ids = list(problem_ids)
+        if not problem_ids:
+            return {}
+        pipe = cache.pipeline()
+        for problem_id in problem_ids:
+            pipe.hgetall(self._key(problem_id))
+        ret = {}
+        for problem_id, delta in zip(problem_ids, pipe.execute()):
+            if delta:
+                ret[problem_id] = {k.decode("utf-8"): int(v) for k, v in delta.items()}
+        return ret
+
+    def discard(self, problem_ids):
+        """
+        直接根据提交重新计算了统计的题目，丢弃还没有写入的增量
+        """
+        problem_ids = list(problem_ids)
+        if problem_ids:
+            cache.delete_many([self._key(problem_id) for problem_id in problem_ids])
+
+    @classmethod
+    def apply(cls, problem, delta):
+        for field in cls.fields:
+            setattr(problem, field, getattr(problem, field) + delta.get(field, 0))
+        for result, count in delta.items():
+            if result not in cls.fields:
+                problem.statistic_info[result] = problem.statistic_info.get(result, 0) + count
+
+    @classmethod
+    def overlay(cls, data, delta):
+        """
+        将增量加到序列化后的数据上
+        """
+        if not delta:
+            return data
+        for field in cls.fields:
+            if field in data:
+                data[field] += delta.get(field, 0)
+        if "statistic_info" in data:
+            info = dict(data["statistic_info"])
+            for result, count in delta.items():
+                if result not in cls.fields:
+                    info[result] = info.get(result, 0) + count
+            data["statistic_info"] = info
+        return data
+
+    def flush(self):
+        cache.delete(CacheKey.problem_counters_scheduled)
+        with self.lock():
+            while True:
+                problem_ids = [int(item) for item in
+                               cache.spop(CacheKey.problem_counters_dirty, self.flush_batch_size) or []]
+                if not problem_ids:
+                    break
+                self._flush(problem_ids)
+
+    def _flush(self, problem_ids):
+        script = redis_script(POP_SCRIPT)
+        deltas = {}
+        for problem_id in problem_ids:
+            values = script(keys=[self._key(problem_id)])
+            if values:
+                deltas[problem_id] = {values[i].decode("utf-8"): int(values[i + 1]) for i in range(0, len(values), 2)}
+        if not deltas:
+            return
+        try:
+            with transaction.atomic():
+                problems = list(Problem.objects.select_for_update().filter(id__in=deltas.keys()).order_by("id"))
+                for problem in problems:
+                    self.apply(problem, deltas[problem.id])
+                Problem.objects.bulk_update(problems, ["submission_number", "accepted_number", "statistic_info"])
+        except Exception:
+            # 写入数据库失败，把增量放回 redis 等待下次 flush
+            self.add(deltas)
+            raise
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problem', '0014_problem_share_submission'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='problem',
+            name='judge_shards',
+            field=models.IntegerField(default=1),
+        ),
+    ]
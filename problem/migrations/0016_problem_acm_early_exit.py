@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problem', '0015_problem_judge_shards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='problem',
+            name='acm_early_exit',
+            field=models.BooleanField(default=False),
+        ),
+    ]
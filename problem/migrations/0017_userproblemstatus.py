@@ -0,0 +1,61 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_problems_status(apps, schema_editor):
+    """
+    把 UserProfile.acm_problems_status 和 oi_problems_status 中的数据复制到 user_problem_status
+    """
+    UserProfile = apps.get_model('account', 'UserProfile')
+    Problem = apps.get_model('problem', 'Problem')
+    UserProblemStatus = apps.get_model('problem', 'UserProblemStatus')
+    contests = dict(Problem.objects.values_list('id', 'contest_id'))
+
+    rows = []
+    for profile in UserProfile.objects.only('user_id', 'acm_problems_status', 'oi_problems_status').iterator():
+        for problems_status in (profile.acm_problems_status, profile.oi_problems_status):
+            for key in ('problems', 'contest_problems'):
+                for problem_id, item in (problems_status or {}).get(key, {}).items():
+                    problem_id = int(problem_id)
+                    # 题目已经被删除
+                    if problem_id not in contests:
+                        continue
+                    rows.append(UserProblemStatus(user_id=profile.user_id, problem_id=problem_id,
+                                                  contest_id=contests[problem_id], status=item['status'],
+                                                  score=item.get('score', 0)))
+        if len(rows) >= 5000:
+            UserProblemStatus.objects.bulk_create(rows, ignore_conflicts=True)
+            rows = []
+    UserProblemStatus.objects.bulk_create(rows, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('account', '0012_userprofile_language'),
+        ('contest', '0010_auto_20190326_0201'),
+        ('problem', '0016_problem_acm_early_exit'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserProblemStatus',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.IntegerField()),
+                ('score', models.IntegerField(default=0)),
+                ('last_update_time', models.DateTimeField(auto_now=True)),
+                ('contest', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='contest.Contest')),
+                ('problem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='problem.Problem')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'user_problem_status',
+                'unique_together': {('user', 'problem')},
+                'index_together': {('user', 'contest')},
+            },
+        ),
+        migrations.RunPython(copy_problems_status, migrations.RunPython.noop),
+    ]
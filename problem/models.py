@@ -81,6 +81,10 @@ class Problem(models.Model):
     # {JudgeStatus.ACCEPTED: 3, JudgeStaus.WRONG_ANSWER: 11}, the number means count
     statistic_info = JSONField(default=dict)
     share_submission = models.BooleanField(default=False)
+    # 测试点较多的题目可以把测试点分成多组，同时发送到多台判题机
+    judge_shards = models.IntegerField(default=1)
+    # ACM 模式下遇到第一个错误的测试点即停止判题，需要判题机支持 early_exit 参数
+    acm_early_exit = models.BooleanField(default=False)
 
     class Meta:
         db_table = "problem"
@@ -94,3 +98,21 @@ class Problem(models.Model):
     def add_ac_number(self):
         self.accepted_number = models.F("accepted_number") + 1
         self.save(update_fields=["accepted_number"])
+
+
+class UserProblemStatus(models.Model):
+    """
+    用户在每个题目上的状态，ACM 模式下 AC 之后不再变化，OI 模式下 score 为最后一次提交的得分。
+    比赛题目的 contest 不为空，不计入用户的 accepted_number 和 total_score
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    problem = models.ForeignKey(Problem, on_delete=models.CASCADE)
+    contest = models.ForeignKey(Contest, null=True, on_delete=models.CASCADE)
+    status = models.IntegerField()
+    score = models.IntegerField(default=0)
+    last_update_time = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "user_problem_status"
+        unique_together = (("user", "problem"),)
+        index_together = (("user", "contest"),)
@@ -7,6 +7,7 @@ from utils.api import UsernameSerializer, serializers
 from utils.constants import Difficulty
 from utils.serializers import LanguageNameMultiChoiceField, SPJLanguageNameChoiceField, LanguageNameChoiceField
 
+from .counters import ProblemCounters
 from .models import Problem, ProblemRuleType, ProblemTag, ProblemIOMode
 from .utils import parse_problem_template
 
@@ -70,6 +71,8 @@ class CreateOrEditProblemSerializer(serializers.Serializer):
     hint = serializers.CharField(allow_blank=True, allow_null=True)
     source = serializers.CharField(max_length=256, allow_blank=True, allow_null=True)
     share_submission = serializers.BooleanField()
+    judge_shards = serializers.IntegerField(min_value=1, max_value=16, default=1)
+    acm_early_exit = serializers.BooleanField(default=False)
 
 
 class CreateProblemSerializer(CreateOrEditProblemSerializer):
@@ -100,9 +103,29 @@ class CompileSPJSerializer(serializers.Serializer):
     spj_code = serializers.CharField()
 
 
+class ProblemCountersListSerializer(serializers.ListSerializer):
+    """
+    一次读取整页题目在 ProblemCounters 中的增量
+    """
+    def to_representation(self, data):
+        problems = list(data.all() if hasattr(data, "all") else data)
+        self.child.live_counters = ProblemCounters().get_many(problem.id for problem in problems)
+        return super().to_representation(problems)
+
+
 class BaseProblemSerializer(serializers.ModelSerializer):
     tags = serializers.SlugRelatedField(many=True, slug_field="name", read_only=True)
     created_by = UsernameSerializer()
+    live_counters = None
+
+    def to_representation(self, instance):
+        ret = super().to_representation(instance)
+        if "submission_number" in ret:
+            live_counters = self.live_counters
+            if live_counters is None:
+                live_counters = ProblemCounters().get_many([instance.id])
+            ProblemCounters.overlay(ret, live_counters.get(instance.id))
+        return ret
 
     def get_public_template(self, obj):
         ret = {}
@@ -115,6 +138,7 @@ class ProblemAdminSerializer(BaseProblemSerializer):
     class Meta:
         model = Problem
         fields = "__all__"
+        list_serializer_class = ProblemCountersListSerializer
 
 
 class ProblemSerializer(BaseProblemSerializer):
@@ -123,7 +147,8 @@ class ProblemSerializer(BaseProblemSerializer):
     class Meta:
         model = Problem
         exclude = ("test_case_score", "test_case_id", "visible", "is_public",
-                   "spj_code", "spj_version", "spj_compile_ok")
+                   "spj_code", "spj_version", "spj_compile_ok", "judge_shards", "acm_early_exit")
+        list_serializer_class = ProblemCountersListSerializer
 
 
 class ProblemSafeSerializer(BaseProblemSerializer):
@@ -132,7 +157,7 @@ class ProblemSafeSerializer(BaseProblemSerializer):
     class Meta:
         model = Problem
         exclude = ("test_case_score", "test_case_id", "visible", "is_public",
-                   "spj_code", "spj_version", "spj_compile_ok",
+                   "spj_code", "spj_version", "spj_compile_ok", "judge_shards", "acm_early_exit",
                    "difficulty", "submission_number", "accepted_number", "statistic_info")
 
 
@@ -0,0 +1,10 @@
+import dramatiq
+
+from utils.shortcuts import DRAMATIQ_WORKER_ARGS
+
+from .counters import ProblemCounters
+
+
+@dramatiq.actor(**DRAMATIQ_WORKER_ARGS(max_retries=3))
+def flush_problem_counters_task():
+    ProblemCounters().flush()
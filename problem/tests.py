@@ -1,5 +1,6 @@
 import copy
 import hashlib
+import json
 import os
 import shutil
 from datetime import timedelta
@@ -7,6 +8,7 @@ from zipfile import ZipFile
 
 from django.conf import settings
 
+from judge.sharding import TestCaseSharder
 from utils.api.tests import APITestCase
 
 from .models import ProblemTag, ProblemIOMode
@@ -130,6 +132,20 @@ class TestCaseUploadAPITest(APITestCase):
                 with open(os.path.join(test_case_dir, name), "r", encoding="utf-8") as f:
                     self.assertEqual(f.read(), name + "\n" + name + "\n" + "end")
 
+    def test_shard_test_case(self):
+        with open(self.make_test_case_zip(), "rb") as f:
+            resp = self.client.post(self.url, data={"spj": "true", "file": f}, format="multipart")
+        self.assertSuccess(resp)
+        sharder = TestCaseSharder(resp.data["data"]["id"])
+        shards = sharder.shard(4)
+        self.assertEqual([members for _, members in shards], [["1"], ["2"]])
+        shard_dir = os.path.join(settings.TEST_CASE_DIR, shards[1][0])
+        with open(os.path.join(shard_dir, "info"), encoding="utf-8") as f:
+            self.assertEqual(json.load(f)["test_cases"]["1"]["input_name"], "2.in")
+        responses = [{"err": None, "data": [{"test_case": "1", "result": 0}]},
+                     {"err": None, "data": [{"test_case": "1", "result": -1}]}]
+        self.assertEqual([item["test_case"] for item in TestCaseSharder.merge(shards, responses)["data"]], ["1", "2"])
+
 
 class ProblemAdminAPITest(APITestCase):
     def setUp(self):
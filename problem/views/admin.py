@@ -15,6 +15,7 @@ from account.decorators import problem_permission_required, ensure_created_by
 from contest.models import Contest, ContestStatus
 from fps.parser import FPSHelper, FPSParser
 from judge.dispatcher import SPJCompiler
+from judge.tasks import precompile_spj_task
 from options.options import SysOptions
 from submission.models import Submission, JudgeStatus
 from utils.api import APIView, CSRFExemptAPIView, validate_serializer, APIError
@@ -195,6 +196,12 @@ class ProblemBase(APIView):
             data["total_score"] = total_score
         data["languages"] = list(data["languages"])
 
+    @staticmethod
+    def precompile_spj(problem):
+        # 在所有判题机上预先编译 spj, 判题时不用再发送 spj 代码
+        if problem.spj_code:
+            transaction.on_commit(lambda: precompile_spj_task.send(problem.id))
+
 
 class ProblemAPI(ProblemBase):
     @problem_permission_required
@@ -215,6 +222,7 @@ class ProblemAPI(ProblemBase):
         tags = data.pop("tags")
         data["created_by"] = request.user
         problem = Problem.objects.create(**data)
+        self.precompile_spj(problem)
 
         for item in tags:
             try:
@@ -279,6 +287,7 @@ class ProblemAPI(ProblemBase):
         for k, v in data.items():
             setattr(problem, k, v)
         problem.save()
+        self.precompile_spj(problem)
 
         problem.tags.remove(*problem.tags.all())
         for tag in tags:
@@ -336,6 +345,7 @@ class ContestProblemAPI(ProblemBase):
         tags = data.pop("tags")
         data["created_by"] = request.user
         problem = Problem.objects.create(**data)
+        self.precompile_spj(problem)
 
         for item in tags:
             try:
@@ -409,6 +419,7 @@ class ContestProblemAPI(ProblemBase):
         for k, v in data.items():
             setattr(problem, k, v)
         problem.save()
+        self.precompile_spj(problem)
 
         problem.tags.remove(*problem.tags.all())
         for tag in tags:
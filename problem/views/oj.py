@@ -2,9 +2,9 @@ import random
 from django.db.models import Q, Count
 from utils.api import APIView
 from account.decorators import check_contest_permission
-from ..models import ProblemTag, Problem, ProblemRuleType
+from contest.freeze import ScoreboardFreeze
+from ..models import ProblemTag, Problem, UserProblemStatus
 from ..serializers import ProblemSerializer, TagSerializer, ProblemSafeSerializer
-from contest.models import ContestRuleType
 
 
 class ProblemTagAPI(APIView):
@@ -26,24 +26,27 @@ class PickOneAPI(APIView):
         return self.success(problems[random.randint(0, count - 1)]._id)
 
 
+def add_problem_status(user, problems):
+    """
+    只查询当前页题目的状态
+    """
+    statuses = dict(UserProblemStatus.objects.filter(user=user, problem_id__in=[problem["id"] for problem in problems])
+                    .values_list("problem_id", "status"))
+    for problem in problems:
+        problem["my_status"] = statuses.get(problem["id"])
+
+
 class ProblemAPI(APIView):
     @staticmethod
     def _add_problem_status(request, queryset_values):
         if request.user.is_authenticated:
-            profile = request.user.userprofile
-            acm_problems_status = profile.acm_problems_status.get("problems", {})
-            oi_problems_status = profile.oi_problems_status.get("problems", {})
             # paginate data
             results = queryset_values.get("results")
             if results is not None:
                 problems = results
             else:
                 problems = [queryset_values, ]
-            for problem in problems:
-                if problem["rule_type"] == ProblemRuleType.ACM:
-                    problem["my_status"] = acm_problems_status.get(str(problem["id"]), {}).get("status")
-                else:
-                    problem["my_status"] = oi_problems_status.get(str(problem["id"]), {}).get("status")
+            add_problem_status(request.user, problems)
 
     def get(self, request):
         # 问题详情页
@@ -86,13 +89,19 @@ class ProblemAPI(APIView):
 class ContestProblemAPI(APIView):
     def _add_problem_status(self, request, queryset_values):
         if request.user.is_authenticated:
-            profile = request.user.userprofile
-            if self.contest.rule_type == ContestRuleType.ACM:
-                problems_status = profile.acm_problems_status.get("contest_problems", {})
-            else:
-                problems_status = profile.oi_problems_status.get("contest_problems", {})
-            for problem in queryset_values:
-                problem["my_status"] = problems_status.get(str(problem["id"]), {}).get("status")
+            add_problem_status(request.user, queryset_values)
+
+    def _hide_counters(self, request, problems):
+        """
+        封榜期间普通用户看不到题目的提交数和通过数，其中包含封榜后的判题结果
+        """
+        if request.user.is_authenticated and request.user.is_contest_admin(self.contest):
+            return
+        if not ScoreboardFreeze(self.contest).frozen():
+            return
+        for problem in problems:
+            for field in ("submission_number", "accepted_number", "statistic_info"):
+                problem.pop(field, None)
 
     @check_contest_permission(check_type="problems")
     def get(self, request):
@@ -107,6 +116,7 @@ class ContestProblemAPI(APIView):
             if self.contest.problem_details_permission(request.user):
                 problem_data = ProblemSerializer(problem).data
                 self._add_problem_status(request, [problem_data, ])
+                self._hide_counters(request, [problem_data, ])
             else:
                 problem_data = ProblemSafeSerializer(problem).data
             return self.success(problem_data)
@@ -115,6 +125,7 @@ class ContestProblemAPI(APIView):
         if self.contest.problem_details_permission(request.user):
             data = ProblemSerializer(contest_problems, many=True).data
             self._add_problem_status(request, data)
+            self._hide_counters(request, data)
         else:
             data = ProblemSafeSerializer(contest_problems, many=True).data
         return self.success(data)
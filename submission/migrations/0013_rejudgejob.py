@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('contest', '0010_auto_20190326_0201'),
+        ('problem', '0016_problem_acm_early_exit'),
+        ('submission', '0012_auto_20180501_0436'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RejudgeJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('submission_ids', models.JSONField(default=list)),
+                ('results', models.JSONField(default=list)),
+                ('rate', models.FloatField(default=5)),
+                ('status', models.TextField(default='running')),
+                ('total', models.IntegerField(default=0)),
+                ('sent', models.IntegerField(default=0)),
+                ('last_create_time', models.DateTimeField(null=True)),
+                ('last_submission_id', models.TextField(null=True)),
+                ('create_time', models.DateTimeField(auto_now_add=True)),
+                ('last_update_time', models.DateTimeField(auto_now=True)),
+                ('finish_time', models.DateTimeField(null=True)),
+                ('contest', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='contest.Contest')),
+                ('created_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('problem', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='problem.Problem')),
+            ],
+            options={
+                'db_table': 'rejudge_job',
+                'ordering': ('-create_time',),
+            },
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 
+from account.models import User
 from utils.constants import ContestStatus
 from utils.models import JSONField
 from problem.models import Problem
@@ -58,3 +59,39 @@ class Submission(models.Model):
 
     def __str__(self):
         return self.id
+
+
+class RejudgeJobStatus:
+    RUNNING = "running"
+    PAUSED = "paused"
+    # 已经全部发送，等待判题完成后重新计算统计数据
+    FINALIZING = "finalizing"
+    FINISHED = "finished"
+    CANCELLED = "cancelled"
+
+
+class RejudgeJob(models.Model):
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE)
+    problem = models.ForeignKey(Problem, null=True, on_delete=models.CASCADE)
+    contest = models.ForeignKey(Contest, null=True, on_delete=models.CASCADE)
+    # 只重判这些提交 id, 为空则不限制
+    submission_ids = JSONField(default=list)
+    # 只重判这些结果的提交，为空则不限制
+    results = JSONField(default=list)
+    # 每秒发送的提交数
+    rate = models.FloatField(default=5)
+    status = models.TextField(default=RejudgeJobStatus.RUNNING)
+    total = models.IntegerField(default=0)
+    sent = models.IntegerField(default=0)
+    # 按 (create_time, id) 顺序发送，记录最后发送的提交，中断后从这里继续
+    last_create_time = models.DateTimeField(null=True)
+    last_submission_id = models.TextField(null=True)
+    create_time = models.DateTimeField(auto_now_add=True)
+    last_update_time = models.DateTimeField(auto_now=True)
+    finish_time = models.DateTimeField(null=True)
+    # 每次创建、继续或取消时加 1, 之前延迟发送的 rejudge_job_task 发现不一致后退出，避免同时有两个任务在发送
+    generation = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = "rejudge_job"
+        ordering = ("-create_time",)
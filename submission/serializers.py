@@ -1,5 +1,5 @@
-from .models import Submission
-from utils.api import serializers
+from .models import JudgeStatus, RejudgeJob, Submission
+from utils.api import serializers, UsernameSerializer
 from utils.serializers import LanguageNameChoiceField
 
 
@@ -49,3 +49,30 @@ class SubmissionListSerializer(serializers.ModelSerializer):
         if self.user is None or not self.user.is_authenticated:
             return False
         return obj.check_user_permission(self.user)
+
+
+class CreateRejudgeJobSerializer(serializers.Serializer):
+    problem_id = serializers.IntegerField(required=False)
+    contest_id = serializers.IntegerField(required=False)
+    submission_ids = serializers.ListField(child=serializers.CharField(max_length=32), required=False)
+    # 只重判这些结果的提交，为空时重判全部
+    results = serializers.ListField(child=serializers.ChoiceField(choices=[
+        JudgeStatus.COMPILE_ERROR, JudgeStatus.WRONG_ANSWER, JudgeStatus.ACCEPTED,
+        JudgeStatus.CPU_TIME_LIMIT_EXCEEDED, JudgeStatus.REAL_TIME_LIMIT_EXCEEDED,
+        JudgeStatus.MEMORY_LIMIT_EXCEEDED, JudgeStatus.RUNTIME_ERROR, JudgeStatus.SYSTEM_ERROR,
+        JudgeStatus.PARTIALLY_ACCEPTED]), required=False)
+    # 每秒发送的提交数
+    rate = serializers.FloatField(min_value=0.1, max_value=100, default=5)
+
+
+class EditRejudgeJobSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    action = serializers.ChoiceField(choices=["pause", "resume", "cancel"])
+
+
+class RejudgeJobSerializer(serializers.ModelSerializer):
+    created_by = UsernameSerializer()
+
+    class Meta:
+        model = RejudgeJob
+        exclude = ("submission_ids",)
@@ -1,9 +1,19 @@
 from copy import deepcopy
+from datetime import timedelta
 from unittest import mock
 
-from problem.models import Problem, ProblemTag
+from django.utils import timezone
+
+from contest.models import Contest
+from contest.tests import DEFAULT_CONTEST_DATA
+from judge.ingestion import VerdictIngestion
+from judge.rejudge import StatisticsRecomputer
+from judge.tasks import rejudge_job_task as job_task
+from options.options import SysOptions
+from problem.counters import ProblemCounters
+from problem.models import Problem, ProblemTag, UserProblemStatus
 from utils.api.tests import APITestCase
-from .models import Submission
+from .models import JudgeStatus, RejudgeJobStatus, Submission
 
 DEFAULT_PROBLEM_DATA = {"_id": "A-110", "title": "test", "description": "<p>test</p>", "input_description": "test",
                         "output_description": "test", "time_limit": 1000, "memory_limit": 256, "difficulty": "Low",
@@ -58,6 +68,35 @@ class SubmissionListTest(SubmissionPrepare):
 
 
 @mock.patch("submission.views.oj.judge_task.send")
+class ContestSubmissionFreezeTest(SubmissionPrepare):
+    def setUp(self):
+        self._create_problem_and_submission()
+        data = dict(DEFAULT_CONTEST_DATA, password="", start_time=timezone.now() - timedelta(hours=5),
+                    end_time=timezone.now() + timedelta(hours=1))
+        self.contest = Contest.objects.create(created_by=self.problem.created_by,
+                                              freeze_time=timezone.now() - timedelta(hours=1), **data)
+        Problem.objects.filter(id=self.problem.id).update(contest=self.contest)
+        self.users = [self.create_user(f"user{i}", "test123", login=False) for i in range(2)]
+        # user0 在封榜前提交，user1 在封榜后提交
+        for user, create_time in zip(self.users, (self.contest.freeze_time - timedelta(minutes=10),
+                                                  self.contest.freeze_time + timedelta(minutes=10))):
+            submission = Submission.objects.create(**dict(self.submission_data, contest_id=self.contest.id,
+                                                          user_id=user.id, username=user.username))
+            Submission.objects.filter(id=submission.id).update(create_time=create_time)
+        self.create_user("viewer", "test123")
+
+    def test_frozen_submission_list(self):
+        resp = self.client.get(self.reverse("contest_submission_list_api"),
+                               data={"contest_id": self.contest.id, "limit": 10})
+        self.assertSuccess(resp)
+        self.assertEqual([item["username"] for item in resp.data["data"]["results"]], [self.users[0].username])
+
+    def test_frozen_problem_counters(self):
+        resp = self.client.get(self.reverse("contest_problem_api"), data={"contest_id": self.contest.id})
+        self.assertSuccess(resp)
+        self.assertNotIn("accepted_number", resp.data["data"][0])
+
+
 class SubmissionAPITest(SubmissionPrepare):
     def setUp(self):
         self._create_problem_and_submission()
@@ -76,3 +115,145 @@ class SubmissionAPITest(SubmissionPrepare):
         self.assertDictEqual(resp.data, {"error": "error",
                                          "data": "Python3 is now allowed in the problem"})
         judge_task.assert_not_called()
+
+    def test_admission_disabled_by_default(self, judge_task):
+        self.assertEqual(SysOptions.judge_admission["user_in_flight_limit"], 0)
+        for _ in range(2):
+            self.assertSuccess(self.client.post(self.url, self.submission_data))
+        self.assertEqual(judge_task.call_count, 2)
+
+    def test_user_in_flight_limit(self, judge_task):
+        SysOptions.judge_admission = {"user_in_flight_limit": 1, "queue_soft_limit": 0, "contest_exempt": True}
+        resp = self.client.post(self.url, self.submission_data)
+        self.assertSuccess(resp)
+        # 上一个提交还在等待判题
+        resp = self.client.post(self.url, self.submission_data)
+        self.assertFailed(resp)
+        self.assertEqual(judge_task.call_count, 1)
+
+
+@mock.patch("submission.views.admin.rejudge_job_task.send")
+class RejudgeJobAPITest(SubmissionPrepare):
+    def setUp(self):
+        self._create_problem_and_submission()
+        self.create_super_admin()
+        self.url = self.reverse("rejudge_job_api")
+
+    def test_create_and_pause_job(self, rejudge_job_task):
+        resp = self.client.post(self.url, {"problem_id": self.problem.id, "rate": 2})
+        self.assertSuccess(resp)
+        self.assertEqual(resp.data["data"]["total"], 1)
+        rejudge_job_task.assert_called_once()
+
+        resp = self.client.put(self.url, {"id": resp.data["data"]["id"], "action": "pause"})
+        self.assertSuccess(resp)
+        self.assertEqual(resp.data["data"]["status"], RejudgeJobStatus.PAUSED)
+
+    @mock.patch("judge.rejudge.RejudgeJobRunner.tick")
+    def test_stale_tick_after_resume(self, tick, rejudge_job_task):
+        resp = self.client.post(self.url, {"problem_id": self.problem.id, "rate": 2})
+        job_id = resp.data["data"]["id"]
+        self.client.put(self.url, {"id": job_id, "action": "pause"})
+        self.client.put(self.url, {"id": job_id, "action": "resume"})
+        # 暂停前延迟发送的调用还带着旧的 generation, 不再继续
+        self.assertEqual(rejudge_job_task.call_args_list[-1][0], (job_id, 2))
+        tick.return_value = None
+        job_task.fn(job_id, 0)
+        tick.assert_not_called()
+        job_task.fn(job_id, 2)
+        tick.assert_called_once()
+
+    def test_filter_is_required(self, rejudge_job_task):
+        resp = self.client.post(self.url, {"rate": 2})
+        self.assertFailed(resp)
+        rejudge_job_task.assert_not_called()
+
+
+class VerdictIngestionTest(SubmissionPrepare):
+    def setUp(self):
+        self._create_problem_and_submission()
+        self.user = self.create_user("123", "test123", login=False)
+
+    def _event(self, result):
+        return {"submission_id": self.submission.id, "problem_id": self.problem.id, "contest_id": None,
+                "user_id": self.user.id, "result": result, "score": 0, "last_result": None,
+                "contest_time": 0, "contest_underway": False}
+
+    @mock.patch("problem.tasks.flush_problem_counters_task.send_with_options")
+    def test_apply_batch(self, flush_task):
+        with self.captureOnCommitCallbacks(execute=True):
+            VerdictIngestion().apply([self._event(JudgeStatus.WRONG_ANSWER), self._event(JudgeStatus.ACCEPTED),
+                                      self._event(JudgeStatus.WRONG_ANSWER)])
+        # 题目的计数先写入 redis, flush 后才写入数据库
+        self.assertEqual(ProblemCounters().get_many([self.problem.id])[self.problem.id]["submission_number"], 3)
+        ProblemCounters().flush()
+        problem = Problem.objects.get(id=self.problem.id)
+        self.assertEqual(problem.submission_number, 3)
+        self.assertEqual(problem.accepted_number, 1)
+        self.assertEqual(problem.statistic_info, {str(JudgeStatus.WRONG_ANSWER): 2, str(JudgeStatus.ACCEPTED): 1})
+        profile = self.user.userprofile
+        profile.refresh_from_db()
+        self.assertEqual(profile.submission_number, 3)
+        self.assertEqual(profile.accepted_number, 1)
+        # 已经 AC 的题目状态不再变化
+        self.assertEqual(UserProblemStatus.objects.get(user=self.user, problem=self.problem).status,
+                         JudgeStatus.ACCEPTED)
+
+    @mock.patch("problem.tasks.flush_problem_counters_task.send_with_options")
+    def test_apply_deleted_problem(self, flush_task):
+        deleted = self._event(JudgeStatus.ACCEPTED)
+        deleted["problem_id"] = self.problem.id + 1000
+        with self.captureOnCommitCallbacks(execute=True):
+            VerdictIngestion().apply([deleted, self._event(JudgeStatus.WRONG_ANSWER)])
+        # 被删除的题目的事件被丢弃，同一批中的其他事件正常处理
+        profile = self.user.userprofile
+        profile.refresh_from_db()
+        self.assertEqual(profile.submission_number, 1)
+        self.assertEqual(profile.accepted_number, 0)
+
+
+@mock.patch("problem.tasks.flush_problem_counters_task.send_with_options")
+class StatisticsRecomputerTest(SubmissionPrepare):
+    def setUp(self):
+        self._create_problem_and_submission()
+        Submission.objects.filter(id=self.submission.id).delete()
+        data = dict(DEFAULT_CONTEST_DATA, password="", start_time=timezone.now() - timedelta(hours=5),
+                    end_time=timezone.now() + timedelta(hours=1))
+        self.contest = Contest.objects.create(created_by=self.problem.created_by, **data)
+        Problem.objects.filter(id=self.problem.id).update(contest=self.contest)
+        self.problem.refresh_from_db()
+        self.user = self.create_user("user", "test123", login=False)
+        self.events = []
+
+    def _submit(self, user, result, minutes, underway=True):
+        submission = Submission.objects.create(**dict(self.submission_data, contest_id=self.contest.id,
+                                                      user_id=user.id, username=user.username, result=result))
+        Submission.objects.filter(id=submission.id) \
+            .update(create_time=self.contest.start_time + timedelta(minutes=minutes))
+        self.events.append({"submission_id": submission.id, "problem_id": self.problem.id,
+                            "contest_id": self.contest.id, "user_id": user.id, "result": result, "score": 0,
+                            "last_result": None, "contest_time": minutes * 60, "contest_underway": underway})
+
+    def test_rejudge_contest_problem(self, flush_task):
+        self._submit(self.user, JudgeStatus.WRONG_ANSWER, 10)
+        self._submit(self.user, JudgeStatus.ACCEPTED, 20)
+        # ACM 比赛中 AC 之后的提交，比赛创建者的提交和比赛开始前的提交都不计入统计
+        self._submit(self.user, JudgeStatus.WRONG_ANSWER, 30)
+        self._submit(self.problem.created_by, JudgeStatus.ACCEPTED, 40)
+        self._submit(self.user, JudgeStatus.ACCEPTED, -10, underway=False)
+        with self.captureOnCommitCallbacks(execute=True):
+            VerdictIngestion().apply(self.events)
+        ProblemCounters().flush()
+        problem = Problem.objects.get(id=self.problem.id)
+        self.assertEqual(problem.submission_number, 2)
+        self.assertEqual(problem.accepted_number, 1)
+        self.assertEqual(problem.statistic_info, {str(JudgeStatus.WRONG_ANSWER): 1, str(JudgeStatus.ACCEPTED): 1})
+
+        # 重新计算的结果与判题时逐个更新的结果相同
+        with self.captureOnCommitCallbacks(execute=True):
+            StatisticsRecomputer(Submission.objects.filter(problem_id=self.problem.id)).run()
+        recomputed = Problem.objects.get(id=self.problem.id)
+        self.assertEqual((recomputed.submission_number, recomputed.accepted_number, recomputed.statistic_info),
+                         (problem.submission_number, problem.accepted_number, problem.statistic_info))
+        self.assertEqual(UserProblemStatus.objects.get(user=self.user, problem=self.problem).status,
+                         JudgeStatus.ACCEPTED)
@@ -1,8 +1,10 @@
 from account.decorators import super_admin_required
-from judge.tasks import judge_task
+from judge.tasks import rejudge_job_task, rejudge_task
 # from judge.dispatcher import JudgeDispatcher
-from utils.api import APIView
-from ..models import Submission
+from judge.rejudge import RejudgeJobRunner
+from utils.api import APIView, validate_serializer
+from ..models import RejudgeJob, RejudgeJobStatus, Submission
+from ..serializers import CreateRejudgeJobSerializer, EditRejudgeJobSerializer, RejudgeJobSerializer
 
 
 class SubmissionRejudgeAPI(APIView):
@@ -18,5 +20,57 @@ class SubmissionRejudgeAPI(APIView):
         submission.statistic_info = {}
         submission.save()
 
-        judge_task.send(submission.id, submission.problem.id)
+        rejudge_task.send(submission.id, submission.problem.id)
         return self.success()
+
+
+class RejudgeJobAPI(APIView):
+    @super_admin_required
+    def get(self, request):
+        jobs = RejudgeJob.objects.select_related("created_by")
+        return self.success(self.paginate_data(request, jobs, RejudgeJobSerializer))
+
+    @super_admin_required
+    @validate_serializer(CreateRejudgeJobSerializer)
+    def post(self, request):
+        data = request.data
+        if not (data.get("problem_id") or data.get("contest_id") or data.get("submission_ids")):
+            return self.error("One of problem_id, contest_id and submission_ids is required")
+        job = RejudgeJob(created_by=request.user, problem_id=data.get("problem_id"),
+                         contest_id=data.get("contest_id"), submission_ids=data.get("submission_ids", []),
+                         results=data.get("results", []), rate=data["rate"])
+        job.total = RejudgeJobRunner(job).queryset().count()
+        if not job.total:
+            return self.error("No submission to rejudge")
+        job.save()
+        rejudge_job_task.send(job.id, job.generation)
+        return self.success(RejudgeJobSerializer(job).data)
+
+    @super_admin_required
+    @validate_serializer(EditRejudgeJobSerializer)
+    def put(self, request):
+        data = request.data
+        try:
+            job = RejudgeJob.objects.get(id=data["id"])
+        except RejudgeJob.DoesNotExist:
+            return self.error("Rejudge job does not exist")
+        action = data["action"]
+        if action == "pause":
+            if job.status != RejudgeJobStatus.RUNNING:
+                return self.error("Only running job can be paused")
+            job.status = RejudgeJobStatus.PAUSED
+        elif action == "resume":
+            if job.status != RejudgeJobStatus.PAUSED:
+                return self.error("Only paused job can be resumed")
+            job.status = RejudgeJobStatus.RUNNING
+        else:
+            if job.status not in (RejudgeJobStatus.RUNNING, RejudgeJobStatus.PAUSED):
+                return self.error("Job is already finishing")
+            # 已经发送的提交仍然会判完，统计需要重新计算，因此取消后先进入 FINALIZING 状态
+            job.status = RejudgeJobStatus.CANCELLED if not job.sent else RejudgeJobStatus.FINALIZING
+        # 之前的 rejudge_job_task 可能还在延迟队列中，generation 变化后它不再继续
+        job.generation += 1
+        job.save(update_fields=["status", "generation", "last_update_time"])
+        if job.status in (RejudgeJobStatus.RUNNING, RejudgeJobStatus.FINALIZING):
+            rejudge_job_task.send(job.id, job.generation)
+        return self.success(RejudgeJobSerializer(job).data)
@@ -1,8 +1,12 @@
 import ipaddress
 
+from django.db.models import Q
+
 from account.decorators import login_required, check_contest_permission
+from contest.freeze import ScoreboardFreeze
 from contest.models import ContestStatus, ContestRuleType
-from judge.tasks import judge_task
+from judge.admission import JudgeAdmission
+from judge.tasks import judge_task, contest_judge_task
 from options.options import SysOptions
 # from judge.dispatcher import JudgeDispatcher
 from problem.models import Problem, ProblemRuleType
@@ -76,6 +80,11 @@ class SubmissionAPI(APIView):
         
         if data["language"] not in problem.languages:
             return self.error(f"{data['language']} is not allowed in the problem")
+
+        # 判题队列过长或者该用户还有太多提交在等待判题时拒绝提交
+        error = JudgeAdmission().check(request.user.id, data.get("contest_id"))
+        if error:
+            return self.error(error)
         
         # Create submission WITHOUT penalty calculation (signals will handle it)
         submission = Submission.objects.create(
@@ -89,7 +98,10 @@ class SubmissionAPI(APIView):
             # Remove: anti_cheat_penalty_minutes=anti_cheat_penalty
         )
         
-        judge_task.send(submission.id, problem.id)
+        if submission.contest_id:
+            contest_judge_task.send(submission.id, problem.id)
+        else:
+            judge_task.send(submission.id, problem.id)
         
         if hide_id:
             return self.success()
@@ -195,9 +207,12 @@ class ContestSubmissionListAPI(APIView):
             submissions = submissions.filter(create_time__gte=contest.start_time)
 
         # 封榜的时候只能看到自己的提交
-        if contest.rule_type == ContestRuleType.ACM:
-            if not contest.real_time_rank and not request.user.is_contest_admin(contest):
+        if not request.user.is_contest_admin(contest):
+            if contest.rule_type == ContestRuleType.ACM and not contest.real_time_rank:
                 submissions = submissions.filter(user_id=request.user.id)
+            # 设置了封榜时间时，封榜期间其他人的提交只能看到封榜前的
+            elif ScoreboardFreeze(contest).frozen():
+                submissions = submissions.filter(Q(user_id=request.user.id) | Q(create_time__lt=contest.freeze_time))
 
         data = self.paginate_data(request, submissions)
         data["results"] = SubmissionListSerializer(data["results"], many=True, user=request.user).data
@@ -4,6 +4,7 @@ import logging
 
 from django.http import HttpResponse, QueryDict
 from django.utils.decorators import method_decorator
+from django.utils.functional import cached_property
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import View
 
@@ -40,15 +41,38 @@ class URLEncodedParser(object):
         return QueryDict(body)
 
 
+class RawJSONHttpResponse(HttpResponse):
+    """
+    内容已经是 json 字符串的响应，只有访问 data 时 (例如测试中) 才解析
+    """
+    @cached_property
+    def data(self):
+        return json.loads(self.content.decode("utf-8"))
+
+
 class JSONResponse(object):
     content_type = ContentType.json_response
 
+    @staticmethod
+    def dumps(data):
+        """
+        使用紧凑的格式，缓存的 json 字符串拼接成的响应 (raw_response) 与直接序列化的响应完全相同
+        """
+        return json.dumps(data, separators=(",", ":"))
+
     @classmethod
     def response(cls, data):
-        resp = HttpResponse(json.dumps(data, indent=4), content_type=cls.content_type)
+        resp = HttpResponse(cls.dumps(data), content_type=cls.content_type)
         resp.data = data
         return resp
 
+    @classmethod
+    def raw_response(cls, content):
+        """
+        content 是已经序列化的 json 字符串，直接作为响应的内容
+        """
+        return RawJSONHttpResponse(content, content_type=cls.content_type)
+
 
 class APIView(View):
     """
@@ -85,6 +109,12 @@ class APIView(View):
     def success(self, data=None):
         return self.response({"error": None, "data": data})
 
+    def success_raw(self, data):
+        """
+        data 是用 JSONResponse.dumps 序列化的 json 字符串，缓存的响应不需要再次序列化
+        """
+        return self.response_class.raw_response('{"error":null,"data":' + data + "}")
+
     def error(self, msg="error", err="error"):
         return self.response({"error": err, "data": msg})
 
@@ -110,12 +140,9 @@ class APIView(View):
     def server_error(self):
         return self.error(err="server-error", msg="server error")
 
-    def paginate_data(self, request, query_set, object_serializer=None):
+    def get_page_params(self, request):
         """
-        :param request: django的request
-        :param query_set: django model的query set或者其他list like objects
-        :param object_serializer: 用来序列化query set, 如果为None, 则直接对query set切片
-        :return:
+        :return: (offset, limit)
         """
         try:
             limit = int(request.GET.get("limit", "10"))
@@ -129,6 +156,16 @@ class APIView(View):
             offset = 0
         if offset < 0:
             offset = 0
+        return offset, limit
+
+    def paginate_data(self, request, query_set, object_serializer=None):
+        """
+        :param request: django的request
+        :param query_set: django model的query set或者其他list like objects
+        :param object_serializer: 用来序列化query set, 如果为None, 则直接对query set切片
+        :return:
+        """
+        offset, limit = self.get_page_params(request)
         results = query_set[offset:offset + limit]
         if object_serializer:
             count = query_set.count()
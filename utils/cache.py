@@ -25,3 +25,15 @@ class MyRedisCache(RedisCache):
 
     def __getattr__(self, item):
         return getattr(self.client, item)
+
+
+_scripts = {}
+
+
+def redis_script(source):
+    """
+    注册并缓存 lua 脚本，返回的对象可以直接调用 script(keys=[...], args=[...])
+    """
+    if source not in _scripts:
+        _scripts[source] = cache.register_script(source)
+    return _scripts[source]
@@ -21,10 +21,38 @@ class ContestRuleType(Choices):
     OI = "OI"
 
 
+class JudgePriority(Choices):
+    CONTEST = "contest"
+    PRACTICE = "practice"
+    REJUDGE = "rejudge"
+
+
 class CacheKey:
     waiting_queue = "waiting_queue"
+    waiting_queue_lock = "waiting_queue_lock"
+    async_judge_queue = "async_judge_queue"
     contest_rank_cache = "contest_rank_cache"
+    contest_rank_version = "contest_rank_version"
+    contest_scoreboard = "contest_scoreboard"
+    contest_rank_stream = "contest_rank_stream"
     website_config = "website_config"
+    languages_version = "languages_version"
+    judge_server_registry = "judge_server_registry"
+    judge_server_admin = "judge_server_admin"
+    judge_server_leases = "judge_server_leases"
+    judge_server_spj = "judge_server_spj"
+    judge_server_http_stats = "judge_server_http_stats"
+    judge_server_latency = "judge_server_latency"
+    judge_verdict_cache = "judge_verdict_cache"
+    judge_verdict_cache_stats = "judge_verdict_cache_stats"
+    verdict_events = "verdict_events"
+    verdict_ingestion_lock = "verdict_ingestion_lock"
+    verdict_ingestion_scheduled = "verdict_ingestion_scheduled"
+    problem_counters = "problem_counters"
+    problem_counters_dirty = "problem_counters_dirty"
+    problem_counters_lock = "problem_counters_lock"
+    problem_counters_scheduled = "problem_counters_scheduled"
+    rejudge_job_lock = "rejudge_job_lock"
 
 
 class Difficulty(Choices):
@@ -1,6 +1,6 @@
 from rest_framework import serializers
 
-from options.options import SysOptions
+from options.options import language_registry
 
 
 class InvalidLanguage(serializers.ValidationError):
@@ -11,7 +11,7 @@ class InvalidLanguage(serializers.ValidationError):
 class LanguageNameChoiceField(serializers.CharField):
     def to_internal_value(self, data):
         data = super().to_internal_value(data)
-        if data and data not in SysOptions.language_names:
+        if data and data not in language_registry.names:
             raise InvalidLanguage(data)
         return data
 
@@ -19,7 +19,7 @@ class LanguageNameChoiceField(serializers.CharField):
 class SPJLanguageNameChoiceField(serializers.CharField):
     def to_internal_value(self, data):
         data = super().to_internal_value(data)
-        if data and data not in SysOptions.spj_language_names:
+        if data and data not in language_registry.spj_names:
             raise InvalidLanguage(data)
         return data
 
@@ -28,7 +28,7 @@ class LanguageNameMultiChoiceField(serializers.ListField):
     def to_internal_value(self, data):
         data = super().to_internal_value(data)
         for item in data:
-            if item not in SysOptions.language_names:
+            if item not in language_registry.names:
                 raise InvalidLanguage(item)
         return data
 
@@ -37,6 +37,6 @@ class SPJLanguageNameMultiChoiceField(serializers.ListField):
     def to_internal_value(self, data):
         data = super().to_internal_value(data)
         for item in data:
-            if item not in SysOptions.spj_language_names:
+            if item not in language_registry.spj_names:
                 raise InvalidLanguage(item)
         return data